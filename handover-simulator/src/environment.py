@@ -22,14 +22,14 @@ class Environment:
         Args:
             dataframe (DataFrame): The input dataframe.
             intervals (list): List of intervals.
-            scenario (dict): The scenario configuration.
+            scenario (Scenario): The scenario configuration.
             nUes (int): Number of UEs.
             interval_duration (int): Duration of each interval.
 
         Attributes:
             dataframe (DataFrame): The input dataframe.
             intervals (list): List of intervals.
-            scenario (dict): The scenario configuration.
+            scenario (Scenario): The scenario configuration.
             interval_duration (int): Duration of each interval.
             current_interval (int): Current interval.
             timer (int): Timer.
@@ -50,9 +50,9 @@ class Environment:
         self.nUes = nUes
         self.ue_actions = [-1] * nUes  # -1 means that the UE is not connected to any gNB
         self.connections = [-1] * nUes
-        self.gnb_occupation = [0] * len(scenario["gnbs"])
-        self.gnb_occupation_agg = [0] * len(scenario["gnbs"])
-        self.saturationLevel = [NO_SATURATION] * len(scenario["gnbs"])
+        self.gnb_occupation = [0] * len(scenario.gnbs)
+        self.gnb_occupation_agg = [0] * len(scenario.gnbs)
+        self.saturationLevel = [NO_SATURATION] * len(scenario.gnbs)
         self.packetSize = packet_size
         self.simulatedSaturation = simulatedSaturation
         self.traces = []
@@ -67,11 +67,8 @@ class Environment:
                 df = get_gnb_data(i,self.dataframe[ue],self.current_interval)
                 thr = df["Throughput"]
                 aggregated_datarate += df["Throughput"]
-        gnb_datarate = next((band["GNB_Bandwidth_Hz"] for band in self.scenario["bands"] if band["Band_ID"] == self.scenario["gnbs"][i]["Band_ID"]), None) * SPECTRAL_EFFICIENCY
-        if gnb_datarate is not None:
-            return aggregated_datarate / gnb_datarate
-        else:
-            return 0
+        gnb_datarate = float(self.scenario.gnb_bandwidth[i]) * SPECTRAL_EFFICIENCY
+        return aggregated_datarate / gnb_datarate
         
         
         
@@ -80,17 +77,17 @@ class Environment:
         # take the number of UEs connected to the gNB i
         connected_users = self.ue_actions.count(i)
         # used bandwidth is the number of UEs connected to the gNB i times the user bandwidth
-        used_bandwidth = connected_users * next((band["User_Bandwidth_Hz"] for band in self.scenario["bands"] if band["Band_ID"] == self.scenario["gnbs"][i]["Band_ID"]), None)
+        used_bandwidth = connected_users * float(self.scenario.user_bandwidth[i])
         # the occupation is the used bandwidth divided by the gNB bandwidth
-        return used_bandwidth / next((band["GNB_Bandwidth_Hz"] for band in self.scenario["bands"] if band["Band_ID"] == self.scenario["gnbs"][i]["Band_ID"]), None)
+        return used_bandwidth / float(self.scenario.gnb_bandwidth[i])
     
     def calculate_bandwidth_occupation_consolidated(self, i):
         # take the number of UEs connected to the gNB i
         connected_users = self.connections.count(i)
         # used bandwidth is the number of UEs connected to the gNB i times the user bandwidth
-        used_bandwidth = connected_users * next((band["User_Bandwidth_Hz"] for band in self.scenario["bands"] if band["Band_ID"] == self.scenario["gnbs"][i]["Band_ID"]), None)
+        used_bandwidth = connected_users * float(self.scenario.user_bandwidth[i])
         # the occupation is the used bandwidth divided by the gNB bandwidth
-        return used_bandwidth / next((band["GNB_Bandwidth_Hz"] for band in self.scenario["bands"] if band["Band_ID"] == self.scenario["gnbs"][i]["Band_ID"]), None)
+        return used_bandwidth / float(self.scenario.gnb_bandwidth[i])
         
     def __get_ue_dataframe(self, ue_id, interval=-1):
         """
@@ -148,7 +145,7 @@ class Environment:
             list: The RSRP for all the gNBs in the scenario.
         """
         rsrp_list = []
-        for i in range(len(self.scenario["gnbs"])):
+        for i in range(len(self.scenario.gnbs)):
             df = get_gnb_data(i,self.dataframe[ue_id],self.current_interval)
             rsrp = df["Rsrp"]
             if rsrp == None:
@@ -242,7 +239,7 @@ class Environment:
         for i in range(len(self.ue_actions)):
             if self.ue_actions[i] != -1:
                 ue_datarate = get_gnb_data(self.ue_actions[i],self.dataframe[i],self.current_interval)["Throughput"]
-                gnb_datarate = next((band["GNB_Bandwidth_Hz"] for band in self.scenario["bands"] if band["Band_ID"] == self.scenario["gnbs"][self.ue_actions[i]]["Band_ID"]), None) *SPECTRAL_EFFICIENCY
+                gnb_datarate = float(self.scenario.gnb_bandwidth[self.ue_actions[i]]) * SPECTRAL_EFFICIENCY
                 oc_contrib = ue_datarate / gnb_datarate
                 occupation = self.calculate_datarate_occupation(self.ue_actions[i])
                 if self.consolidate_directly or occupation < 0.99 - oc_contrib:
@@ -274,7 +271,7 @@ class Environment:
         self.timer = 0
         self.ue_actions = [-1] * self.nUes
         self.connections = [-1] * self.nUes
-        self.gnb_occupation = [0] * len(self.scenario["gnbs"])
+        self.gnb_occupation = [0] * len(self.scenario.gnbs)
     
     def is_done(self):
         """
@@ -402,7 +399,7 @@ class Environment:
             
             i += 1
         for ue in range(len(self.connections)):
-            self.traces[ue] = pd.DataFrame(self.traces[ue])
+            self.traces[ue] = compact_results(self.traces[ue])
             # add GNodeB column
         return self.traces
 
@@ -12,14 +12,18 @@ import json
 import logging
 import logging.config
 import yaml
-from simulator_gti_dqn import simulate_gti_dqn_handover
-import matplotlib.pyplot as plt
-import tensorflow as tf
 
 from utils import *
+from trace_cube import load_trace_cube
+from trace_stream import StreamingTraceCube
+from trace_store import TraceStore
+from run_cache import RunCache, RUN_CACHE_FOLDER_NAME, file_digest
 from simulator_3gpp import simulate_3gpp_handover
 from simulator_3gpp_rel16 import simulate_3gpp_cho_handover
-from simulator_sbgh import simulate_ideal_sbgh_handover, simulate_sbgh_handover
+from scheduler import ALGORITHMS, run_algorithms
+from simulator_common import create_worker_pool
+from scoring import calculate_score_tensor
+from occupation import QUEUE_MODELS, get_queue_model
 
 import warnings
 warnings.filterwarnings("ignore")
@@ -52,11 +56,11 @@ def build_simulation():
     process.wait()
 
 
-import matplotlib.pyplot as plt
 import pandas as pd
 import os
 
 def plot_rsrp(simDataframes, nUEs, nGnb, traces_sim_folder):
+    import matplotlib.pyplot as plt
     # Assuming simDataframes is a list of pandas DataFrames where each DataFrame represents the simulation data for a UE
     for j in range(nUEs):
         plt.figure(figsize=(10, 6))
@@ -88,6 +92,7 @@ def plot_rsrp(simDataframes, nUEs, nGnb, traces_sim_folder):
 
 
 def plot_throughput(simDataframes, nUEs, nGnb, traces_sim_folder):
+    import matplotlib.pyplot as plt
     # Assuming simDataframes is a list of pandas DataFrames where each DataFrame represents the simulation data for a gNB
     for j in range(nUEs):
         plt.figure()
@@ -145,11 +150,22 @@ def run_simulation(index):
         f"--tolerance={tolerance}",
         f"--speed={speed}",
         f"--trayectoryTime={trayectoryTime}",
+        f"--traceFormat={traceFormat}",
         ]
     if wp is not None:
         print(f"Using waypoints file: {wp}")
         command.append(f"--wp={wp}")
 
+    if runCache is not None:
+        runKey = runCache.key(command)
+        if runCache.lookup(runKey, traces_folder):
+            logging.info(f"Reusing the cached ns-3 run {runKey} for UE {ue} and gNodeB {selectedGnb}")
+            processes_state[ue][selectedGnb] = {
+                "t": 0,
+                "p": "100"
+                }
+            return
+
     print(command)
     time.sleep(10)
     try:
@@ -185,6 +201,8 @@ def run_simulation(index):
                     "t": time_elapsed,
                     "p": "100"
                     }
+        if runCache is not None:
+            runCache.store(runKey, traces_folder, command)
 
 
 
@@ -217,6 +235,11 @@ if __name__ == "__main__":
     default_trayectoryTime = 5.0  # Default time for the trajectory in seconds
     default_alpha = 5000.0  # Default alpha parameter for the scoring function
     default_beta = 1000.0  # Default beta parameter for the scoring function
+    default_traceFormat = "csv"  # Default trace output format of the ns-3 simulations
+    default_a3Engine = "scalar"  # Default engine of the 3GPP A3 handover simulation
+    default_choEngine = "scalar"  # Default engine of the 3GPP Rel-16 CHO handover simulation
+    default_memoryBudget = 1024  # Default memory budget in MB of the traces paged in by the per UE algorithms
+    default_queueModel = ["md1"]  # Default queue model of the gNBs
     # Definition of the penalty dictionary to simulate the penalty for the handover
     penalty_dict = {}
     penalty_dict["Latency"] = 0.020 
@@ -250,6 +273,15 @@ if __name__ == "__main__":
     parser.add_argument("--alpha", type=float, default=default_alpha, help="Alpha parameter for the scoring function")
     parser.add_argument("--beta", type=float, default=default_beta, help="Beta parameter for the scoring function")
     parser.add_argument("--wp", type=str,  default=default_wpFile, help="Path to the waypoints file")
+    parser.add_argument("--stream", action="store_true", help="Evaluate the 3GPP A3 and CHO algorithms while the ns-3 simulations are running, each UE as soon as the traces of all its gNBs are complete")
+    parser.add_argument("--a3Engine", choices=["scalar", "batched"], default=default_a3Engine, help="Engine of the 3GPP A3 handover: scalar (one loop per UE, the reference) or batched (all the UEs advance together with array operations)")
+    parser.add_argument("--choEngine", choices=["scalar", "batched"], default=default_choEngine, help="Engine of the 3GPP Rel-16 CHO handover: scalar (one loop per UE, the reference) or batched (all the UEs advance together with array operations)")
+    parser.add_argument("--algorithms", nargs="+", choices=list(ALGORITHMS), default=list(ALGORITHMS), help="Handover algorithms to run, in parallel")
+    parser.add_argument("--memoryBudget", type=float, default=default_memoryBudget, help="Memory budget in MB of the UE traces kept in memory by the 3GPP A3 and CHO algorithms, 0 for no limit")
+    parser.add_argument("--noRunCache", action="store_true", help="Always launch the ns-3 simulations, instead of reusing the traces of previous runs with the same ns-3 parameters, scenario and waypoints")
+    parser.add_argument("--queueModel", nargs="+", choices=list(QUEUE_MODELS), default=default_queueModel, help="Queue model of the gNBs: md1, mm1 or mg1 (with --serviceCv). With several models the results of every model are written to a subfolder of the algorithm named after the model")
+    parser.add_argument("--serviceCv", type=float, default=None, help="Coefficient of variation of the service time of the mg1 queue model")
+    parser.add_argument("--traceFormat", choices=["csv", "bin"], default=default_traceFormat, help="Trace output format of the ns-3 simulations: csv or bin (fixed size binary records)")
     args = parser.parse_args()
 
     # Load configuration from YAML file if provided
@@ -283,6 +315,19 @@ if __name__ == "__main__":
     packetSize = args.packetSize
     alpha = args.alpha
     beta = args.beta
+    traceFormat = args.traceFormat
+    memoryBudget = int(args.memoryBudget * 1e6) if args.memoryBudget > 0 else None
+    stream = args.stream
+    a3Engine = args.a3Engine
+    choEngine = args.choEngine
+    selectedAlgorithms = args.algorithms
+    queueModelNames = [args.queueModel] if isinstance(args.queueModel, str) else args.queueModel
+    try:
+        queueModels = [get_queue_model(name, args.serviceCv) for name in queueModelNames]
+    except ValueError as error:
+        parser.error(str(error))
+    queueModel = queueModels[0] if len(queueModels) == 1 else queueModels
+    wp = None
     if args.wp:
         wp = os.path.abspath(args.wp)
     
@@ -292,25 +337,14 @@ if __name__ == "__main__":
     scenario = parse_scenario_file(sc)
     
     
-    nGnb = len(scenario["gnbs"])
+    nGnb = len(scenario.gnbs)
     
     # Crear lista de FR1/FR2 por cada gNB según su Band_ID
-    scenario_bands = scenario['bands']
-    bands = []
-    for gnb in scenario['gnbs']:
-        gnb_band_id = gnb['Band_ID']
-        # Buscar la banda correspondiente en el escenario
-        band_info = scenario_bands[gnb_band_id]
-        central_freq_ghz = band_info['Central_Frequency_Hz'] / 1e9
-        
-        # Clasificar como FR1 o FR2
-        if 0.41 <= central_freq_ghz <= 7.125:
-            bands.append('FR1')
-        elif 24.25 <= central_freq_ghz <= 52.6:
-            bands.append('FR2')
-        else:
-            bands.append('Unknown')
+    bands = scenario_bands(scenario)
     
+    traceStream = None
+    # The worker pool of the algorithms, created before the simulations when they stream
+    pool = None
     if not args.trace:
         
         for iUe in range(nUEs):
@@ -357,7 +391,31 @@ if __name__ == "__main__":
             except:
                     print('Failed to create {}'.format(traces_sim_folder))
         build_simulation()
-        
+
+        runCache = None
+        if not args.noRunCache:
+            # The traces of the ns-3 simulations only depend on their arguments and input files, so the runs
+            # with the same ones are reused, also across the invocations that only change handover parameters
+            runCache = RunCache(os.path.join(traces_dir, RUN_CACHE_FOLDER_NAME), {
+                "sc": file_digest(sc),
+                "wp": file_digest(wp),
+                "ns3": file_digest(ns3_simulation_exec),
+                })
+
+        if stream:
+            # The per UE stage of the interval-causal algorithms runs on the traces as they are written,
+            # each UE is evaluated as soon as the ns-3 simulations of all its gNBs finish
+            traceStream = StreamingTraceCube(traces_sim_folder, nUEs, nGnb)
+            os.makedirs(os.path.join(traces_sim_folder, "results"), exist_ok=True)
+            # The pool is forked before any thread starts, the workers open the trace cache once it exists
+            pool = create_worker_pool()
+            streamExecutor = ThreadPoolExecutor(max_workers=2)
+            streamFutures = []
+            if "a3" in selectedAlgorithms:
+                streamFutures.append(streamExecutor.submit(simulate_3gpp_handover, nUEs, debug, traces_sim_folder, nGnb, Hys, A3Offset, NrMeasureInt, interval, DECISION_PARAMETER, timeToTrigger, HOInterval, None, None, scenario, packetSize, penalty_dict, traceStream=traceStream, engine=a3Engine, pool=pool, queueModel=queueModel))
+            if "cho" in selectedAlgorithms:
+                streamFutures.append(streamExecutor.submit(simulate_3gpp_cho_handover, nUEs, debug, traces_sim_folder, nGnb, Hys, A3Offset, NrMeasureInt, interval, DECISION_PARAMETER, timeToTrigger, HOInterval, None, None, scenario, packetSize, penalty_dict, bands, traceStream=traceStream, engine=choEngine, pool=pool, queueModel=queueModel))
+
         executor = ThreadPoolExecutor(max_workers=cpu_threads_count)
         processes = []
                 
@@ -365,15 +423,19 @@ if __name__ == "__main__":
         for iUe in range(nUEs):
             for ignb in range(nGnb):
                     process = executor.submit(run_simulation, iUe*nGnb+ignb)
+                    if traceStream is not None:
+                        process.add_done_callback(lambda _, ue=iUe, gnb=ignb: traceStream.mark_done(ue, gnb))
                     processes.append(process)
         while any(not process.done() for process in processes):
+            if traceStream is not None:
+                traceStream.poll()
             
             print("Number of CPU threads:", cpu_threads_count)
             # Print the simulation parameters
             
             print("Simulation Parameters:")
             # Print scenario dimensions
-            scenario_dimensions = scenario['scenario_dimensions']
+            scenario_dimensions = scenario.scenario_dimensions
             print("Scenario Dimensions:")
             print(f"  - Min X: {scenario_dimensions['min_x']}")
             print(f"  - Min Y: {scenario_dimensions['min_y']}")
@@ -381,7 +443,7 @@ if __name__ == "__main__":
             print(f"  - Max Y: {scenario_dimensions['max_y']}")
             
             # Mostrar información de las bandas del escenario
-            for i, band in enumerate(scenario['bands'], 1):
+            for i, band in enumerate(scenario.bands, 1):
                 central_freq_hz = band['Central_Frequency_Hz']
                 central_freq_ghz = central_freq_hz / 1e9
                 
@@ -420,6 +482,12 @@ if __name__ == "__main__":
             clear_terminal()
         executor.shutdown(wait=True)
         print("NS3 simulations finished")
+        if traceStream is not None:
+            for future in streamFutures:
+                future.result()
+            streamExecutor.shutdown()
+            # The streamed traces become the trace cache, they are not parsed again below
+            traceStream.save_cache(interval)
         parameters = {
             "debug": args.logging,
             "simTime": args.simTime,
@@ -435,6 +503,7 @@ if __name__ == "__main__":
             "packetSize": args.packetSize,
             "bitRate": args.bitRate,
             "timeToTrigger": args.ttt,
+            "HOInterval": args.HOInterval,
             "speed": args.speed,
             "trayectoryTime": args.trayectoryTime,
             
@@ -465,31 +534,41 @@ if __name__ == "__main__":
         
         #timeToTrigger = parameters["timeToTrigger"]
     
-    simDataframes = load_dataframes(traces_sim_folder, nUEs, nGnb)
-    intervals = simDataframes[0][0]['Time'].unique()
-    # Calculate the packets send and received by the UEs in the interval
-    # as the traces extracted from the simulation are aggregated
-    for user in range(nUEs):
-        for gnb in range(nGnb):
-            simDataframes[user][gnb]['TxPacketsDiff'] = simDataframes[user][gnb]['TxPackets'].diff()
-            simDataframes[user][gnb]['TxBytesDiff'] = simDataframes[user][gnb]['TxBytes'].diff()
-            simDataframes[user][gnb]['RxPacketsDiff'] = simDataframes[user][gnb]['RxPackets'].diff()
-            simDataframes[user][gnb]['RxBytesDiff'] = simDataframes[user][gnb]['RxBytes'].diff()
-            simDataframes[user][gnb]['LostPacketsDiff'] = simDataframes[user][gnb]['LostPackets'].diff()
-            # for the first interval the difference is the same as the value, by default .diff() returns NaN
-            simDataframes[user][gnb].loc[0, 'TxPacketsDiff'] = simDataframes[user][gnb].loc[0, 'TxPackets']
-            simDataframes[user][gnb].loc[0, 'TxBytesDiff'] = simDataframes[user][gnb].loc[0, 'TxBytes']
-            simDataframes[user][gnb].loc[0, 'RxPacketsDiff'] = simDataframes[user][gnb].loc[0, 'RxPackets']
-            simDataframes[user][gnb].loc[0, 'RxBytesDiff'] = simDataframes[user][gnb].loc[0, 'RxBytes']
-            simDataframes[user][gnb].loc[0, 'LostPacketsDiff'] = simDataframes[user][gnb].loc[0, 'LostPackets']
-            # calculate the throughput
-            simDataframes[user][gnb]['Throughput'] = (simDataframes[user][gnb]['RxBytesDiff'] * 8) / interval
-
-    #plot all the throughput for each user
-    #plot_throughput(simDataframes, nUEs, nGnb, traces_sim_folder)
-    #plot_rsrp(simDataframes, nUEs, nGnb, traces_sim_folder)
-    simulate_3gpp_handover(nUEs, debug, traces_sim_folder, nGnb, Hys, A3Offset, NrMeasureInt, interval, DECISION_PARAMETER, timeToTrigger, HOInterval, intervals, simDataframes, scenario, packetSize, penalty_dict)
-    simulate_3gpp_cho_handover(nUEs, debug, traces_sim_folder, nGnb, Hys, A3Offset, NrMeasureInt, interval, DECISION_PARAMETER, timeToTrigger, HOInterval, intervals, simDataframes, scenario, packetSize, penalty_dict, bands)
-    simulate_sbgh_handover(nUEs,debug,traces_sim_folder, nGnb, interval ,simDataframes ,intervals ,scenario, packetSize, alpha, beta, penalty_dict, HOInterval)
-    simulate_ideal_sbgh_handover(nUEs,debug,traces_sim_folder, nGnb, interval ,simDataframes ,intervals ,scenario, packetSize, alpha, beta, penalty_dict, HOInterval)
-    simulate_gti_dqn_handover(nUEs,debug,traces_sim_folder, nGnb, interval ,simDataframes ,intervals ,scenario, packetSize,penalty_dict, HOInterval)
+    # Load the traces through the on-disk trace cube cache, a replay never re-parses the CSVs.
+    # The packets and bytes sent and received in each interval and the throughput are
+    # computed by the loader, as the traces extracted from the simulation are aggregated
+    traceCube = load_trace_cube(traces_sim_folder, nUEs, nGnb, interval)
+    # Every trace is aligned on the same interval grid, the simulators address them by tick
+    intervals = traceCube.times
+
+    # The selected algorithms run in parallel on one worker pool
+    algorithms = {}
+    # The streamed UEs were aligned on the grid of the first UE. If the traces of the other UEs report
+    # other times, A3 and CHO run again on the grid of all the traces, the one of a --trace replay
+    streamed = traceStream is not None and traceStream.matches_grid(intervals)
+    if traceStream is not None and traceStream.times is not None and not streamed:
+        logging.warning("The traces of the UEs do not share the time grid of the first UE, A3 and CHO are run again")
+    if not streamed:
+        # The per UE algorithms page the UEs in from the memory-mapped cube, under the memory budget.
+        # A3 and CHO run in threads of this process, each has its own store
+        algorithms["a3"] = ((nUEs, debug, traces_sim_folder, nGnb, Hys, A3Offset, NrMeasureInt, interval, DECISION_PARAMETER, timeToTrigger, HOInterval, intervals, TraceStore(traceCube, memoryBudget), scenario, packetSize, penalty_dict), {"engine": a3Engine, "queueModel": queueModel})
+        algorithms["cho"] = ((nUEs, debug, traces_sim_folder, nGnb, Hys, A3Offset, NrMeasureInt, interval, DECISION_PARAMETER, timeToTrigger, HOInterval, intervals, TraceStore(traceCube, memoryBudget), scenario, packetSize, penalty_dict, bands), {"engine": choEngine, "queueModel": queueModel})
+
+    # SBGH and MA-DDQN evaluate all the UEs in every interval, they use the whole set of traces. The
+    # store is sent to their pool task as the handle of the trace cache and keeps every UE it builds
+    if any(name in selectedAlgorithms for name in ("sbgh", "ideal-sbgh", "dqn")):
+        simDataframes = TraceStore(traceCube)
+        #plot all the throughput for each user
+        #plot_throughput(simDataframes, nUEs, nGnb, traces_sim_folder)
+        #plot_rsrp(simDataframes, nUEs, nGnb, traces_sim_folder)
+        # SBGH and ideal-SBGH share the scores of every connection, computed once before they start
+        scoreTensor = None
+        if any(name in selectedAlgorithms for name in ("sbgh", "ideal-sbgh")):
+            scoreTensor = calculate_score_tensor(traceCube.column("Rsrp"), scenario, alpha, beta)
+        algorithms["sbgh"] = ((nUEs,debug,traces_sim_folder, nGnb, interval ,simDataframes ,intervals ,scenario, packetSize, alpha, beta, penalty_dict, HOInterval), {"scoreTensor": scoreTensor, "queueModel": queueModel})
+        algorithms["ideal-sbgh"] = ((nUEs,debug,traces_sim_folder, nGnb, interval ,simDataframes ,intervals ,scenario, packetSize, alpha, beta, penalty_dict, HOInterval), {"scoreTensor": scoreTensor, "queueModel": queueModel})
+        algorithms["dqn"] = ((nUEs,debug,traces_sim_folder, nGnb, interval ,simDataframes ,intervals ,scenario, packetSize,penalty_dict, HOInterval), {"queueModel": queueModel})
+    # The algorithms create their own folders in parallel, the shared results folder is created first
+    os.makedirs(os.path.join(traces_sim_folder, "results"), exist_ok=True)
+    with pool if pool is not None else create_worker_pool(traceCube) as pool:
+        run_algorithms({name: algorithms[name] for name in selectedAlgorithms if name in algorithms}, pool)
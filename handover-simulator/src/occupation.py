@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 # encoding: UTF-8
+import abc
 import math
+import numpy as np
 
 
 def calculate_occupation(gnb_capacity=float, gnb_traffic=float):
@@ -130,3 +132,149 @@ def apply_channel_simulation(interval_data=None, occupation=float, gnb_capacity=
     interval_data["PLostPackets"] = interval_data["LostPackets"] / (rx_packets_diff + interval_data["LostPackets"]) if rx_packets_diff + interval_data["LostPackets"] != 0 else 0
 
     return interval_data
+
+
+class QueueModel(abc.ABC):
+    """Queue model of a gNB: the average time a packet spends in the system at a given occupation.
+
+    The models work on numbers and on NumPy arrays alike, see calculate_system_waiting_time_array.
+    name is the name of the model in the logs and the results folders.
+    """
+
+    name = None
+
+    @abc.abstractmethod
+    def waiting_time(self, serving_rate, occupation):
+        """Average system waiting time in s.
+
+        - serving_rate in packets per second
+        - occupation, below 1
+
+        returns average_system_waiting_time in s
+        """
+
+
+class MG1Queue(QueueModel):
+    """M/G/1 queue: Poisson arrivals and a general service time, with the Pollaczek-Khinchine formula.
+
+    - service_cv: coefficient of variation of the service time, 0 for a constant packet length (M/D/1)
+      and 1 for exponential packet lengths (M/M/1)
+    """
+
+    def __init__(self, service_cv, name=None):
+        if service_cv < 0:
+            raise ValueError(f"The coefficient of variation of the service time cannot be negative, got {service_cv}")
+        self.service_cv = service_cv
+        self.name = name or f"mg1-cv{service_cv:g}"
+
+    def waiting_time(self, serving_rate, occupation):
+        service_cv2 = self.service_cv ** 2
+        return 1.0 / serving_rate + (occupation * (1 + service_cv2) / (2.0 * serving_rate * (1 - occupation)))
+
+
+MD1_QUEUE = MG1Queue(0.0, "md1")
+MM1_QUEUE = MG1Queue(1.0, "mm1")
+# Queue models by name, the M/G/1 model is built for the coefficient of variation of its service time
+QUEUE_MODELS = {"md1": MD1_QUEUE, "mm1": MM1_QUEUE, "mg1": MG1Queue}
+
+
+def get_queue_model(name, service_cv=None):
+    """The queue model of a name of QUEUE_MODELS.
+
+    - name: md1, mm1 or mg1
+    - service_cv: coefficient of variation of the service time of the M/G/1 model
+
+    returns a QueueModel, raises ValueError if the name is unknown or mg1 is given no service_cv
+    """
+    if name not in QUEUE_MODELS:
+        raise ValueError(f"Unknown queue model {name}, expected one of {list(QUEUE_MODELS)}")
+    if name != "mg1":
+        return QUEUE_MODELS[name]
+    if service_cv is None:
+        raise ValueError("The mg1 queue model needs the coefficient of variation of the service time")
+    return MG1Queue(service_cv)
+
+
+def calculate_system_waiting_time_array(gnb_capacity, occupation, packet_length, queue_model=MD1_QUEUE):
+    """ Array version of calculate_system_waiting_time, for the occupations of many gNBs or intervals at once.
+
+    - gnb_capacity in bps, a number or an array broadcast with occupation
+    - occupation, an array
+    - packet_length in bytes
+    - queue_model: a QueueModel, or a list of them to evaluate side by side
+
+    returns average_system_waiting_time in s, with a leading axis per model if queue_model is a list
+    """
+    serving_rate = np.asarray(gnb_capacity) / (packet_length * 8) # In packets per second
+    # The occupation of an unstable gNB is clamped below 1, as in calculate_system_waiting_time
+    occupation = np.where(np.asarray(occupation) < 1, occupation, 1-1e-5)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if isinstance(queue_model, (list, tuple)):
+            return np.stack([model.waiting_time(serving_rate, occupation) for model in queue_model])
+        return queue_model.waiting_time(serving_rate, occupation)
+
+
+def calculate_throughput_array(occupation, user_throughput):
+    """ Array version of calculate_throughput.
+
+    - occupation, an array
+    - user_throughput in bps, an array broadcast with occupation
+
+    returns throughput in bps
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(np.asarray(occupation) < 1, user_throughput, user_throughput * (1/occupation))
+
+
+def calculate_lost_packets_array(occupation, rx_packets_diff, channel_packets_lost=0.0):
+    """ Array version of calculate_lost_packets.
+
+    - occupation, an array
+    - rx_packets_diff, an array broadcast with occupation
+    - channel_packets_lost, a number or an array
+
+    returns lost_packets, floats
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        occupation_lost_packets = np.where(np.asarray(occupation) < 1, 0, np.ceil(rx_packets_diff * (1-(1/ occupation))))
+    return occupation_lost_packets + channel_packets_lost
+
+
+def apply_channel_simulation_array(interval_data, occupation, gnb_capacity, packet_length, queue_model=MD1_QUEUE):
+    """Array version of apply_channel_simulation, for the intervals of many gNBs or UEs at once.
+
+    - interval_data: dict with the Throughput, Latency, RxPacketsDiff, RxBytesDiff and LostPackets arrays
+    - occupation, an array
+    - gnb_capacity in bps, a number or an array
+    - packet_length in bytes
+    - queue_model: a QueueModel, or a list of them to evaluate side by side
+
+    returns a dict with the Throughput, Latency, RxPacketsDiff, RxBytesDiff, LostPackets, SimLatency and
+    PLostPackets arrays after the channel simulation, all with a leading axis per model if queue_model is
+    a list. The packet counters keep their type.
+    """
+    if isinstance(queue_model, (list, tuple)):
+        results = [apply_channel_simulation_array(interval_data, occupation, gnb_capacity, packet_length, model)
+                   for model in queue_model]
+        return {name: np.stack([result[name] for result in results]) for name in results[0]}
+    average_system_waiting_time = calculate_system_waiting_time_array(gnb_capacity, occupation, packet_length, queue_model)
+    latency = calculate_latency(average_system_waiting_time, interval_data["Latency"])
+    throughput = calculate_throughput_array(occupation, interval_data["Throughput"])
+    rx_packets_diff = np.asarray(interval_data["RxPacketsDiff"])
+    lost_packets_sim = np.minimum(calculate_lost_packets_array(occupation, rx_packets_diff, 0),
+                                  rx_packets_diff).astype(rx_packets_diff.dtype)
+    rx_packets_diff = rx_packets_diff - lost_packets_sim
+    rx_bytes_diff = interval_data["RxBytesDiff"] - lost_packets_sim * packet_length
+    lost_packets = lost_packets_sim + interval_data["LostPackets"]
+    received = rx_packets_diff + lost_packets
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p_lost_packets = np.where(received != 0, lost_packets / received, 0)
+    return {
+        "Throughput": throughput,
+        "Latency": latency,
+        "RxPacketsDiff": rx_packets_diff,
+        "RxBytesDiff": rx_bytes_diff,
+        "LostPackets": lost_packets,
+        "SimLatency": average_system_waiting_time,
+        "PLostPackets": p_lost_packets,
+    }
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+# Post-processing shared by all the handover algorithms: from the per UE results of the connected
+# gNBs, or the serving-gNB matrix of an algorithm, it builds the gNB, restricted UE and scenario
+# metrics and the score of the algorithm, and writes them to the results folder. The algorithms only
+# differ in how the gNB metrics of every interval are aggregated into the scenario metrics, see the
+# SCENARIO_* aggregations.
+import os
+import logging
+import numpy as np
+import pandas as pd
+
+from occupation import MD1_QUEUE
+from scoring import calculate_algorithm_score
+from simulator_common import UE_SUM_COLUMNS, simulate_gnbs, simulate_users_restricted, stack_ue_results
+from simulator_3gpp_batched import ROW_COLUMNS, stack_columns, gather_results, batch_size, batch_traces
+
+# Aggregations of the gNB metrics into the scenario metrics. "metrics" is the operation applied to
+# every metric over the gNBs. The 3GPP algorithms aggregate every interval on its own; the others
+# group the metrics by Time, which keeps the integer gNB columns, and add the mean throughput per gNB.
+# The latency of DDQN is weighted by the throughput of every gNB. The score is written as a float or,
+# with integerScore, truncated to an integer.
+SCENARIO_3GPP = {
+    "metrics": {"Throughput": "sum", "TxPacketsAcc": "sum", "TxBytesAcc": "sum", "TxBytesDiff": "sum",
+                "TxPacketsDiff": "sum", "RxBytesAcc": "sum", "RxPacketsAcc": "sum", "RxBytesDiff": "sum",
+                "RxPacketsDiff": "sum", "Latency": "mean", "Jitter": "mean", "LostPackets": "sum",
+                "ConnectedUEs": "sum", "MeanThroughput": "mean", "PLostPackets": "mean", "Handovers": "mean"},
+    "groupByTime": False,
+    "weightedLatency": False,
+    "integerScore": False,
+}
+SCENARIO_SBGH = {
+    "metrics": {"Throughput": "sum", "TxPacketsAcc": "sum", "TxBytesAcc": "sum", "TxBytesDiff": "sum",
+                "TxPacketsDiff": "sum", "RxPacketsAcc": "sum", "RxBytesAcc": "sum", "RxBytesDiff": "sum",
+                "RxPacketsDiff": "sum", "Latency": "mean", "Jitter": "mean", "LostPackets": "sum",
+                "ConnectedUEs": "sum", "Occupation": "mean", "PLostPackets": "mean", "Handovers": "sum"},
+    "groupByTime": True,
+    "weightedLatency": False,
+    "integerScore": True,
+}
+SCENARIO_IDEAL_SBGH = {
+    "metrics": {name: operation for name, operation in SCENARIO_SBGH["metrics"].items() if name != "Handovers"},
+    "groupByTime": True,
+    "weightedLatency": False,
+    "integerScore": True,
+}
+SCENARIO_DQN = {
+    "metrics": {"Throughput": "sum", "TxPacketsAcc": "sum", "TxBytesAcc": "sum", "TxBytesDiff": "sum",
+                "TxPacketsDiff": "sum", "Latency": "mean", "RxPacketsAcc": "sum", "RxBytesAcc": "sum",
+                "RxBytesDiff": "sum", "RxPacketsDiff": "sum", "Jitter": "mean", "LostPackets": "sum",
+                "ConnectedUEs": "sum", "Occupation": "mean", "PLostPackets": "mean"},
+    "groupByTime": True,
+    "weightedLatency": True,
+    "integerScore": True,
+}
+# Trace columns of the serving gNB the gNB metrics are computed from, and their result names
+SERVED_COLUMNS = {name: result_name for name, result_name in ROW_COLUMNS.items()
+                  if result_name in ["Throughput", "Latency", "Jitter"] + UE_SUM_COLUMNS}
+
+
+def stack_gnb_metric(gnbResults_list, name, nIntervals):
+    """Stack a metric of every gNB into a [gNB, interval] array.
+
+    Args:
+        gnbResults_list (list): The results of every gNB as DataFrames, see simulate_gnbs.
+        name (str): The metric.
+        nIntervals (int): The number of intervals.
+
+    Returns:
+        tuple: The float64 [gNB, interval] array, NaN where a gNB has no value, and whether the metric
+            is an integer column of every gNB.
+    """
+    values = np.full((len(gnbResults_list), nIntervals), np.nan)
+    integer = len(gnbResults_list) > 0
+    for g, gnbResults in enumerate(gnbResults_list):
+        if name in gnbResults.columns:
+            values[g] = gnbResults[name].to_numpy(dtype=np.float64)
+            integer &= pd.api.types.is_integer_dtype(gnbResults[name])
+        else:
+            integer = False
+    return values, integer
+
+
+def aggregate_scenario(gnbResults_list, intervals, aggregation):
+    """Aggregate the gNB metrics of every interval into the scenario metrics.
+
+    All the gNB metrics are stacked into [gNB, interval] arrays and every scenario metric is a
+    reduction over the gNB axis, the sums and means skip the gNBs without a value. Without groupByTime
+    every metric is a float. With groupByTime the sums of integer columns stay integers, Time is the
+    index and the mean throughput of the gNBs is added.
+
+    Args:
+        gnbResults_list (list): The results of every gNB as DataFrames, see simulate_gnbs.
+        intervals (list): A list of intervals.
+        aggregation (dict): The aggregation of the scenario metrics, one of the SCENARIO_* dicts.
+
+    Returns:
+        DataFrame: The scenario metrics, one row per interval.
+    """
+    nGnbs, nIntervals = len(gnbResults_list), len(intervals)
+    scenarioColumns = {}
+    if aggregation["weightedLatency"]:
+        throughput, _ = stack_gnb_metric(gnbResults_list, "Throughput", nIntervals)
+    for name, operation in aggregation["metrics"].items():
+        values, integer = stack_gnb_metric(gnbResults_list, name, nIntervals)
+        if aggregation["groupByTime"] and integer and operation == "sum":
+            scenarioColumns[name] = np.stack([gnbResults[name].to_numpy(dtype=np.int64) for gnbResults in gnbResults_list]).sum(axis=0)
+            continue
+        if name == "Latency" and aggregation["weightedLatency"]:
+            values = values * throughput
+        valid = ~np.isnan(values)
+        total = np.sum(values, axis=0, where=valid)
+        if operation == "sum":
+            scenarioColumns[name] = total
+        else:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                scenarioColumns[name] = total / valid.sum(axis=0)
+    if not aggregation["groupByTime"]:
+        return pd.DataFrame({"Time": np.asarray(intervals, dtype=np.float64), **scenarioColumns})
+    scenarioResults = pd.DataFrame(scenarioColumns, index=pd.Index(gnbResults_list[0]["Time"].to_numpy(), name="Time"))
+    if aggregation["weightedLatency"]:
+        scenarioResults["Latency"] = scenarioResults["Latency"] / scenarioResults["Throughput"]
+    scenarioResults["MeanThroughput"] = scenarioResults["Throughput"] / nGnbs
+    return scenarioResults
+
+
+def serving_results(serving, traces, intervals):
+    """Results of the UEs of a [UE, interval] serving-gNB matrix.
+
+    The results of every interval are the trace row of the serving gNB at that tick, with no handover
+    penalty, and a handover is a change of the serving gNB once the UE is connected. The UEs are read
+    in batches, see simulator_3gpp_batched.batch_size.
+
+    Args:
+        serving (ndarray): The serving gNB of every UE and interval, NO_GNB while the UE is not connected.
+        traces (list): The dataframes of every UE, indexed by UE and gNB, or a TraceStore.
+        intervals (list): A list of intervals.
+
+    Returns:
+        tuple: The results of every UE as DataFrames, indexed by UE, and the UE results the gNB metrics
+            are computed from, see simulator_common.stack_ue_results.
+    """
+    serving = np.asarray(serving, dtype=np.int64)
+    nUEs, nIntervals = serving.shape
+    connected = serving >= 0
+    ticks = np.where(connected, np.arange(nIntervals), -1)
+    changes = (serving[:, 1:] != serving[:, :-1]) & connected[:, :-1]
+    handovers = np.concatenate([np.zeros((nUEs, 1), dtype=np.int64), np.cumsum(changes, axis=1)], axis=1)
+    ueResults = []
+    ue_columns = {name: [] for name in SERVED_COLUMNS.values()}
+    batchSize = batch_size(traces)
+    for start in range(0, nUEs, batchSize):
+        rows = slice(start, min(start + batchSize, nUEs))
+        columns = stack_columns(batch_traces(traces, range(rows.start, rows.stop)))
+        ueResults.extend(gather_results(columns, intervals, serving[rows], serving[rows], ticks[rows], handovers[rows]))
+        batch = np.arange(rows.stop - rows.start)[:, None]
+        for name, result_name in SERVED_COLUMNS.items():
+            values = columns[name][batch, np.maximum(serving[rows], 0), np.arange(nIntervals)]
+            ue_columns[result_name].append(np.where(connected[rows], values, 0))
+    ue_columns = {name: np.concatenate(values) for name, values in ue_columns.items()}
+    ue_columns["GNodeB"] = serving
+    return ueResults, ue_columns
+
+
+def save_model_results(results_folder, gnbResults_list, restricted_results, intervals, aggregation):
+    """Save the gnb and ue-restricted results, scenario.csv and scenario-score.txt of a queue model.
+
+    Args:
+        results_folder (str): The folder of the results of the queue model.
+        gnbResults_list (list): The results of every gNB as DataFrames, see simulate_gnbs.
+        restricted_results (list): The restricted results of every UE as DataFrames, see simulate_users_restricted.
+        intervals (list): A list of intervals.
+        aggregation (dict): The aggregation of the scenario metrics, one of the SCENARIO_* dicts.
+
+    Returns:
+        float: The score of the algorithm with the queue model.
+    """
+    for folder in ["gnb", "ue-restricted"]:
+        os.makedirs(os.path.join(results_folder, folder), exist_ok=True)
+    for gnb, results in enumerate(gnbResults_list):
+        results.to_csv(os.path.join(results_folder, "gnb", f"GNB-{gnb}.csv"), index=False)
+    for ue, results in enumerate(restricted_results):
+        results.to_csv(os.path.join(results_folder, "ue-restricted", f"UE-{ue}.csv"), index=False)
+
+    scenarioResults = aggregate_scenario(gnbResults_list, intervals, aggregation)
+    scenarioResults.to_csv(os.path.join(results_folder, "scenario.csv"), index=aggregation["groupByTime"])
+    score = calculate_algorithm_score(scenarioResults)
+    logging.info(f"Scenario Score: {score}")
+    with open(os.path.join(results_folder, "scenario-score.txt"), "w") as file:
+        file.write(str(int(score)) if aggregation["integerScore"] else str(score))
+    return score
+
+
+def post_process(results_folder, ueResults_df, intervals, nGnbs, scenario, packetSize, aggregation,
+                 queueModel=MD1_QUEUE, traces=None):
+    """Build and save the results of an algorithm from the per UE results of its connected gNBs.
+
+    Writes the ue-ideal, gnb and ue-restricted results, scenario.csv and scenario-score.txt to the
+    results folder of the algorithm. An algorithm that only decides the serving gNBs passes the
+    [UE, interval] serving-gNB matrix and the traces instead of the per UE results, see serving_results.
+    With a list of queue models the ue-ideal results are written once and the results of every model
+    go to a subfolder named after the model.
+
+    Args:
+        results_folder (str): The results folder of the algorithm, created if it does not exist.
+        ueResults_df (list or ndarray): The results of every UE as DataFrames, indexed by UE, or the
+            serving gNB of every UE and interval, NO_GNB while the UE is not connected.
+        intervals (list): A list of intervals.
+        nGnbs (int): The number of gNBs.
+        scenario (Scenario): The scenario information.
+        packetSize (int): The packet size in bytes.
+        aggregation (dict): The aggregation of the scenario metrics, one of the SCENARIO_* dicts.
+        queueModel (QueueModel): The queue model of the gNBs, M/D/1 by default, or a list of them.
+        traces (list): The traces of the serving-gNB matrix, the dataframes of every UE or a TraceStore.
+
+    Returns:
+        float: The score of the algorithm. With a list of queue models, a dict of the score of every
+            model by its name.
+    """
+    if isinstance(ueResults_df, np.ndarray):
+        ueResults_df, ue_columns = serving_results(ueResults_df, traces, intervals)
+    else:
+        ue_columns = stack_ue_results(ueResults_df, len(ueResults_df))
+    nUEs = len(ueResults_df)
+    os.makedirs(os.path.join(results_folder, "ue-ideal"), exist_ok=True)
+    for ue in range(nUEs):
+        ueResults_df[ue].to_csv(os.path.join(results_folder, "ue-ideal", f"UE-{ue}.csv"), index=False)
+
+    logging.info("Calculating gNB metrics")
+    gnbResults_list = simulate_gnbs(nGnbs, intervals, nUEs, ueResults_df, scenario, packetSize, queueModel, ue_columns)
+
+    logging.info("Calculating the restricted UE throughput")
+    restricted_results = simulate_users_restricted(ueResults_df, gnbResults_list, nUEs, intervals, packetSize, queueModel,
+                                                   ue_columns)
+
+    logging.info("Calculating the scenario metrics")
+    if not isinstance(queueModel, (list, tuple)):
+        return save_model_results(results_folder, gnbResults_list, restricted_results, intervals, aggregation)
+    return {model.name: save_model_results(os.path.join(results_folder, model.name), gnbResults_list[m],
+                                           restricted_results[m], intervals, aggregation)
+            for m, model in enumerate(queueModel)}
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+# Content-addressed cache of ns-3 runs: the trace of a UE/gNB simulation is stored under a hash of the
+# ns-3 arguments and of the scenario, waypoints and simulator executable contents, so a run with the
+# same inputs reuses the stored trace instead of launching ns-3 again.
+import os
+import json
+import shutil
+import hashlib
+import logging
+
+from trace_cube import TRACES_FILE_NAME, BINARY_TRACES_FILE_NAME, HASH_CHUNK_SIZE
+
+RUN_CACHE_FOLDER_NAME = "run-cache"
+RUN_CACHE_ENTRY_FILE_NAME = "run.json"
+RUN_CACHE_VERSION = 1
+
+# Arguments that do not change the trace written by ns-3, or whose file contents are hashed instead
+IGNORED_ARGUMENTS = ("path", "logging", "sc", "wp")
+
+
+def file_digest(file_name):
+    """Hash of the contents of a file, None if the file is not set or does not exist."""
+    if file_name is None or not os.path.isfile(file_name):
+        return None
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_name, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def run_arguments(command):
+    """Extract the ns-3 arguments that define the trace of a run from its command line.
+
+    Args:
+        command (list): The ns-3 command, the executable followed by --name=value arguments.
+
+    Returns:
+        dict: The arguments by name, without the ones in IGNORED_ARGUMENTS.
+    """
+    arguments = {}
+    for argument in command[1:]:
+        name, _, value = argument.lstrip("-").partition("=")
+        if name not in IGNORED_ARGUMENTS:
+            arguments[name] = value
+    return arguments
+
+
+def run_key(arguments, digests):
+    """Key of a run in the cache.
+
+    Args:
+        arguments (dict): The ns-3 arguments of the run, see run_arguments.
+        digests (dict): The content hashes of the input files of the run, by name.
+
+    Returns:
+        str: The hex digest of the arguments and file hashes.
+    """
+    key = json.dumps({"version": RUN_CACHE_VERSION, "arguments": arguments, "files": digests}, sort_keys=True)
+    return hashlib.blake2b(key.encode(), digest_size=20).hexdigest()
+
+
+class RunCache:
+    """Store of ns-3 traces indexed by run key.
+
+    Every entry is a <key> folder with the trace file and a run.json file with the arguments of the run,
+    written last so that an entry is only visible once its trace is complete.
+
+    Attributes:
+        cache_folder (str): The folder of the cache, shared by all the runs.
+        digests (dict): The content hashes of the input files, shared by all the runs of a simulation.
+    """
+
+    def __init__(self, cache_folder, digests):
+        self.cache_folder = cache_folder
+        self.digests = digests
+
+    def key(self, command):
+        return run_key(run_arguments(command), self.digests)
+
+    def _entry_folder(self, key):
+        return os.path.join(self.cache_folder, key)
+
+    def lookup(self, key, traces_folder):
+        """Place the cached trace of a run in its traces folder.
+
+        The trace is hard linked when possible and copied otherwise.
+
+        Returns:
+            bool: True on a cache hit.
+        """
+        entry_folder = self._entry_folder(key)
+        if not os.path.isfile(os.path.join(entry_folder, RUN_CACHE_ENTRY_FILE_NAME)):
+            return False
+        for name in (BINARY_TRACES_FILE_NAME, TRACES_FILE_NAME):
+            cached_file = os.path.join(entry_folder, name)
+            if os.path.isfile(cached_file):
+                break
+        else:
+            return False
+        trace_file = os.path.join(traces_folder, name)
+        if os.path.exists(trace_file):
+            os.remove(trace_file)
+        try:
+            os.link(cached_file, trace_file)
+        except OSError:
+            shutil.copyfile(cached_file, trace_file)
+        return True
+
+    def store(self, key, traces_folder, command):
+        """Store the trace written by a finished run.
+
+        Args:
+            key (str): The key of the run.
+            traces_folder (str): The folder where ns-3 wrote the trace.
+            command (list): The ns-3 command of the run, recorded in the entry.
+        """
+        for name in (BINARY_TRACES_FILE_NAME, TRACES_FILE_NAME):
+            trace_file = os.path.join(traces_folder, name)
+            if os.path.isfile(trace_file):
+                break
+        else:
+            logging.warning(f"No trace found in {traces_folder}, the run is not cached")
+            return
+        entry_folder = self._entry_folder(key)
+        os.makedirs(entry_folder, exist_ok=True)
+        cached_file = os.path.join(entry_folder, name)
+        tmp_file = cached_file + ".tmp"
+        shutil.copyfile(trace_file, tmp_file)
+        os.replace(tmp_file, cached_file)
+        entry_file = os.path.join(entry_folder, RUN_CACHE_ENTRY_FILE_NAME)
+        with open(entry_file + ".tmp", "w") as file:
+            json.dump({"version": RUN_CACHE_VERSION, "arguments": run_arguments(command), "files": self.digests}, file)
+        os.replace(entry_file + ".tmp", entry_file)
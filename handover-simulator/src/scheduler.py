@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+# Scheduler of the handover algorithms: the selected algorithms run at the same time on one worker
+# pool, created once by main.py for the whole run. A3 and CHO drive their per UE stage from threads
+# of the calling process, SBGH, ideal-SBGH and MA-DDQN run as a pool task each, so any change an
+# algorithm makes to its traces stays in its own copy. The algorithm modules are only imported where
+# they run, TensorFlow and matplotlib are not loaded unless MA-DDQN is selected.
+import importlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from simulator_common import create_worker_pool
+
+# Module and function of every algorithm, by --algorithms name
+ALGORITHMS = {
+    "a3": ("simulator_3gpp", "simulate_3gpp_handover"),
+    "cho": ("simulator_3gpp_rel16", "simulate_3gpp_cho_handover"),
+    "sbgh": ("simulator_sbgh", "simulate_sbgh_handover"),
+    "ideal-sbgh": ("simulator_sbgh", "simulate_ideal_sbgh_handover"),
+    "dqn": ("simulator_gti_dqn", "simulate_gti_dqn_handover"),
+}
+# Algorithms whose per UE stage runs on the worker pool, the others run as a single pool task
+POOL_ALGORITHMS = {"a3", "cho"}
+
+
+def run_algorithm(name, args, kwargs, pool=None):
+    """Run an algorithm, on the worker pool if it is in POOL_ALGORITHMS.
+
+    Args:
+        name (str): The algorithm, a key of ALGORITHMS.
+        args (tuple): The positional arguments of the algorithm function.
+        kwargs (dict): The keyword arguments of the algorithm function.
+        pool (Pool): The worker pool of the per UE stage, see create_worker_pool.
+    """
+    module_name, function_name = ALGORITHMS[name]
+    simulate = getattr(importlib.import_module(module_name), function_name)
+    logging.info(f"Running {name}")
+    if name in POOL_ALGORITHMS:
+        simulate(*args, pool=pool, **kwargs)
+    else:
+        simulate(*args, **kwargs)
+    logging.info(f"{name} finished")
+
+
+def run_algorithms(algorithms, pool=None):
+    """Run several algorithms in parallel on a shared worker pool.
+
+    The algorithms that are not in POOL_ALGORITHMS are submitted to the pool first, one task each, so
+    they start at once; their arguments are pickled, a TraceStore as the handle of the trace cache.
+    The algorithms of POOL_ALGORITHMS then run in threads of the calling process and queue their UEs
+    behind them. Without a pool, a pool is created for the call.
+
+    Args:
+        algorithms (dict): The positional and keyword arguments of every algorithm to run, by name.
+        pool (Pool): The worker pool, see create_worker_pool.
+
+    Raises:
+        RuntimeError: If an algorithm failed, after all of them finished.
+    """
+    if not algorithms:
+        return
+    if pool is None:
+        with create_worker_pool() as pool:
+            return run_algorithms(algorithms, pool)
+    tasks = {name: pool.apply_async(run_algorithm, args=(name, args, kwargs))
+             for name, (args, kwargs) in algorithms.items() if name not in POOL_ALGORITHMS}
+    threaded = {name: arguments for name, arguments in algorithms.items() if name in POOL_ALGORITHMS}
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, len(threaded))) as executor:
+        futures = {name: executor.submit(run_algorithm, name, args, kwargs, pool)
+                   for name, (args, kwargs) in threaded.items()}
+        # Wait for every algorithm, in the order they were given
+        results = {name: task.get for name, task in tasks.items()}
+        results.update({name: future.result for name, future in futures.items()})
+        for name in algorithms:
+            try:
+                results[name]()
+            except Exception:
+                logging.exception(f"{name} failed")
+                failed.append(name)
+    if failed:
+        raise RuntimeError(f"Algorithms {failed} failed, see the log above")
@@ -2,6 +2,7 @@
 # encoding: UTF-8
 # This file contains the scoring functions for the handover simulator.
 import math
+import numpy as np
 # Constants
 BW_MAX = 400.0 * 10**6  # 400 MHz
 F_MAX = 74.0 * 10**9  # 74 GHz
@@ -15,7 +16,7 @@ def calculate_score(user_data, scenario_data, connected_gnb, alpha,beta):
     
         user_data (DataFrame): The user data for the UE, containing the data for the simulation of each connection. Format: the same as the ns-3 csv traces
         
-        scenario_data (DataFrame): The scenario data for the cell. Format: scenario_info dictionary as defined in the utils.py file.
+        scenario_data (Scenario): The scenario data for the cell, as defined in the utils.py file.
 
     Returns:
     
@@ -30,27 +31,11 @@ def calculate_score(user_data, scenario_data, connected_gnb, alpha,beta):
     if user_data["Rsrp"] is None :
         return 0
     rsrp = float(user_data["Rsrp"])
-    gnbs = scenario_data['gnbs']
-    bands = scenario_data['bands']
-    # take the band id from the connected gNB
-    band_id = gnbs[connected_gnb]["Band_ID"]
-    # get the bandwidth for the band
-    band = next((band for band in bands if band["Band_ID"] == band_id), None)
-    user_bandwidth = band["User_Bandwidth_Hz"]
-    # get the Central_Frequency for the connected gNB
-    central_frequency =band["Central_Frequency_Hz"]
-    # get the max distance as x distance and y distance
-    # being distance = sqrt(x^2 + y^2)
-    # x = max_x - min_x
-    # y = max_y - min_y
-    x = scenario_data['scenario_dimensions']['max_x'] - scenario_data['scenario_dimensions']['min_x']
-    y = scenario_data['scenario_dimensions']['max_y'] - scenario_data['scenario_dimensions']['min_y']
-    max_distance = math.sqrt(x**2 + y**2)
+    # get the user bandwidth of the band of the connected gNB
+    user_bandwidth = float(scenario_data.user_bandwidth[connected_gnb])
     
     # normalize the bandwidth
     bw = user_bandwidth / BW_MAX
-    # normalize the frequency
-    f = central_frequency / F_MAX
     # power parameter
     min_rsrp = -100
     max_rsrp = -80
@@ -62,6 +47,33 @@ def calculate_score(user_data, scenario_data, connected_gnb, alpha,beta):
     score = alpha*(bw)*p 
 
     return score
+
+
+def calculate_score_tensor(rsrp, scenario_data, alpha, beta):
+    """Calculate the score of calculate_score for every UE, gNB and interval at once.
+
+    The score of a connection only depends on the RSRP of the UE and on the user bandwidth of the band
+    of the gNB, so the scores of all the connections are computed from the RSRP of the traces with
+    array operations. SBGH and ideal-SBGH read the same scores, with their own delay.
+
+    Args:
+        rsrp (ndarray): The RSRP of every UE, gNB and interval, shape [UE, gNB, interval], e.g. the Rsrp
+            column of the trace cube. Missing ticks are -inf and score -inf.
+        scenario_data (Scenario): The scenario information, as defined in the utils.py file.
+        alpha (float): The alpha parameter of the score.
+        beta (float): The beta parameter of the score, not used by calculate_score.
+
+    Returns:
+        ndarray: The score of every UE, gNB and interval, shape [UE, gNB, interval].
+    """
+    rsrp = np.asarray(rsrp, dtype=np.float64)
+    # normalized user bandwidth of the band of every gNB
+    bw = scenario_data.user_bandwidth[:rsrp.shape[1]][None, :, None] / BW_MAX
+    # power parameter
+    min_rsrp = -100
+    max_rsrp = -80
+    p = np.where(rsrp > max_rsrp, 1, (rsrp - min_rsrp)/(max_rsrp - min_rsrp))
+    return alpha*(bw)*p
     
     
 def calculate_algorithm_score(gnbs_metrics):
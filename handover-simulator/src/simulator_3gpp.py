@@ -6,19 +6,25 @@ import os
 import multiprocessing as mp
 from occupation import *
 from simulator_common import *
-from scoring import calculate_algorithm_score
+from postprocessing import post_process, SCENARIO_3GPP
 
 
 import pandas as pd
 import logging
 import logging.config
 from nrEvents import *
+from simulator_3gpp_batched import simulate_users_batched
 ALGORITHM = "3GPP_A3"
 def simulate_user(user=int,simDataframes=None, intervals=None, Hys=float, A3Offset=float, NrMeasureInt=float, interval=float, DECISION_PARAMETER=str, TTT=float, penalty_time=float, bands=None, packetSize=int, penalty_dict=None):
     logging.info(f"Simulating UE {user}")
     ueResults = []
 
     dataframes = simDataframes[user]
+    # The traces are read from plain column lists and the two best gNBs of every interval are ranked
+    # upfront, the loop only runs the event state machine
+    columns = gnb_columns(dataframes)
+    ranked_gnbs = best_neighbours(dataframes, DECISION_PARAMETER)[0].tolist()
+    last_gnb_id = len(dataframes) - 1
     handovers = 0
     t_handover = 0
 
@@ -42,29 +48,14 @@ def simulate_user(user=int,simDataframes=None, intervals=None, Hys=float, A3Offs
 
     for index,match_interval in enumerate(intervals):
         
-        best_gnb = None
-        best_gnb_id = None
-        best_metric_value = float('-inf')
         position = None
         sysTime = None
-        
-
-
-
 
-        # Iterate over each gNB file
-        for file_id, df in enumerate(dataframes):
-            # Filter the dataframe for the current time interval "Time" == match_interval
-            interval_df = df.loc[df["Time"] == match_interval]
-            # Find the row with the maximum value of the metric
-            interval_metric_value = interval_df[DECISION_PARAMETER].values[0]
-            if interval_metric_value > best_metric_value:
-                if connected_gnb_id is not None and connected_gnb_id == file_id:
-                    continue
-                best_gnb_id = file_id  
-                best_gnb = interval_df
-                best_metric_value = interval_metric_value
-                # Get the throughput in the interval
+        # Best gNB of the interval other than the connected one
+        first_gnb_id, second_gnb_id = ranked_gnbs[index]
+        best_gnb_id = second_gnb_id if first_gnb_id == connected_gnb_id else first_gnb_id
+        if best_gnb_id < 0:
+            best_gnb_id = None
         if connected_gnb is not None:
             throughput = connected_gnb["Throughput"]
             tx_packets_diff = connected_gnb["TxPacketsDiff"]
@@ -76,7 +67,7 @@ def simulate_user(user=int,simDataframes=None, intervals=None, Hys=float, A3Offs
             lost_packets_diff = connected_gnb["LostPacketsDiff"]
             distance = connected_gnb["Distance"]
             rsrp = connected_gnb["Rsrp"]
-            position = connected_gnb["UE Position"]
+            position = (connected_gnb["PosX"], connected_gnb["PosY"], connected_gnb["PosZ"])
             sysTime = connected_gnb["System Time"]
         else:
             throughput = 0
@@ -90,8 +81,9 @@ def simulate_user(user=int,simDataframes=None, intervals=None, Hys=float, A3Offs
             rsrp = None
             distance = None
             # take the position from the UE file
-            position = interval_df["UE Position"].values[0]
-            sysTime = interval_df["System Time"].values[0]
+            interval_df = gnb_row(columns, last_gnb_id, index)
+            position = (interval_df["PosX"], interval_df["PosY"], interval_df["PosZ"])
+            sysTime = interval_df["System Time"]
             
             
 
@@ -123,7 +115,9 @@ def simulate_user(user=int,simDataframes=None, intervals=None, Hys=float, A3Offs
             "LostPackets": lost_packets_diff,
             "Distance": distance,
             "Rsrp": rsrp,
-            "UE Position": position,
+            "PosX": position[0],
+            "PosY": position[1],
+            "PosZ": position[2],
             "Handovers": handovers,
             "System Time": sysTime
         }
@@ -137,7 +131,7 @@ def simulate_user(user=int,simDataframes=None, intervals=None, Hys=float, A3Offs
         if nr_timer >= NrMeasureInt:
             nr_timer -= NrMeasureInt
             if best_gnb_id is not None:
-                best_rsrp = best_gnb["Rsrp"].values[0]
+                best_rsrp = columns[best_gnb_id]["Rsrp"][index]
                 if not ttt_started and not handover_started and not nr_event_triggered:
                     if connected_gnb_id == None:
                         if best_gnb_id != None:
@@ -160,7 +154,7 @@ def simulate_user(user=int,simDataframes=None, intervals=None, Hys=float, A3Offs
                         connected_gnb_id = best_gnb_id
                         handover_started = True
                         handover_remaining_time = penalty_time
-                        handovers = True
+                        handovers += 1
                     ttt_event = None
                         
 
@@ -183,12 +177,14 @@ def simulate_user(user=int,simDataframes=None, intervals=None, Hys=float, A3Offs
                     
 
             if connected_gnb_id is not None:
-                connected_gnb = get_gnb_data(connected_gnb_id, dataframes, index)
+                connected_gnb = gnb_row(columns, connected_gnb_id, index)
                 
                 if handover_remaining_time > 0:
                     connected_gnb = apply_penalty(connected_gnb, penalty_dict, handover_remaining_time,interval)
                     handover_remaining_time -= interval
-                    
+                # The handover is complete once its interruption time elapsed, the UE measures again
+                if handover_remaining_time <= 0:
+                    handover_started = False
 
             else:
                 connected_gnb = None
@@ -198,9 +194,7 @@ def simulate_user(user=int,simDataframes=None, intervals=None, Hys=float, A3Offs
 
 
 
-def simulate_3gpp_handover(nUEs=False,debug=False,traces_sim_folder=str, nGnbs=int, Hys=float, A3Offset=float, NrMeasureInt=float, interval=float, DECISION_PARAMETER=str, TTT=float, penalty_time=float, intervals= None, simDataframes=None, scenario=None, packetSize=int, penalty_dict=None):
-    ueResults_df = [] * nUEs
-    gnbResults_list = []
+def simulate_3gpp_handover(nUEs=False,debug=False,traces_sim_folder=str, nGnbs=int, Hys=float, A3Offset=float, NrMeasureInt=float, interval=float, DECISION_PARAMETER=str, TTT=float, penalty_time=float, intervals= None, simDataframes=None, scenario=None, packetSize=int, penalty_dict=None, traceStream=None, engine="scalar", pool=None, queueModel=MD1_QUEUE):
     logging.info(f"Simulating 3GPP A3 NR event based handover")
     # Create the results folder
     results_folder = os.path.join(traces_sim_folder, "results")
@@ -209,114 +203,23 @@ def simulate_3gpp_handover(nUEs=False,debug=False,traces_sim_folder=str, nGnbs=i
     results_folder = os.path.join(results_folder, ALGORITHM)
     if not os.path.isdir(results_folder):
         os.mkdir(results_folder)
-    # CPU threads
-    cpu_threads_count =  mp.cpu_count()
-    with mp.Pool(cpu_threads_count) as pool:
-        # create a list of processes
-        processes = [{'p':pool.apply_async(simulate_user, args=(ue,simDataframes, intervals, Hys, A3Offset, NrMeasureInt, interval, DECISION_PARAMETER, TTT, penalty_time)), 'id': ue} for ue in range(nUEs)]
-        # save the results by id
-        for p in processes:
-            logging.info(f"UE {p['id']} started")
-            ueResults_df.insert(p['id'], p['p'].get())
-            logging.info(f"UE {p['id']} finished")
-    # Save the results to a file
-    for ue in range(nUEs):
-        ueIdealResults_folder = os.path.join(results_folder, "ue-ideal")
-        if not os.path.isdir(ueIdealResults_folder):
-            os.mkdir(ueIdealResults_folder)
-        ueResults_file = os.path.join(ueIdealResults_folder, f"UE-{ue}.csv")
-        ueResults_df[ue] = pd.DataFrame(ueResults_df[ue])
-        ueResults_df[ue].to_csv(ueResults_file, index=False)
-        
-    # calculate the gNB metrics
-    logging.info("Calculating gNB metrics")
-    for gnb in range(nGnbs):
-        gnbResults_list.append(simulate_gnb(gnb,intervals,nUEs, ueResults_df, scenario, packetSize))
-        logging.info(f"GNB {gnb} finished")
-    # Save the results to a file
-    for gnb in range(nGnbs):
-        gnbResults_folder = os.path.join(results_folder, "gnb")
-        if not os.path.isdir(gnbResults_folder):
-            os.mkdir(gnbResults_folder)
-        gnbResults_file = os.path.join(gnbResults_folder, f"GNB-{gnb}.csv")
-        gnbResults_list[gnb] = pd.DataFrame(gnbResults_list[gnb])
-        gnbResults_list[gnb].to_csv(gnbResults_file, index=False)
-    
-    # now from the occupation in the gnb we can calculate the restricted ue throughput
-    logging.info("Calculating the restricted UE throughput")
-    # create a folder to save the results
-    restricted_ueResults_folder = os.path.join(results_folder, "ue-restricted")
-    restricted_ueResults_df = []
-    if not os.path.isdir(restricted_ueResults_folder):
-        os.mkdir(restricted_ueResults_folder)
-
-    for ue in range(nUEs):
-        restricted_ueResults_df.append(pd.DataFrame(simulate_user_restricted(ueResults_df, gnbResults_list, ue, intervals, packetSize)))
-        logging.info(f"UE {ue} finished")
-        restricted_ueResults_file = os.path.join(restricted_ueResults_folder, f"UE-{ue}.csv")
-        
-        pd.DataFrame(restricted_ueResults_df[ue]).to_csv(restricted_ueResults_file, index=False)
-    # calculate the scenario metrics
-    logging.info("Calculating the scenario metrics")
-    scenarioResults = []
-    # calculate the scenario metrics for each interval aggregate each gnb
-    for index, interval in enumerate(intervals):
-        interval_data = []
-        for gnb in range(nGnbs):
-            gnb_data = gnbResults_list[gnb]
-            interval_data.append(gnb_data.iloc[index])
-        interval_data = pd.DataFrame(interval_data)
-        if len(interval_data) > 0:
-            interval_data = interval_data.agg({
-                        "Throughput": "sum",
-                        "TxPacketsAcc": "sum",
-                        "TxBytesAcc": "sum",
-                        "TxBytesDiff": "sum",
-                        "TxPacketsDiff": "sum",
-                        "RxBytesAcc": "sum",
-                        "RxPacketsAcc": "sum",
-                        "RxBytesDiff": "sum",
-                        "RxPacketsDiff": "sum",
-                        "Latency": "mean",
-                        "Jitter": "mean",
-                        "LostPackets": "sum",
-                        "ConnectedUEs": "sum",
-                        "MeanThroughput": "mean",
-                        'PLostPackets': 'mean',
-                        "Handovers": "mean",
-
-                    })
+    if traceStream is not None and intervals is None:
+        intervals = traceStream.intervals()
+    if engine == "batched":
+        # The UEs advance together, when streaming in batches of the UEs whose traces are complete.
+        # simulate_user is the reference of the batched engine
+        def simulate_batch(ueDataframes):
+            return simulate_users_batched(len(ueDataframes), ueDataframes, intervals, Hys, A3Offset, NrMeasureInt,
+                                          interval, DECISION_PARAMETER, TTT, penalty_time, penalty_dict)
+
+        if traceStream is not None:
+            ueResults_df = simulate_stream_batches(simulate_batch, nUEs, traceStream, interval)
         else:
-            interval_data = {
-                "Throughput": 0,
-                "TxPacketsAcc": 0,
-                "TxBytesAcc": 0,
-                "TxBytesDiff": 0,
-                "TxPacketsDiff": 0,
-                "RxBytesAcc": 0,
-                "RxPacketsAcc": 0,
-                "RxBytesDiff": 0,
-                "RxPacketsDiff": 0,
-                "Latency": 0,
-                "Jitter": 0,
-                "LostPackets": 0,
-                "ConnectedUEs": 0,
-                "MeanThroughput": 0,
-                'PLostPackets': 0,
-
-            }
-        
-        
-        # insert time in the first position
-        interval_data = {"Time": interval, **interval_data}
-        scenarioResults.append(interval_data)
-    scenarioResults = pd.DataFrame(scenarioResults)
-    # Save the results to a file in results/<algorithm>/scenario.csv
-    scenarioResults.to_csv(os.path.join(results_folder, "scenario.csv"), index=False)
-    #save the score of the algorithm
-    score = calculate_algorithm_score(scenarioResults)
-    logging.info(f"Scenario Score: {score}")
-    # save the score in a file
-    score_file = os.path.join(results_folder, "scenario-score.txt")
-    with open(score_file, "w") as file:
-        file.write(str(score))
\ No newline at end of file
+            ueResults_df = simulate_batch(simDataframes)
+    else:
+        ueResults_df = simulate_users(simulate_user, nUEs, simDataframes, intervals,
+                                      (Hys, A3Offset, NrMeasureInt, interval, DECISION_PARAMETER, TTT, penalty_time,
+                                       None, packetSize, penalty_dict),
+                                      traceStream, interval, pool)
+    ueResults_df = [compact_results(results) for results in ueResults_df]
+    post_process(results_folder, ueResults_df, intervals, nGnbs, scenario, packetSize, SCENARIO_3GPP, queueModel)
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+# Batched engine of the 3GPP A3 handover: the NR measurement and TTT state of every UE is kept in
+# arrays and all the UEs advance one tick at a time, instead of one Python loop per UE. The batch
+# rows can also run the same UE with different parameters, see sweep.py.
+# simulator_3gpp.simulate_user is the reference implementation, this engine produces the same results.
+import logging
+import numpy as np
+import pandas as pd
+from utils import *
+from simulator_common import rank_gnbs
+from trace_store import TraceStore, TraceBatch
+
+# Largest number of UEs advanced together, bounds the memory of the stacked traces
+DEFAULT_BATCH_SIZE = 1024
+
+# Trace columns copied to the results from the row of the connected gNB, and their result names
+ROW_COLUMNS = {
+    "Throughput": "Throughput",
+    "TxBytesDiff": "TxBytesDiff",
+    "TxPacketsDiff": "TxPacketsDiff",
+    "RxBytesDiff": "RxBytesDiff",
+    "RxPacketsDiff": "RxPacketsDiff",
+    "LatencySum": "Latency",
+    "JitterSum": "Jitter",
+    "LostPacketsDiff": "LostPackets",
+    "Distance": "Distance",
+    "Rsrp": "Rsrp",
+}
+# Columns with no value while the UE is not connected, they are 0 otherwise
+MISSING_COLUMNS = ["Distance", "Rsrp"]
+# Columns taken from the last gNB trace while the UE is not connected
+UE_COLUMNS = ["PosX", "PosY", "PosZ", "System Time"]
+# Accumulated counters of the results and the increment each one adds up
+ACC_COLUMNS = {
+    "TxPacketsAcc": "TxPacketsDiff",
+    "TxBytesAcc": "TxBytesDiff",
+    "RxBytesAcc": "RxBytesDiff",
+    "RxPacketsAcc": "RxPacketsDiff",
+}
+# Trace columns of the connected gNB a handover penalty can degrade, the keys of penalty_dict that
+# apply_penalty finds in a trace row and that reach the results
+PENALTY_COLUMNS = [name for name in list(ROW_COLUMNS) + UE_COLUMNS if name != "System Time"]
+# Number of [UE, gNB, interval] arrays a batch stacks: the result columns and the RSRP
+STACKED_COLUMNS = len(ROW_COLUMNS) + len(UE_COLUMNS) + 1
+# Column order of the per UE results of simulator_3gpp.simulate_user
+RESULT_COLUMNS = ["Time", "GNodeB", "Throughput", "TxPacketsAcc", "TxBytesAcc", "TxBytesDiff", "TxPacketsDiff",
+                  "RxBytesAcc", "RxPacketsAcc", "RxBytesDiff", "RxPacketsDiff", "Latency", "Jitter", "LostPackets",
+                  "Distance", "Rsrp", "PosX", "PosY", "PosZ", "Handovers", "System Time"]
+
+
+def stack_column(ueDataframes, name):
+    """Stack a trace column of several UEs, shape [UE, gNB, interval].
+
+    ueDataframes is the list of the DataFrames of every UE, or a TraceBatch, which reads the column
+    from the trace cube without building the DataFrames.
+    """
+    if isinstance(ueDataframes, TraceBatch):
+        return ueDataframes.column(name)
+    return np.stack([np.stack([df[name].to_numpy() for df in dataframes]) for dataframes in ueDataframes])
+
+
+def batch_size(simDataframes, batchSize=DEFAULT_BATCH_SIZE):
+    """Number of UEs advanced together.
+
+    With a TraceStore the batch is read from the trace cube and the stacked columns of a batch are
+    bounded by the memory budget of the store, at least one UE per batch.
+
+    Args:
+        simDataframes (list): A list of lists of dataframes or a TraceStore.
+        batchSize (int): The largest number of UEs of a batch.
+
+    Returns:
+        int: The number of UEs of a batch.
+    """
+    if not isinstance(simDataframes, TraceStore) or simDataframes.memory_budget is None:
+        return batchSize
+    cube = simDataframes.cube
+    ue_bytes = STACKED_COLUMNS * cube.nGnb * cube.nIntervals * np.dtype(np.float64).itemsize
+    return int(max(1, min(batchSize, simDataframes.memory_budget // ue_bytes)))
+
+
+def batch_traces(simDataframes, ues):
+    """The traces of a batch of UEs: a TraceBatch over the cube of a TraceStore, their DataFrames otherwise."""
+    if isinstance(simDataframes, TraceStore):
+        return simDataframes.batch(ues)
+    return [simDataframes[ue] for ue in ues]
+
+
+def stack_columns(ueDataframes):
+    """Stack the trace columns copied to the results, see stack_column.
+
+    The integer counters are widened to int64 and the other columns to float64, the types the
+    per interval sums of simulate_user produce.
+
+    Returns:
+        dict: The stacked columns by trace column name.
+    """
+    columns = {}
+    for name in list(ROW_COLUMNS) + UE_COLUMNS:
+        values = stack_column(ueDataframes, name)
+        if name in ROW_COLUMNS:
+            values = values.astype(np.int64 if np.issubdtype(values.dtype, np.integer) else np.float64)
+        columns[name] = values
+    return columns
+
+
+def stack_metrics(ueDataframes, DECISION_PARAMETER):
+    """Stack the inputs of the state machines: the two best gNBs of every interval by the decision
+    metric, shape [UE, interval, 2], and the RSRP of every gNB, shape [UE, gNB, interval]."""
+    ranked = rank_gnbs(np.moveaxis(stack_column(ueDataframes, DECISION_PARAMETER).astype(np.float64), 1, 2))[0]
+    rsrp = stack_column(ueDataframes, "Rsrp").astype(np.float64)
+    return ranked, rsrp
+
+
+def batch_parameter(value, nRows):
+    """Broadcast a parameter of the state machines, a number or one value per row, to the rows."""
+    return np.broadcast_to(np.asarray(value, dtype=np.float64), (nRows,))
+
+
+def penalty_columns(penalty_dict):
+    """The penalties of penalty_dict on the PENALTY_COLUMNS, the other keys have no effect on the results."""
+    return {name: value for name, value in (penalty_dict or {}).items() if name in PENALTY_COLUMNS}
+
+
+class HandoverPenalty:
+    """Handover interruption of every row, as simulate_user models it with apply_penalty.
+
+    A handover starts an interruption of penalty_time seconds. While it lasts, the row of the connected
+    gNB taken at every NR measurement tick is degraded by the penalties, in full or by the share of
+    the interval that remains, and the handover is complete once the interruption elapsed.
+
+    Args:
+        nRows (int): The number of rows.
+        interval (float): The sample time interval in seconds.
+        penalty_time (float or ndarray): The interruption time in seconds, for all the rows or per row.
+        penalty_dict (dict): The penalty of every trace column, see penalty_columns.
+    """
+
+    def __init__(self, nRows, interval, penalty_time, penalty_dict):
+        self.interval = interval
+        self.penalty_time = batch_parameter(penalty_time, nRows)
+        self.rsrp = penalty_columns(penalty_dict).get("Rsrp", 0.0)
+        self.remaining = np.zeros(nRows)
+        # Share of the penalties applied to the row the results are taken from
+        self.share = np.zeros(nRows)
+
+    def start(self, handover):
+        """Start the interruption of the rows that handed over."""
+        self.remaining = np.where(handover, self.penalty_time, self.remaining)
+
+    def refresh(self, active, connected_gnb_id):
+        """Take the penalty share of the rows whose connected gNB row is refreshed.
+
+        Returns:
+            ndarray: The rows whose handover is complete.
+        """
+        refresh = active & (connected_gnb_id >= 0)
+        penalized = refresh & (self.remaining > 0)
+        share = np.where(self.remaining > self.interval, 1.0, self.remaining / self.interval)
+        self.share = np.where(active, np.where(penalized, share, 0.0), self.share)
+        self.remaining = np.where(penalized, self.remaining - self.interval, self.remaining)
+        return refresh & (self.remaining <= 0)
+
+    def connected_rsrp(self, rsrp):
+        """The RSRP of the connected gNB row with its penalty."""
+        return np.where(self.share > 0, rsrp + self.rsrp * self.share, rsrp)
+
+
+def advance_a3(ranked, rsrp, Hys, A3Offset, NrMeasureInt, interval, TTT, ues=None, penalty_time=0.0, penalty_dict=None):
+    """Run the A3 event state machine of simulator_3gpp.simulate_user for a batch of rows.
+
+    A row is a UE run with a set of parameters: by default every UE of the inputs once, and with ues,
+    the UE of the inputs each row runs, so several parameter sets of the same UE advance together.
+    The state of every row is held in arrays and each tick updates all the rows with array operations,
+    in the same order as the scalar state machine. As in simulate_user, the row of the connected gNB
+    used for the results is refreshed at the NR measurement ticks. A handover interrupts the UE for
+    penalty_time, the rows taken meanwhile are degraded by penalty_dict and the UE measures again
+    once it elapsed, see HandoverPenalty.
+
+    Args:
+        ranked (ndarray): The two best gNBs of every interval by the decision metric, shape [UE, interval, 2].
+        rsrp (ndarray): The RSRP of every gNB, shape [UE, gNB, interval].
+        Hys (float or ndarray): Hysteresis of the A3 event in dB, for all the rows or per row.
+        A3Offset (float or ndarray): Offset of the A3 event in dB.
+        NrMeasureInt (float or ndarray): Interval of the NR measurements in seconds.
+        interval (float): The sample time interval in seconds.
+        TTT (float or ndarray): Time to trigger in seconds.
+        ues (ndarray): The UE of every row, None for one row per UE.
+        penalty_time (float or ndarray): The handover interruption time in seconds.
+        penalty_dict (dict): The penalty of every trace column during the interruption.
+
+    Returns:
+        tuple: For every row and interval, shape [row, interval]: the connected gNB (-1 if none), the gNB
+            and tick of the row the results are taken from (-1 if none), the handover counter and the
+            share of the penalties applied to the row.
+    """
+    if ues is None:
+        ues = np.arange(ranked.shape[0])
+    nRows, nIntervals = len(ues), ranked.shape[1]
+    Hys, A3Offset, NrMeasureInt, TTT = (batch_parameter(value, nRows) for value in (Hys, A3Offset, NrMeasureInt, TTT))
+    penalty = HandoverPenalty(nRows, interval, penalty_time, penalty_dict)
+
+    def rsrp_at(gnb, index):
+        return np.where(gnb >= 0, rsrp[ues, np.maximum(gnb, 0), np.maximum(index, 0)], np.nan)
+
+    nr_timer = np.zeros(nRows)
+    ttt_timer = np.zeros(nRows)
+    ttt_a3 = np.zeros(nRows, dtype=bool)
+    ttt_started = np.zeros(nRows, dtype=bool)
+    nr_event_triggered = np.zeros(nRows, dtype=bool)
+    handover_started = np.zeros(nRows, dtype=bool)
+    handover_count = np.zeros(nRows, dtype=np.int64)
+    connected_gnb_id = np.full(nRows, -1)
+    row_gnb = np.full(nRows, -1)
+    row_index = np.full(nRows, -1)
+    best_rsrp = np.full(nRows, np.nan)
+    connected_rsrp = np.full(nRows, np.nan)
+
+    connected = np.empty((nRows, nIntervals), dtype=np.int32)
+    rows_gnb = np.empty((nRows, nIntervals), dtype=np.int32)
+    rows_index = np.empty((nRows, nIntervals), dtype=np.int32)
+    handovers = np.empty((nRows, nIntervals), dtype=np.int64)
+    rows_penalty = np.empty((nRows, nIntervals))
+
+    for index in range(nIntervals):
+        first_gnb_id, second_gnb_id = ranked[ues, index, 0], ranked[ues, index, 1]
+        best_gnb_id = np.where(first_gnb_id == connected_gnb_id, second_gnb_id, first_gnb_id)
+        connected[:, index] = connected_gnb_id
+        rows_gnb[:, index] = row_gnb
+        rows_index[:, index] = row_index
+        handovers[:, index] = handover_count
+        rows_penalty[:, index] = penalty.share
+
+        nr_timer += interval
+        measure = nr_timer >= NrMeasureInt
+        nr_timer = np.where(measure, nr_timer - NrMeasureInt, nr_timer)
+        has_best = measure & (best_gnb_id >= 0)
+        best_rsrp = np.where(has_best, rsrp_at(best_gnb_id, index), best_rsrp)
+        idle = has_best & ~ttt_started & ~handover_started & ~nr_event_triggered
+        # Not connected: connect to the best gNB
+        attach = idle & (connected_gnb_id < 0)
+        # Connected: start the TTT timer on an A3 event
+        check = idle & (connected_gnb_id >= 0) & (row_gnb >= 0)
+        connected_rsrp = np.where(check, penalty.connected_rsrp(rsrp_at(row_gnb, row_index)), connected_rsrp)
+        a3 = check & (best_rsrp >= connected_rsrp + (A3Offset + Hys))
+        connected_gnb_id = np.where(attach, best_gnb_id, connected_gnb_id)
+        ttt_started |= a3
+        ttt_a3 |= a3
+        # The rows that connected or started the TTT timer skip the rest of the tick
+        active = measure & ~attach & ~a3
+        # TTT expired: hand over unless the A3-2 event holds
+        triggered = has_best & nr_event_triggered & active
+        handover = triggered & ttt_a3 & ~(best_rsrp < connected_rsrp + (A3Offset - Hys))
+        nr_event_triggered &= ~triggered
+        connected_gnb_id = np.where(handover, best_gnb_id, connected_gnb_id)
+        handover_started |= handover
+        handover_count += handover
+        penalty.start(handover)
+        ttt_a3 &= ~triggered
+        if handover.any():
+            logging.debug(f"A3 handover of rows {np.flatnonzero(handover).tolist()} at tick {index}")
+        # TTT timer
+        timing = active & ttt_started
+        ttt_timer = np.where(timing, ttt_timer + interval, ttt_timer)
+        a3_2 = timing & ttt_a3 & (best_rsrp < connected_rsrp + (A3Offset - Hys))
+        ttt_a3 &= ~a3_2
+        ttt_started &= ~a3_2
+        nr_event_triggered &= ~a3_2
+        ttt_timer = np.where(a3_2, 0, ttt_timer)
+        expired = timing & (ttt_timer >= TTT)
+        nr_event_triggered |= expired
+        ttt_timer = np.where(expired, 0, ttt_timer)
+        ttt_started &= ~expired
+        # Row of the connected gNB for the next ticks, the handover is complete once its interruption elapsed
+        row_gnb = np.where(active, connected_gnb_id, row_gnb)
+        row_index = np.where(active, np.where(connected_gnb_id >= 0, index, -1), row_index)
+        handover_started &= ~penalty.refresh(active, connected_gnb_id)
+
+    return connected, rows_gnb, rows_index, handovers, rows_penalty
+
+
+def gather_results(columns, intervals, connected, rows_gnb, rows_index, handovers, rows_penalty=None,
+                   penalty_dict=None, ues=None):
+    """Build the per UE results of a batch of rows from the trace rows selected by a state machine.
+
+    Args:
+        columns (dict): The stacked trace columns of the UEs, see stack_columns.
+        intervals (list): A list of intervals.
+        connected (ndarray): The connected gNB of every row and interval, -1 if none.
+        rows_gnb (ndarray): The gNB of the trace row the results are taken from, -1 if none.
+        rows_index (ndarray): The tick of the trace row the results are taken from.
+        handovers (ndarray): The handover counter of every row and interval.
+        rows_penalty (ndarray): The share of the penalties applied to the trace row, None for none.
+        penalty_dict (dict): The penalty of every trace column, see penalty_columns.
+        ues (ndarray): The UE of every row, None for one row per UE.
+
+    Returns:
+        list: The results of every row as DataFrames, with the columns and types of the results of
+            the scalar simulate_user.
+    """
+    nRows, nIntervals = connected.shape
+    if ues is None:
+        ues = np.arange(nRows)
+    has_row = rows_gnb >= 0
+    row_ues = np.asarray(ues)[:, None]
+    ticks = np.arange(nIntervals)[None, :]
+    gnb = np.maximum(rows_gnb, 0)
+    index = np.maximum(rows_index, 0)
+    last_gnb = columns["PosX"].shape[1] - 1
+    penalty = penalty_columns(penalty_dict)
+    penalized = has_row & (rows_penalty > 0) if rows_penalty is not None and penalty else np.zeros_like(has_row)
+
+    def row_values(name, default):
+        values = columns[name][row_ues, gnb, index]
+        if name in penalty:
+            # The penalty turns the values of the interruption into floats, as apply_penalty does
+            values = np.where(penalized, values + penalty[name] * np.where(penalized, rows_penalty, 0), values)
+        return np.where(has_row, values, default)
+
+    results = {}
+    for name, result_name in ROW_COLUMNS.items():
+        results[result_name] = row_values(name, np.nan if result_name in MISSING_COLUMNS else 0)
+    for name in UE_COLUMNS:
+        results[name] = row_values(name, columns[name][row_ues, last_gnb, ticks])
+    for name, diff in ACC_COLUMNS.items():
+        results[name] = np.cumsum(results[diff], axis=1)
+    results["Time"] = np.broadcast_to(np.asarray(intervals), (nRows, nIntervals))
+    results["GNodeB"] = connected.astype(np.int64)
+    results["Handovers"] = handovers.astype(np.int64)
+    # Types of the columns the penalties widen to float64, with the accumulated counters they add up
+    penalized_types = {ROW_COLUMNS.get(name, name): columns[name].dtype for name in penalty}
+    penalized_types.update({name: np.int64 for name, diff in ACC_COLUMNS.items()
+                            if np.issubdtype(penalized_types.get(diff, np.float64), np.integer)})
+    ueResults = []
+    for row in range(nRows):
+        row_columns = {name: results[name][row] for name in RESULT_COLUMNS}
+        if not has_row[row].any():
+            # A UE that never connected only has the default values, with their types in simulate_user
+            for name in ROW_COLUMNS.values():
+                row_columns[name] = np.full(nIntervals, None, dtype=object) if name in MISSING_COLUMNS \
+                    else np.zeros(nIntervals, dtype=np.int64)
+        elif not penalized[row].any():
+            # The columns of a UE never penalized keep the types of its traces
+            for name, dtype in penalized_types.items():
+                row_columns[name] = row_columns[name].astype(dtype)
+        ueResults.append(compact_results(pd.DataFrame(row_columns)))
+    return ueResults
+
+
+def simulate_users_batched(nUEs, simDataframes, intervals, Hys, A3Offset, NrMeasureInt, interval, DECISION_PARAMETER,
+                           TTT, penalty_time=0.0, penalty_dict=None, batchSize=DEFAULT_BATCH_SIZE):
+    """Run the per UE stage of the 3GPP A3 handover for all the UEs with the batched engine.
+
+    Args:
+        nUEs (int): The number of UEs.
+        simDataframes (list): A list of lists of dataframes or a TraceStore.
+        intervals (list): A list of intervals.
+        Hys (float): Hysteresis of the A3 event in dB.
+        A3Offset (float): Offset of the A3 event in dB.
+        NrMeasureInt (float): Interval of the NR measurements in seconds.
+        interval (float): The sample time interval in seconds.
+        DECISION_PARAMETER (str): The metric the gNBs are ranked by.
+        TTT (float): Time to trigger in seconds.
+        penalty_time (float): The handover interruption time in seconds.
+        penalty_dict (dict): The penalty of every trace column during the interruption.
+        batchSize (int): The largest number of UEs advanced together, see batch_size.
+
+    Returns:
+        list: The results of every UE as DataFrames, indexed by UE.
+    """
+    ueResults = []
+    batchSize = batch_size(simDataframes, batchSize)
+    for start in range(0, nUEs, batchSize):
+        ues = range(start, min(start + batchSize, nUEs))
+        ueDataframes = batch_traces(simDataframes, ues)
+        logging.info(f"UEs {ues.start}-{ues.stop - 1} started")
+        ranked, rsrp = stack_metrics(ueDataframes, DECISION_PARAMETER)
+        selection = advance_a3(ranked, rsrp, Hys, A3Offset, NrMeasureInt, interval, TTT, penalty_time=penalty_time,
+                               penalty_dict=penalty_dict)
+        ueResults.extend(gather_results(stack_columns(ueDataframes), intervals, *selection, penalty_dict=penalty_dict))
+        logging.info(f"UEs {ues.start}-{ues.stop - 1} finished")
+    return ueResults
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+# Batched engine of the 3GPP Rel-16 CHO handover: the NR measurement state, the CHO candidates and
+# their TTT timers are kept in arrays and all the UEs advance one tick at a time, as in the batched
+# A3 engine. simulator_3gpp_rel16.simulate_user is the reference implementation, this engine
+# produces the same results.
+import logging
+import numpy as np
+from utils import *
+from simulator_3gpp_batched import (DEFAULT_BATCH_SIZE, stack_columns, stack_metrics, batch_parameter, gather_results,
+                                    batch_size, batch_traces, HandoverPenalty)
+
+
+def advance_cho(ranked, rsrp, fr2, Hys, A3Offset, NrMeasureInt, interval, TTT, Hys_FR2, TTT_FR2, ues=None,
+                penalty_time=0.0, penalty_dict=None):
+    """Run the CHO state machine of simulator_3gpp_rel16.simulate_user for a batch of rows.
+
+    A row is a UE run with a set of parameters, see simulator_3gpp_batched.advance_a3. On an A3 event
+    every gNB meeting its own A3 condition becomes a candidate, with the hysteresis and TTT of its
+    band. At each NR measurement tick the candidates hit by the A3-2 event are dropped, the timers of
+    the others advance and the UE hands over to the lowest gNB id whose timer reached its TTT. The
+    handover interruption is modelled as in advance_a3, the UE scans for A3 events again once it elapsed.
+
+    Args:
+        ranked (ndarray): The two best gNBs of every interval by the decision metric, shape [UE, interval, 2].
+        rsrp (ndarray): The RSRP of every gNB, shape [UE, gNB, interval].
+        fr2 (ndarray): Whether every gNB is in FR2, shape [gNB].
+        Hys (float or ndarray): Hysteresis of the A3 event in FR1 in dB, for all the rows or per row.
+        A3Offset (float or ndarray): Offset of the A3 event in dB.
+        NrMeasureInt (float or ndarray): Interval of the NR measurements in seconds.
+        interval (float): The sample time interval in seconds.
+        TTT (float or ndarray): Time to trigger in FR1 in seconds.
+        Hys_FR2 (float or ndarray): Hysteresis of the A3 event in FR2 in dB.
+        TTT_FR2 (float or ndarray): Time to trigger in FR2 in seconds.
+        ues (ndarray): The UE of every row, None for one row per UE.
+        penalty_time (float or ndarray): The handover interruption time in seconds.
+        penalty_dict (dict): The penalty of every trace column during the interruption.
+
+    Returns:
+        tuple: For every row and interval, shape [row, interval]: the connected gNB (-1 if none), the gNB
+            and tick of the row the results are taken from (-1 if none), the handover counter and the
+            share of the penalties applied to the row.
+    """
+    if ues is None:
+        ues = np.arange(ranked.shape[0])
+    nRows, nIntervals = len(ues), ranked.shape[1]
+    nGnbs = rsrp.shape[1]
+    Hys, A3Offset, NrMeasureInt, TTT, Hys_FR2, TTT_FR2 = (
+        batch_parameter(value, nRows) for value in (Hys, A3Offset, NrMeasureInt, TTT, Hys_FR2, TTT_FR2))
+    fr2 = np.asarray(fr2, dtype=bool)[None, :]
+    # Hysteresis and TTT of every candidate gNB, by its band
+    hys = np.where(fr2, Hys_FR2[:, None], Hys[:, None])
+    ttt = np.where(fr2, TTT_FR2[:, None], TTT[:, None])
+    a3_threshold = A3Offset[:, None] + hys
+    a3_2_threshold = A3Offset[:, None] - hys
+    gnbs = np.arange(nGnbs)[None, :]
+    penalty = HandoverPenalty(nRows, interval, penalty_time, penalty_dict)
+
+    nr_timer = np.zeros(nRows)
+    handover_started = np.zeros(nRows, dtype=bool)
+    handover_count = np.zeros(nRows, dtype=np.int64)
+    cho_mode = np.zeros(nRows, dtype=bool)
+    candidates = np.zeros((nRows, nGnbs), dtype=bool)
+    timers = np.zeros((nRows, nGnbs))
+    connected_gnb_id = np.full(nRows, -1)
+    row_gnb = np.full(nRows, -1)
+    row_index = np.full(nRows, -1)
+
+    connected = np.empty((nRows, nIntervals), dtype=np.int32)
+    rows_gnb = np.empty((nRows, nIntervals), dtype=np.int32)
+    rows_index = np.empty((nRows, nIntervals), dtype=np.int32)
+    handovers = np.empty((nRows, nIntervals), dtype=np.int64)
+    rows_penalty = np.empty((nRows, nIntervals))
+
+    for index in range(nIntervals):
+        first_gnb_id, second_gnb_id = ranked[ues, index, 0], ranked[ues, index, 1]
+        best_gnb_id = np.where(first_gnb_id == connected_gnb_id, second_gnb_id, first_gnb_id)
+        connected[:, index] = connected_gnb_id
+        rows_gnb[:, index] = row_gnb
+        rows_index[:, index] = row_index
+        handovers[:, index] = handover_count
+        rows_penalty[:, index] = penalty.share
+
+        nr_timer += interval
+        measure = nr_timer >= NrMeasureInt
+        nr_timer = np.where(measure, nr_timer - NrMeasureInt, nr_timer)
+        # Not connected: connect to the best gNB and skip the rest of the tick
+        attach = measure & (connected_gnb_id < 0) & (best_gnb_id >= 0)
+        connected_gnb_id = np.where(attach, best_gnb_id, connected_gnb_id)
+        active = measure & ~attach
+        has_row = row_gnb >= 0
+        connected_rsrp = np.where(has_row, rsrp[ues, np.maximum(row_gnb, 0), np.maximum(row_index, 0)], np.nan)
+        connected_rsrp = penalty.connected_rsrp(connected_rsrp)[:, None]
+        gnb_rsrp = rsrp[ues, :, index]
+        # A3 event from any gNB: enter CHO mode with every gNB meeting its A3 condition as a candidate
+        meets_a3 = (gnb_rsrp >= connected_rsrp + a3_threshold) & (gnbs != connected_gnb_id[:, None])
+        enter = active & has_row & ~handover_started & ~cho_mode & meets_a3.any(axis=1)
+        candidates = np.where(enter[:, None], meets_a3, candidates)
+        timers = np.where(enter[:, None], 0, timers)
+        cho_mode |= enter
+        # CHO mode: drop the candidates hit by A3-2, advance the timers of the others
+        evaluate = (active & cho_mode)[:, None] & candidates
+        a3_2 = evaluate & (gnb_rsrp < connected_rsrp + a3_2_threshold)
+        holding = evaluate & ~a3_2
+        timers = np.where(holding, timers + interval, np.where(a3_2, 0, timers))
+        completed = holding & (timers >= ttt)
+        candidates &= ~a3_2
+        # Execute the handover to the first candidate that completed its TTT
+        handover = completed.any(axis=1)
+        connected_gnb_id = np.where(handover, np.argmax(completed, axis=1), connected_gnb_id)
+        handover_started |= handover
+        handover_count += handover
+        penalty.start(handover)
+        candidates &= ~handover[:, None]
+        if handover.any():
+            logging.debug(f"CHO handover of rows {np.flatnonzero(handover).tolist()} at tick {index}")
+        # Exit CHO mode after a handover or when no candidates remain
+        cho_mode &= ~(active & (handover | ~candidates.any(axis=1)))
+        # Row of the connected gNB for the next ticks, the handover is complete once its interruption elapsed
+        row_gnb = np.where(active, connected_gnb_id, row_gnb)
+        row_index = np.where(active, np.where(connected_gnb_id >= 0, index, -1), row_index)
+        handover_started &= ~penalty.refresh(active, connected_gnb_id)
+
+    return connected, rows_gnb, rows_index, handovers, rows_penalty
+
+
+def simulate_users_batched(nUEs, simDataframes, intervals, Hys, A3Offset, NrMeasureInt, interval, DECISION_PARAMETER,
+                           TTT, bands=None, Hys_FR2=6.0, TTT_FR2=None, penalty_time=0.0, penalty_dict=None,
+                           batchSize=DEFAULT_BATCH_SIZE):
+    """Run the per UE stage of the 3GPP Rel-16 CHO handover for all the UEs with the batched engine.
+
+    Args:
+        nUEs (int): The number of UEs.
+        simDataframes (list): A list of lists of dataframes or a TraceStore.
+        intervals (list): A list of intervals.
+        Hys (float): Hysteresis of the A3 event in FR1 in dB.
+        A3Offset (float): Offset of the A3 event in dB.
+        NrMeasureInt (float): Interval of the NR measurements in seconds.
+        interval (float): The sample time interval in seconds.
+        DECISION_PARAMETER (str): The metric the gNBs are ranked by.
+        TTT (float): Time to trigger in FR1 in seconds.
+        bands (list): The band of every gNB, FR1 or FR2, None for FR1 only.
+        Hys_FR2 (float): Hysteresis of the A3 event in FR2 in dB.
+        TTT_FR2 (float): Time to trigger in FR2 in seconds, TTT if None.
+        penalty_time (float): The handover interruption time in seconds.
+        penalty_dict (dict): The penalty of every trace column during the interruption.
+        batchSize (int): The largest number of UEs advanced together, see simulator_3gpp_batched.batch_size.
+
+    Returns:
+        list: The results of every UE as DataFrames, indexed by UE.
+    """
+    if TTT_FR2 is None:
+        TTT_FR2 = TTT
+    ueResults = []
+    batchSize = batch_size(simDataframes, batchSize)
+    for start in range(0, nUEs, batchSize):
+        ues = range(start, min(start + batchSize, nUEs))
+        ueDataframes = batch_traces(simDataframes, ues)
+        logging.info(f"UEs {ues.start}-{ues.stop - 1} started")
+        ranked, rsrp = stack_metrics(ueDataframes, DECISION_PARAMETER)
+        fr2 = [band == "FR2" for band in bands] if bands is not None else np.zeros(rsrp.shape[1], dtype=bool)
+        selection = advance_cho(ranked, rsrp, fr2, Hys, A3Offset, NrMeasureInt, interval, TTT, Hys_FR2, TTT_FR2,
+                                penalty_time=penalty_time, penalty_dict=penalty_dict)
+        ueResults.extend(gather_results(stack_columns(ueDataframes), intervals, *selection, penalty_dict=penalty_dict))
+        logging.info(f"UEs {ues.start}-{ues.stop - 1} finished")
+    return ueResults
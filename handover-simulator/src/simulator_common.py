@@ -1,144 +1,433 @@
 #!/usr/bin/env python3
 # encoding: UTF-8
+import numpy as np
 import pandas as pd
+import logging
+import multiprocessing as mp
+from collections import deque
 from utils import *
 from occupation import *
+from trace_cube import TraceCubeHandle
+from trace_store import TraceStore
+from scoring import calculate_algorithm_score
 
-def simulate_gnb(gnb, intervals, nUEs, ueResults_df, scenario=None, packetSize=int):
-    gnbResults = []
-    gnb_band = scenario['gnbs'][gnb]['Band_ID']
-    gnb_bw = scenario["bands"][gnb_band]["GNB_Bandwidth_Hz"]
-    gnb_capacity = get_datarate(gnb_bw)
-    for index, interval in enumerate(intervals):
-        interval_data = []
+
+def init_worker(handle):
+    """Initializer of the worker pool, opens the trace cache once in every worker.
+
+    Args:
+        handle (TraceCubeHandle): The trace cache, None if the traces are not cached.
+    """
+    if handle is not None:
+        handle.open()
+
+
+def create_worker_pool(cube=None, processes=None):
+    """Create the process pool an algorithm submits its per UE work to.
+
+    The pool is meant to live for the whole algorithm, so the workers are started and the trace cache
+    is opened only once for all its stages.
+
+    Args:
+        cube (TraceCube): The traces of the run, the workers open its trace cache when it has one.
+        processes (int): The number of workers, one per CPU thread if None.
+
+    Returns:
+        Pool: The worker pool.
+    """
+    handle = cube.handle if cube is not None else None
+    return mp.Pool(processes or mp.cpu_count(), initializer=init_worker, initargs=(handle,))
+
+
+def simulate_users(simulate_user, nUEs, simDataframes, intervals, args, traceStream=None, interval=None, pool=None):
+    """Run the per UE stage of an algorithm.
+
+    The UEs are simulated on a process pool. When a trace stream is given, every UE is submitted as
+    soon as the ns-3 simulations of all its gNBs finish, with its traces. When simDataframes is a
+    TraceStore over the trace cache, each pool task only receives the handle of the cache and its UE
+    index, and the worker memory-maps the cache itself; otherwise a task receives the traces of its
+    own UE and at most two tasks per CPU thread are queued. The workers send back the results as
+    column arrays. Without a pool, a pool is created for the call.
+
+    Args:
+        simulate_user (function): The per UE simulation, called as simulate_user(ue, {ue: dataframes}, intervals, *args).
+        nUEs (int): The number of UEs.
+        simDataframes (list): A list of lists of dataframes or a TraceStore, not used when streaming.
+        intervals (list): A list of intervals.
+        args (tuple): The remaining arguments of simulate_user.
+        traceStream (StreamingTraceCube): The traces of the running simulations.
+        interval (float): The sample time interval in seconds, used to add the derived columns when streaming.
+        pool (Pool): The worker pool, see create_worker_pool.
+
+    Returns:
+        list: The results of every UE as DataFrames, indexed by UE.
+    """
+    if pool is None:
+        with create_worker_pool() as pool:
+            return simulate_users(simulate_user, nUEs, simDataframes, intervals, args, traceStream, interval, pool)
+    ueResults = []
+    if traceStream is not None:
+        tasks = {}
+        waiting = list(range(nUEs))
+        while waiting:
+            for ue in traceStream.wait_for_ues(waiting):
+                waiting.remove(ue)
+                logging.info(f"UE {ue} started")
+                traces = traceStream.ue_dataframes(ue, interval)
+                tasks[ue] = pool.apply_async(simulate_user_task, args=(simulate_user, traces, ue, intervals, args))
         for ue in range(nUEs):
+            ueResults.append(pd.DataFrame(tasks[ue].get()))
+            logging.info(f"UE {ue} finished")
+        return ueResults
+    handle = simDataframes.cube.handle if isinstance(simDataframes, TraceStore) else None
+    # CPU threads
+    max_pending = 2 * mp.cpu_count()
+    pending = deque()
+    for ue in range(nUEs):
+        logging.info(f"UE {ue} started")
+        traces = handle if handle is not None else simDataframes[ue]
+        pending.append((ue, pool.apply_async(simulate_user_task, args=(simulate_user, traces, ue, intervals, args))))
+        # the results are collected in UE order
+        while len(pending) >= max_pending or (ue == nUEs - 1 and pending):
+            done_ue, result = pending.popleft()
+            ueResults.append(pd.DataFrame(result.get()))
+            logging.info(f"UE {done_ue} finished")
+    return ueResults
+
+
+def simulate_user_task(simulate_user, traces, ue, intervals, args):
+    """Pool task of simulate_users.
+
+    Args:
+        simulate_user (function): The per UE simulation.
+        traces (TraceCubeHandle): The trace cache, or the dataframes of the UE, indexed by gNB.
+        ue (int): The UE.
+        intervals (list): A list of intervals.
+        args (tuple): The remaining arguments of simulate_user.
+
+    Returns:
+        dict: The compact results of the UE, one array per column.
+    """
+    if isinstance(traces, TraceCubeHandle):
+        traces = traces.open().ue_dataframes(ue)
+    results = compact_results(simulate_user(ue, {ue: traces}, intervals, *args))
+    return {name: results[name].to_numpy() for name in results.columns}
+
+
+def simulate_stream_batches(simulate_batch, nUEs, traceStream, interval):
+    """Run a batched engine on the UEs of a trace stream, a batch every time some UEs are complete.
+
+    The UEs are independent rows of the batched engines, so their results do not depend on the batch
+    they run in, and the engine runs while the simulations of the other UEs are still writing.
+
+    Args:
+        simulate_batch (function): The batched engine, called with the DataFrames of the UEs of a batch and
+            returning their results, in the same order.
+        nUEs (int): The number of UEs.
+        traceStream (StreamingTraceCube): The traces of the running simulations.
+        interval (float): The sample time interval in seconds, used to add the derived columns.
+
+    Returns:
+        list: The results of every UE, indexed by UE.
+    """
+    ueResults = [None] * nUEs
+    waiting = list(range(nUEs))
+    while waiting:
+        ues = traceStream.wait_for_ues(waiting)
+        for ue in ues:
+            waiting.remove(ue)
+        logging.info(f"Running the batched engine on UEs {ues}")
+        for ue, results in zip(ues, simulate_batch([traceStream.ue_dataframes(ue, interval) for ue in ues])):
+            ueResults[ue] = results
+    return ueResults
+
+
+def gnb_columns(dataframes):
+    """Read the traces of a UE as plain column lists, so the per interval loops index lists instead of
+    building a row Series every tick. The values are the same scalars a row of the DataFrame holds.
+
+    Args:
+        dataframes (list): The dataframes of the UE, indexed by gNB.
+
+    Returns:
+        list: Dicts mapping each column name to the list of its values, indexed by gNB.
+    """
+    return [{name: list(df[name].to_numpy()) for name in df.columns} for df in dataframes]
+
+
+def gnb_row(columns, gnb, index):
+    """Row of a gNB trace at a tick, as a dict, see gnb_columns."""
+    return {name: values[index] for name, values in columns[gnb].items()}
+
+
+def best_neighbours(dataframes, parameter):
+    """Rank the gNBs of every interval by a metric, for all the intervals at once.
+
+    The best gNB of an interval excluding the serving one is the first of the two ranked gNBs that is
+    not the serving one. Ties are ranked by gNB id and gNBs with a -inf or NaN value are never ranked,
+    as in the per gNB scan the A3 simulator did with a strict comparison.
+
+    Args:
+        dataframes (list): The dataframes of the UE, indexed by gNB.
+        parameter (str): The metric, e.g. DECISION_PARAMETER.
+
+    Returns:
+        tuple: The ids of the two best gNBs of every interval, shape [interval, 2], -1 where there is
+            no ranked gNB, and their values.
+    """
+    return rank_gnbs(np.stack([df[parameter].to_numpy(dtype=np.float64) for df in dataframes], axis=1))
+
+
+def rank_gnbs(values):
+    """Two best gNBs of a metric along the last axis, see best_neighbours.
 
-            ue_data = ueResults_df[ue].iloc[index] if ueResults_df[ue].iloc[index]["GNodeB"] == gnb else None
-            if ue_data is not None:
-                interval_data.append(ue_data)
-
-        if interval_data:
-            connectedUEs = len(interval_data)
-            throughput_sum = 0
-            latency_sum = 0
-            rx_packets_diff_sum = 0
-            
-            channel_packet_loss = 0
-
-            for data in interval_data:
-                throughput_sum += data["Throughput"]
-                latency_sum += data["Latency"]*data["Throughput"]
-                rx_packets_diff_sum += data["RxPacketsDiff"]
-                
-            
-                channel_packet_loss += data["LostPackets"]
-            latency_sum = latency_sum / throughput_sum
-            occupation = calculate_occupation(gnb_capacity, throughput_sum)
-
-
-            channel_delay = latency_sum / connectedUEs
-            sim_packet_loss = calculate_lost_packets(occupation, rx_packets_diff_sum)
-            total_packet_loss = sim_packet_loss + channel_packet_loss
-            interval_data_aggregated = {
-                "Time": interval,
-                "Throughput": throughput_sum,
-                "TxBytesDiff": sum(data["TxBytesDiff"] for data in interval_data),
-                "TxPacketsDiff": sum(data["TxPacketsDiff"] for data in interval_data),
-                "RxBytesDiff": sum(data["RxBytesDiff"] for data in interval_data),
-                "RxPacketsDiff": rx_packets_diff_sum,
-                "Latency": latency_sum,
-                "Jitter": sum(data["Jitter"] for data in interval_data),
-                "LostPackets": total_packet_loss,
-                "simLostPackets": sim_packet_loss,
-                "ConnectedUEs": connectedUEs,
-                "MeanThroughput": throughput_sum / connectedUEs,
-                "Occupation": occupation,
-                "offeredRate": throughput_sum,
-                "GnbCapacity": gnb_capacity,
-                "ChannelDelay": channel_delay,
-                "ChannelPacketLoss": channel_packet_loss,
-                "PLostPackets": calculate_lost_packets(occupation, rx_packets_diff_sum, 0)/rx_packets_diff_sum if rx_packets_diff_sum != 0 else 0,
-            }
-            interval_data_aggregated = apply_channel_simulation(interval_data_aggregated, occupation, gnb_capacity, packet_length=packetSize)
-            gnbResults.append(interval_data_aggregated)
-        else:
-            gnbResults.append({
-                "Time": interval,
-                "Throughput": 0,
-                "TxPacketsAcc": 0,
-                "TxBytesAcc": 0,
-                "TxBytesDiff": 0,
-                "TxPacketsDiff": 0,
-                "RxBytesAcc": 0,
-                "RxPacketsAcc": 0,
-                "RxBytesDiff": 0,
-                "RxPacketsDiff": 0,
-                "Latency": 0,
-                "Jitter": 0,
-                "LostPackets": 0,
-                "simLostPackets": 0,
-                "ConnectedUEs": 0,
-                "MeanThroughput": 0,
-                "Occupation": 0,
-                "SimLatency": 0,
-                "PLostPackets": 0,
-                "Handovers": 0,
-            })
-        
-    # calculate the accumulated values
-    accSimLoss = 0
-    for i in range(0, len(gnbResults)):
-        gnbResults[i]["RxPacketsAcc"] = sum(data["RxPacketsDiff"] for data in gnbResults[0:i])
-        gnbResults[i]["RxBytesAcc"] = sum(data["RxBytesDiff"] for data in gnbResults[0:i])
-        gnbResults[i]["TxPacketsAcc"] = sum(data["TxPacketsDiff"] for data in gnbResults[0:i])
-        gnbResults[i]["TxBytesAcc"] = sum(data["TxBytesDiff"] for data in gnbResults[0:i])
-        
-        accSimLoss += gnbResults[i]["simLostPackets"]
-        gnbResults[i]["RxPacketsAcc"] = gnbResults[i]["RxPacketsAcc"] - accSimLoss
-        gnbResults[i]["RxBytesAcc"] = gnbResults[i]["RxBytesAcc"] - (accSimLoss * packetSize)
-        
-    return gnbResults
-
-
-
-# Takes the results of the gNB and recalculates the metric for the UEs with the occupation model
-def simulate_user_restricted(ueResults_df, gnbResults_list, ue, intervals, packetSize):
-    # Initialize an empty DataFrame to store results
-    results = []
-
-    # Take the data from the UE
-    ue_data = ueResults_df[ue]
-
-    # Iterate over the intervals
-    for i in range(len(intervals)):
-        # Take the UE data for the interval (should be one and only one row)
-        ue_interval_data = ue_data.iloc[i]
-
-        # Take the gNB connected to the UE
-        gnb =ue_interval_data["GNodeB"]
-
-        # Check if the value is null or NaN
-        if pd.isna(gnb) or pd.isnull(gnb):
-            ue_interval_data = ue_interval_data.copy()
-            ue_interval_data["Latency"] = 0
-            ue_interval_data['PLostPackets'] = 0
-            ue_interval_data['SimLatency'] = 0
-
-            results.append(ue_interval_data)
-            continue
-
-        # Take the gNB data for the interval
-        gnb_data =gnbResults_list[int(gnb)]
-        gnb_interval_data = gnb_data.iloc[i]
-
-        # Get the occupation
-        occupation = gnb_interval_data["Occupation"]
-
-        # Channel simulation for the UE
-        ue_ideal_throughput = ue_interval_data["Throughput"]
-        ue_interval_data = apply_channel_simulation(ue_interval_data, occupation, ue_ideal_throughput, packetSize)
-        
-        # Append the modified UE interval data to the results DataFrame
-        results.append(ue_interval_data)
-    results = pd.DataFrame(results)
-    return results
+    Args:
+        values (ndarray): The metric, shape [..., gNB].
+
+    Returns:
+        tuple: The ids of the two best gNBs, shape [..., 2], -1 where there is no ranked gNB, and their values.
+    """
+    values = np.where(np.isnan(values), -np.inf, values)
+    if values.shape[-1] < 2:
+        values = np.concatenate([values, np.full(values.shape[:-1] + (2 - values.shape[-1],), -np.inf)], axis=-1)
+    order = np.argsort(-values, axis=-1, kind="stable")[..., :2]
+    best = np.take_along_axis(values, order, axis=-1)
+    return np.where(best > -np.inf, order, -1), best
+
+
+# Columns of the gNB results, in the order they are written. Every interval has all the columns, the
+# metrics of the intervals without connected UEs are zero. ConnectedUEs and Handovers are int64, all
+# the other columns are float64: the counters are sums of the UE counters, which the handover penalty
+# and the channel simulation can make fractional.
+GNB_COLUMNS = ["Time", "Throughput", "TxPacketsAcc", "TxBytesAcc", "TxBytesDiff", "TxPacketsDiff", "RxBytesAcc",
+               "RxPacketsAcc", "RxBytesDiff", "RxPacketsDiff", "Latency", "Jitter", "LostPackets", "simLostPackets",
+               "ConnectedUEs", "MeanThroughput", "Occupation", "SimLatency", "PLostPackets", "Handovers",
+               "offeredRate", "GnbCapacity", "ChannelDelay", "ChannelPacketLoss"]
+GNB_INTEGER_COLUMNS = ["ConnectedUEs", "Handovers"]
+# Counters of the per UE results the gNB metrics sum
+UE_SUM_COLUMNS = ["TxBytesDiff", "TxPacketsDiff", "RxBytesDiff", "RxPacketsDiff", "LostPackets"]
+# Columns of the restricted UE results recalculated with the occupation of the gNB, all float64. They
+# replace the columns of the UE results, SimLatency and PLostPackets are added after them.
+RESTRICTED_COLUMNS = ["Throughput", "Latency", "RxPacketsDiff", "RxBytesDiff", "LostPackets", "SimLatency",
+                      "PLostPackets"]
+
+
+def stack_ue_results(ueResults_df, nUEs):
+    """Stack the per UE results the gNB metrics are aggregated from.
+
+    Args:
+        ueResults_df (list): The results of every UE as DataFrames, indexed by UE.
+        nUEs (int): The number of UEs.
+
+    Returns:
+        dict: Every column as an array of shape [UE, interval], GNodeB is NO_GNB while the UE is not
+            connected. The counters are int64 if they are integers for every UE, so their sums over the
+            UEs are exact, and float64 otherwise.
+    """
+    def stack(name, dtype):
+        return np.stack([pd.to_numeric(ueResults_df[ue][name]).to_numpy(dtype=dtype, na_value=np.nan)
+                         if dtype == np.float64 else ueResults_df[ue][name].to_numpy(dtype=dtype)
+                         for ue in range(nUEs)])
+
+    columns = {"GNodeB": np.nan_to_num(stack("GNodeB", np.float64), nan=NO_GNB).astype(np.int64)}
+    for name in ["Throughput", "Latency", "Jitter"]:
+        columns[name] = stack(name, np.float64)
+    for name in UE_SUM_COLUMNS:
+        integer = all(pd.api.types.is_integer_dtype(ueResults_df[ue][name]) for ue in range(nUEs))
+        columns[name] = stack(name, np.int64 if integer else np.float64)
+    return columns
+
+
+def queue_models(queueModel):
+    """The list of queue models of a queue model or a list of them."""
+    return list(queueModel) if isinstance(queueModel, (list, tuple)) else [queueModel]
+
+
+def simulate_gnbs(nGnbs, intervals, nUEs, ueResults_df, scenario, packetSize, queueModel=MD1_QUEUE, ue_columns=None):
+    """Compute the metrics of every gNB from the results of the UEs connected to it.
+
+    The results of all the UEs are grouped by (gNB, interval) in one pass: the sums of every group are
+    bincounts over the stacked UE results, in UE order, and the occupation and the channel simulation of
+    occupation.apply_channel_simulation_array are applied to the [gNB, interval] arrays. The accumulated
+    columns are cumulative sums of the previous intervals, minus the packets lost by the occupation up to
+    the interval. With a list of queue models the channel simulation of every model runs on the same
+    sums and every model has its gNB results.
+
+    Args:
+        nGnbs (int): The number of gNBs.
+        intervals (list): A list of intervals.
+        nUEs (int): The number of UEs.
+        ueResults_df (list): The results of every UE as DataFrames, indexed by UE.
+        scenario (Scenario): The scenario information.
+        packetSize (int): The packet size in bytes.
+        queueModel (QueueModel): The queue model of the gNBs, M/D/1 by default, or a list of them.
+        ue_columns (dict): The UE results stacked by stack_ue_results, stacked from ueResults_df if None.
+
+    Returns:
+        list: The results of every gNB as DataFrames with the GNB_COLUMNS, one row per interval, indexed by gNB.
+            With a list of queue models, the list of the results of every model.
+    """
+    models = queue_models(queueModel)
+    nIntervals = len(intervals)
+    if ue_columns is None:
+        ue_columns = stack_ue_results(ueResults_df, nUEs)
+    gnb = ue_columns["GNodeB"]
+    connected = (gnb >= 0) & (gnb < nGnbs)
+    # Group of every UE interval, gNB-major so the sums reshape to [gNB, interval]
+    groups = (gnb * nIntervals + np.arange(nIntervals))[connected]
+
+    def group_sum(values):
+        return np.bincount(groups, weights=values[connected], minlength=nGnbs * nIntervals).reshape(nGnbs, nIntervals)
+
+    def group_count(values):
+        # The integer counters are summed as integers, exact for any count
+        if values.dtype != np.int64:
+            return group_sum(values)
+        sums = np.zeros(nGnbs * nIntervals, dtype=np.int64)
+        np.add.at(sums, groups, values[connected])
+        return sums.reshape(nGnbs, nIntervals)
+
+    connected_ues = np.bincount(groups, minlength=nGnbs * nIntervals).reshape(nGnbs, nIntervals)
+    active = connected_ues > 0
+    throughput_sum = group_sum(ue_columns["Throughput"])
+    # Mean latency of the gNB weighted by the throughput of its UEs
+    with np.errstate(divide="ignore", invalid="ignore"):
+        latency_sum = group_sum(ue_columns["Latency"] * ue_columns["Throughput"]) / throughput_sum
+    sums = {name: group_count(ue_columns[name]) for name in UE_SUM_COLUMNS}
+    gnb_capacity = scenario.gnb_capacity[:nGnbs, None]
+    occupation = throughput_sum / gnb_capacity
+    # Packets lost because of the occupation, before the channel simulation caps them to the received packets
+    sim_lost = calculate_lost_packets_array(occupation, sums["RxPacketsDiff"])
+    channel_lost = sums["LostPackets"]
+    channel = apply_channel_simulation_array({
+        "Throughput": throughput_sum,
+        "Latency": latency_sum,
+        "RxPacketsDiff": sums["RxPacketsDiff"],
+        "RxBytesDiff": sums["RxBytesDiff"],
+        "LostPackets": sim_lost + channel_lost,
+        }, occupation, gnb_capacity, packetSize, models)
+
+    def zero_idle(values):
+        return np.where(active, values, 0)
+
+    def previous_sum(values):
+        # Sum of the previous intervals of every gNB
+        return np.cumsum(values, axis=-1) - values
+
+    sim_lost = zero_idle(sim_lost)
+    acc_sim_lost = np.cumsum(sim_lost, axis=-1)
+    rx_packets_diff = zero_idle(channel["RxPacketsDiff"])
+    rx_bytes_diff = zero_idle(channel["RxBytesDiff"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_throughput = throughput_sum / connected_ues
+        channel_delay = latency_sum / connected_ues
+    gnbColumns = {
+        "Time": np.broadcast_to(np.asarray(intervals, dtype=np.float64), (nGnbs, nIntervals)),
+        "Throughput": zero_idle(channel["Throughput"]),
+        "TxPacketsAcc": previous_sum(sums["TxPacketsDiff"]),
+        "TxBytesAcc": previous_sum(sums["TxBytesDiff"]),
+        "TxBytesDiff": sums["TxBytesDiff"],
+        "TxPacketsDiff": sums["TxPacketsDiff"],
+        "RxBytesAcc": previous_sum(rx_bytes_diff) - (acc_sim_lost * packetSize),
+        "RxPacketsAcc": previous_sum(rx_packets_diff) - acc_sim_lost,
+        "RxBytesDiff": rx_bytes_diff,
+        "RxPacketsDiff": rx_packets_diff,
+        "Latency": zero_idle(channel["Latency"]),
+        "Jitter": zero_idle(group_sum(ue_columns["Jitter"])),
+        "LostPackets": zero_idle(channel["LostPackets"]),
+        "simLostPackets": sim_lost,
+        "ConnectedUEs": connected_ues,
+        "MeanThroughput": zero_idle(mean_throughput),
+        "Occupation": zero_idle(occupation),
+        "SimLatency": zero_idle(channel["SimLatency"]),
+        "PLostPackets": zero_idle(channel["PLostPackets"]),
+        "Handovers": np.zeros((nGnbs, nIntervals), dtype=np.int64),
+        "offeredRate": throughput_sum,
+        "GnbCapacity": np.broadcast_to(gnb_capacity, (nGnbs, nIntervals)),
+        "ChannelDelay": zero_idle(channel_delay),
+        "ChannelPacketLoss": channel_lost,
+    }
+    # The channel metrics have a leading axis per queue model, the others are the same for every model
+    shape = (len(models), nGnbs, nIntervals)
+    gnbColumns = {name: np.broadcast_to(values, shape).astype(np.int64 if name in GNB_INTEGER_COLUMNS else np.float64)
+                  for name, values in gnbColumns.items()}
+    gnbResults = [[pd.DataFrame({name: gnbColumns[name][m, g] for name in GNB_COLUMNS}) for g in range(nGnbs)]
+                  for m in range(len(models))]
+    return gnbResults if isinstance(queueModel, (list, tuple)) else gnbResults[0]
+
+
+def calculate_scenario_score(ueResults_df, intervals, nUEs, nGnbs, scenario, packetSize):
+    """Score of a set of per UE results, the one the algorithms write to scenario-score.txt.
+
+    Only the last interval of the scenario metrics is built, the score is the data received by all
+    the gNBs at the end of the simulation.
+
+    Args:
+        ueResults_df (list): The results of every UE as DataFrames, indexed by UE.
+        intervals (list): A list of intervals.
+        nUEs (int): The number of UEs.
+        nGnbs (int): The number of gNBs.
+        scenario (Scenario): The scenario information.
+        packetSize (int): The packet size in bytes.
+
+    Returns:
+        float: The score of the scenario.
+    """
+    last_rows = [gnbResults.iloc[-1] for gnbResults in simulate_gnbs(nGnbs, intervals, nUEs, ueResults_df, scenario, packetSize)]
+    scenarioResults = pd.DataFrame([pd.DataFrame(last_rows).agg({"RxBytesAcc": "sum"})])
+    return calculate_algorithm_score(scenarioResults)
+
+
+def simulate_users_restricted(ueResults_df, gnbResults_list, nUEs, intervals, packetSize, queueModel=MD1_QUEUE,
+                              ue_columns=None):
+    """Recalculate the metrics of every UE with the occupation of the gNB it is connected to.
+
+    The occupation of every UE interval is gathered from the [gNB, interval] occupation matrix, and the
+    channel simulation of apply_channel_simulation_array, with the UE throughput as the capacity, runs
+    on the [UE, interval] arrays of all the UEs at once. The intervals in which a UE is not connected
+    keep their metrics, with no latency. With a list of queue models the occupations are the same for
+    every model and the channel simulation of every model runs on them.
+
+    Args:
+        ueResults_df (list): The results of every UE as DataFrames, indexed by UE.
+        gnbResults_list (list): The results of every gNB as DataFrames, see simulate_gnbs, with the same
+            queue models.
+        nUEs (int): The number of UEs.
+        intervals (list): A list of intervals.
+        packetSize (int): The packet size in bytes.
+        queueModel (QueueModel): The queue model of the gNBs, M/D/1 by default, or a list of them.
+        ue_columns (dict): The UE results stacked by stack_ue_results, stacked from ueResults_df if None.
+
+    Returns:
+        list: The restricted results of every UE as DataFrames, indexed by UE. With a list of queue models,
+            the list of the results of every model.
+    """
+    nIntervals = len(intervals)
+    models = queue_models(queueModel)
+    if isinstance(queueModel, (list, tuple)):
+        gnbResults_list = gnbResults_list[0]
+    occupations = np.stack([gnbResults["Occupation"].to_numpy(dtype=np.float64) for gnbResults in gnbResults_list])
+    if ue_columns is None:
+        ue_columns = stack_ue_results(ueResults_df, nUEs)
+    gnb = ue_columns["GNodeB"]
+    connected = (gnb >= 0) & (gnb < len(gnbResults_list))
+    occupation = np.where(connected, occupations[np.where(connected, gnb, 0), np.arange(nIntervals)], 0)
+    # Channel simulation with the throughput of the UE as the capacity
+    channel = apply_channel_simulation_array(ue_columns, occupation, ue_columns["Throughput"], packetSize, models)
+    restricted = {name: np.where(connected, channel[name], ue_columns[name])
+                  for name in ["Throughput", "RxPacketsDiff", "RxBytesDiff", "LostPackets"]}
+    # The intervals in which the UE is not connected have no latency
+    for name in ["Latency", "SimLatency", "PLostPackets"]:
+        restricted[name] = np.where(connected, channel[name], 0)
+
+    restrictedResults = []
+    for m in range(len(models)):
+        ueResults = []
+        for ue in range(nUEs):
+            # The other columns keep the values and types of the UE results
+            results = ueResults_df[ue].copy()
+            for name in RESTRICTED_COLUMNS:
+                results[name] = restricted[name][m, ue].astype(np.float64)
+            ueResults.append(results)
+        restrictedResults.append(ueResults)
+    return restrictedResults if isinstance(queueModel, (list, tuple)) else restrictedResults[0]
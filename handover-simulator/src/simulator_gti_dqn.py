@@ -8,8 +8,8 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import os
-import simulator_common
-from scoring import calculate_algorithm_score
+from occupation import MD1_QUEUE
+from postprocessing import post_process, SCENARIO_DQN
 
 
 def weighted_avg(df, value_column, weight_column):
@@ -21,7 +21,7 @@ os.environ["KERAS_BACKEND"] = "jax"
 ALGORITHM = "DDQN"
 
 
-def simulate_gti_dqn_handover(nUEs=False,debug=False,traces_sim_folder=str, nGnbs=int, interval=float ,simDataframes=None ,intervals=None ,scenario=None, packetSize=int, penalty_dict=None, penalty_time=0.1):
+def simulate_gti_dqn_handover(nUEs=False,debug=False,traces_sim_folder=str, nGnbs=int, interval=float ,simDataframes=None ,intervals=None ,scenario=None, packetSize=int, penalty_dict=None, penalty_time=0.1, queueModel=MD1_QUEUE):
     # create result folder if not exists
     result_folder_path = traces_sim_folder + "/results"
     print(result_folder_path)
@@ -221,77 +221,9 @@ def simulate_gti_dqn_handover(nUEs=False,debug=False,traces_sim_folder=str, nGnb
     # save the traces
     traces = env.get_traces()
     
-    #save the traces
-    if not os.path.exists(f"{result_folder_path}/ue-ideal"):
-        os.makedirs(f"{result_folder_path}/ue-ideal")
-        
-    for ue_id in range(nUEs):
-        traces[ue_id].to_csv(f"{result_folder_path}/ue-ideal/UE-{ue_id}.csv", index=False)
-    print("Saved traces to ",f"{result_folder_path}/ue-ideal/UE-{ue_id}.csv")
-
-    # gnb simulation
-    if not os.path.exists(f"{result_folder_path}/gnb"):
-        os.makedirs(f"{result_folder_path}/gnb")
-    gnb_results = []
-    for  gnb_id in range(nGnbs):
-        gnb_result = simulator_common.simulate_gnb( gnb_id, intervals, nUEs,traces,scenario, packetSize)
-        gnb_results.append(pd.DataFrame(gnb_result))
-        pd.DataFrame(gnb_result).to_csv(f"{result_folder_path}/gnb/GNB-{gnb_id}.csv", index=False)
-        
-    # execute the restricted simulation
-    restricted_ue_results = []
-    # create a folder to save the results
-    if not os.path.exists(f"{result_folder_path}/ue-restricted"):
-        os.makedirs(f"{result_folder_path}/ue-restricted")
-    for ue_id in range(nUEs):
-        ue_result = simulator_common.simulate_user_restricted(traces,gnb_results, ue_id, intervals, packetSize)
-        restricted_ue_results.append(ue_result)
-        pd.DataFrame(ue_result).to_csv(f"{result_folder_path}/ue-restricted/UE-{ue_id}.csv", index=False)
-
-    # convert the list of dataframes to a single dataframe
-    gnbs_metrics = pd.concat(gnb_results)
-    # aggregate the fields
-    throughput_total = gnbs_metrics['Throughput'].sum()
-
-    gnbs_metrics["Latency"] = gnbs_metrics['Latency'] * gnbs_metrics['Throughput']
-
-    gnbs_metrics = gnbs_metrics.groupby(['Time']).agg({
-        'Throughput': 'sum',
-        'TxPacketsAcc': 'sum',
-        'TxBytesAcc': 'sum',
-        'TxBytesDiff': 'sum',
-        'TxPacketsDiff': 'sum',
-        'Latency': 'mean',
-        'RxPacketsAcc': 'sum',
-        'RxBytesAcc': 'sum',
-        'RxBytesDiff': 'sum',
-        'RxPacketsDiff': 'sum',
-        'Jitter': 'mean',
-        'LostPackets': 'sum',
-        'ConnectedUEs': 'sum',
-        'Occupation': 'mean',
-        'PLostPackets': 'mean',
-    })
-    # Calculate total throughput
-    gnbs_metrics["Latency"] = gnbs_metrics['Latency'] / gnbs_metrics['Throughput']
-    
-    # Calculate new latency
-    meanThroughput = gnbs_metrics['Throughput'] / nGnbs
-    gnbs_metrics['MeanThroughput'] = gnbs_metrics['Throughput'] / nGnbs
-
-    print("Saving the results")
-    # save the results to a file into the results folder
-    gnbs_metrics_file = os.path.join(result_folder_path, "scenario.csv")
-    gnbs_metrics.to_csv(gnbs_metrics_file)
+    score = post_process(result_folder_path, traces, intervals, nGnbs, scenario, packetSize, SCENARIO_DQN, queueModel)
     print(f"Finished {ALGORITHM} algorithm simulation")
-
-    #save the score of the algorithm
-    score = calculate_algorithm_score(gnbs_metrics)
     print(f"Scenario Score: {score}")
-    # save the score in a file
-    score_file = os.path.join(result_folder_path, "scenario-score.txt")
-    with open(score_file, "w") as file:
-        file.write(str(int(score)))
     
 
 
@@ -11,6 +11,8 @@ from scoring import *
 import logging
 from nrEvents import *
 from simulator_common import *
+from occupation import MD1_QUEUE
+from postprocessing import post_process, SCENARIO_SBGH, SCENARIO_IDEAL_SBGH
 
 
 ALGORITHM = "SBGH"
@@ -26,7 +28,42 @@ SCORE_THRESHOLD = 1.25
 HANDOVER_INTERVAL = 100 # The interval for the handover calculation, in multiples of the t_interval
 
 
-def simulate_sbgh_users(nUEs=int ,simDataframes=None ,intervals=None, interval=None ,scenario=None, alpha=float, beta=float,delay = 0,penalty_dict=None,penalty_time=float):
+class GnbLoad:
+    """Number of UEs connected to every gNB, updated when a UE attaches to or detaches from a gNB.
+
+    The connected UEs and the remaining throughput of the gNBs are arrays indexed by gNB id, and the
+    admission check of a gNB takes constant time instead of counting the UEs connected to it.
+
+    Args:
+        scenario (Scenario): The scenario, with the capacity of every gNB and of its UEs.
+    """
+
+    def __init__(self, scenario):
+        self.gnb_capacity = scenario.gnb_capacity
+        self.user_capacity = scenario.user_capacity
+        self.connected_ues = np.zeros(len(scenario.gnbs), dtype=np.int64)
+        self.remaining_throughput = scenario.gnb_capacity.copy()
+
+    def update(self, gnb_id, change):
+        """Add a change to the UEs connected to a gNB."""
+        self.connected_ues[gnb_id] += change
+        self.remaining_throughput[gnb_id] = self.gnb_capacity[gnb_id] - self.connected_ues[gnb_id] * self.user_capacity[gnb_id]
+
+    def move(self, previous_gnb_id, gnb_id):
+        """Move a UE from a gNB to another, None or -1 if the UE is not connected."""
+        if previous_gnb_id == gnb_id:
+            return
+        if previous_gnb_id is not None and previous_gnb_id >= 0:
+            self.update(previous_gnb_id, -1)
+        if gnb_id is not None and gnb_id >= 0:
+            self.update(gnb_id, 1)
+
+    def admits(self, gnb_id):
+        """Whether a gNB has the throughput for one more UE."""
+        return self.remaining_throughput[gnb_id] > 0
+
+
+def simulate_sbgh_users(nUEs=int ,simDataframes=None ,intervals=None, interval=None ,scenario=None, alpha=float, beta=float,delay = 0,penalty_dict=None,penalty_time=float, scoreTensor=None):
     """Simulate the SBGH/GTI handover algorithm for the UEs.
 
     Args:
@@ -34,12 +71,13 @@ def simulate_sbgh_users(nUEs=int ,simDataframes=None ,intervals=None, interval=N
         interval (float): The interval of the simulation.
         simDataframes (list): A list of lists of dataframes.
         intervals (list): A list of intervals.
-        scenario (dict): The scenario data.
+        scenario (Scenario): The scenario data.
         alpha (float): The alpha parameter for the score calculation.
         beta (float): The beta parameter for the score calculation.
         delay (int): The delay in intervals for the handover decision.
         penalty_dict (dict): A dictionary containing the penalty values for each gNB.
         penalty_time (float): The penalty time for the handover, the time the connection gets degraded after each handover.
+        scoreTensor (ndarray): The score of every UE, gNB and interval from calculate_score_tensor, computed if None.
 
     Returns:
         list: A list of dataframes containing the simulation results.
@@ -49,30 +87,18 @@ def simulate_sbgh_users(nUEs=int ,simDataframes=None ,intervals=None, interval=N
     else:
         algorithm = "SBGH"
     logging.info(f"Starting  {algorithm} Algorithm Handover Simulation")
-    gnbs = scenario['gnbs']
-    bands = scenario['bands']
-    # create a structure to store the UEs connected to each gNB
-    connected_ues = {}
     ues_connected_gnbs = [-1] * nUEs
     handover_flag = False
     
         
     timers = [0] * nUEs  
     penalty_timers = [0] * nUEs  
-    # create the value Remaining bandwidth for each gNB
-    for gnb in gnbs:
-        # create a list of connected UEs for each gNB
-        connected_ues[gnb["GNB_ID"]] = []
-        for band in bands:
-            if band['Band_ID'] == gnb['Band_ID']:
-                gnb['RemainingThroughput'] = get_datarate(band['GNB_Bandwidth_Hz']) 
-                gnb["GnBBandwidth"] = band['GNB_Bandwidth_Hz']
-                gnb["UserBandwidth"] = band['User_Bandwidth_Hz']
-                gnb["MaxUsers"] = math.floor(band['GNB_Bandwidth_Hz'] / band['User_Bandwidth_Hz'])
-                gnb['GnBThroughput'] = get_datarate(band['GNB_Bandwidth_Hz'])
-                gnb['UserThroughput'] = get_datarate(band['User_Bandwidth_Hz'])
-                gnb["connected_ues"] = 0
-                break
+    # the UEs connected to each gNB and their remaining throughput
+    load = GnbLoad(scenario)
+    # the score of every connection, the decisions read the scores of the delayed interval
+    if scoreTensor is None:
+        rsrp = np.array([[df["Rsrp"].to_numpy(dtype=np.float64) for df in dataframes] for dataframes in simDataframes])
+        scoreTensor = calculate_score_tensor(rsrp, scenario, alpha, beta)
             
                 
                 
@@ -91,13 +117,6 @@ def simulate_sbgh_users(nUEs=int ,simDataframes=None ,intervals=None, interval=N
             delay_index = index - delay # delay the decision by DELAY_INTERVALS
         
         print_progress(index+1, len(intervals), prefix = 'UE Simulation Progress:', suffix = 'Complete')
-        # reset the gNB remaining throughput
-        for gnb in gnbs:
-            for band in bands:
-                if band['Band_ID'] == gnb['Band_ID']:
-                    connected_ues_count = sum([1 for y in ues_connected_gnbs if y == gnb["GNB_ID"]])
-                    #print(f"Index: {index} - gnb {gnb['GNB_ID']} - Connected UEs: {connected_ues_count} - Max Users: {gnb['MaxUsers']}")
-                    break
         interval_scores = []
         for user in range(nUEs):
 
@@ -126,27 +145,16 @@ def simulate_sbgh_users(nUEs=int ,simDataframes=None ,intervals=None, interval=N
             
             if ues_connected_gnbs[user] != -1:
                 connected_gnb_id = ues_connected_gnbs[user]
-                
-            for gnb in gnbs:
-                for band in bands:
-                    if band['Band_ID'] == gnb['Band_ID']:
-                        connected_ues_count = sum([1 for y in ues_connected_gnbs if y == gnb["GNB_ID"]])
-                        gnb['connected_ues'] = connected_ues_count
-                        break
             
             if connected_gnb_id is  None or index % HANDOVER_INTERVAL == 0:
-                for file_id, df in enumerate(dataframes):
-                    gnb_data = get_gnb_data(file_id, dataframes, delay_index)
-                    score = calculate_score(gnb_data, scenario, file_id, alpha, beta)
+                for file_id, score in enumerate(scoreTensor[user, :, delay_index].tolist()):
                     scores.append({"GNB_ID": file_id, "score": score})
                 scores = sorted(scores, key=lambda x: x["score"], reverse=True)
                 interval_scores.append(scores)
                 # Candidate criteria: the gNB has a positive score and the gNB has enough bandwidth for the UE considering a ideal scenario
                 
                 for score in scores:
-                    gnb = gnbs[score["GNB_ID"]]
-                    connected_ues_count = sum([1 for y in ues_connected_gnbs if y == gnb["GNB_ID"]])
-                    if score["score"] > 0 and (connected_ues_count)* gnb["UserThroughput"] < gnb["GnBThroughput"]:
+                    if score["score"] > 0 and load.admits(score["GNB_ID"]):
                         candidates.append(score)
                 if len(candidates) > 0:
                     #print(f"Best candidate is {candidates}")
@@ -197,6 +205,7 @@ def simulate_sbgh_users(nUEs=int ,simDataframes=None ,intervals=None, interval=N
                             
             
                         
+            load.move(ues_connected_gnbs[user], connected_gnb_id)
             ues_connected_gnbs[user] = connected_gnb_id
             if connected_gnb_id is not None:
                 connected_gnb = get_gnb_data(connected_gnb_id,dataframes, delay_index)
@@ -209,15 +218,6 @@ def simulate_sbgh_users(nUEs=int ,simDataframes=None ,intervals=None, interval=N
                 connected_gnb = None
                 connected_gnb_delay = None
                     # take the data for the connected gNB
-            for gnb in gnbs:
-                for band in bands:
-                    if band['Band_ID'] == gnb['Band_ID']:
-                        # number of UEs connected to the gNB
-                        # 1 if the UE is connected to the gNB, 0 otherwise for each y = ues_connected_gnbs[user] == gnb["GNB_ID"]
-                        # the sum of the y values is the number of UEs connected to the gNB
-                        connected_ues_count = sum([1 for y in ues_connected_gnbs if y == gnb["GNB_ID"]])
-                        gnb['connected_ues'] = connected_ues_count
-                        break            
                         
                             
             if connected_gnb_delay is not None:
@@ -230,7 +230,7 @@ def simulate_sbgh_users(nUEs=int ,simDataframes=None ,intervals=None, interval=N
                 lost_packets = connected_gnb_delay["LostPacketsDiff"]
                 distance = connected_gnb_delay["Distance"]
                 rsrp = connected_gnb_delay["Rsrp"]
-                position = connected_gnb_delay["UE Position"]
+                position = (connected_gnb_delay["PosX"], connected_gnb_delay["PosY"], connected_gnb_delay["PosZ"])
                 throughput = connected_gnb_delay["Throughput"]
                 
                 #sysTime = connected_gnb_delay["System Time"].values[0]
@@ -246,7 +246,9 @@ def simulate_sbgh_users(nUEs=int ,simDataframes=None ,intervals=None, interval=N
                 jitter = 0
                 rsrp = None
                 distance = None
-                position = gnb_data["UE Position"]
+                # the position of the UE in the trace of the last gNB, as scored in this interval
+                gnb_data = get_gnb_data(len(dataframes) - 1, dataframes, delay_index)
+                position = (gnb_data["PosX"], gnb_data["PosY"], gnb_data["PosZ"])
 
             
 
@@ -265,12 +267,14 @@ def simulate_sbgh_users(nUEs=int ,simDataframes=None ,intervals=None, interval=N
                 "LostPackets": lost_packets,
                 "Distance": distance,
                 "Rsrp": rsrp,
-                "UE Position": position,
+                "PosX": position[0],
+                "PosY": position[1],
+                "PosZ": position[2],
                 "Handovers": handovers,
             }
             results[user].append(interval_metrics)
     for user in range(nUEs):
-        results[user] = pd.DataFrame(results[user])
+        results[user] = compact_results(results[user])
         # calculate the adding the Diff values per each interval
         results[user]["TxBytesAcc"] = results[user]["TxBytesDiff"].cumsum()
         results[user]["TxPacketsAcc"] = results[user]["TxPacketsDiff"].cumsum()
@@ -279,7 +283,7 @@ def simulate_sbgh_users(nUEs=int ,simDataframes=None ,intervals=None, interval=N
     return results,results_score
 
 
-def simulate_sbgh_handover(nUEs=False,debug=False,traces_sim_folder=str, nGnbs=int, interval=float ,simDataframes=None ,intervals=None ,scenario=None, packetSize=int, alpha=float, beta=float, penalty_dict=None, penalty_time=float):
+def simulate_sbgh_handover(nUEs=False,debug=False,traces_sim_folder=str, nGnbs=int, interval=float ,simDataframes=None ,intervals=None ,scenario=None, packetSize=int, alpha=float, beta=float, penalty_dict=None, penalty_time=float, scoreTensor=None, queueModel=MD1_QUEUE):
         """Simulate the proposed SBGH handover algorithm.
 
         Args:
@@ -291,18 +295,20 @@ def simulate_sbgh_handover(nUEs=False,debug=False,traces_sim_folder=str, nGnbs=i
             interval (float): The interval of the simulation.
             simDataframes (list): A list of lists of dataframes.
             intervals (list): A list of intervals.
-            scenario (dict): The scenario data.
+            scenario (Scenario): The scenario data.
             packetSize (int): The packet size.
             alpha (float): The alpha parameter for the score calculation.
             beta (float): The beta parameter for the score calculation.
             penalty_dict (dict): A dictionary containing the penalty values for each gNB.
             penalty_time (float): The penalty time for the handover, the time the connection gets degraded after each handover.
+            scoreTensor (ndarray): The scores of calculate_score_tensor, shared with ideal-SBGH, computed if None.
+            queueModel (QueueModel): The queue model of the gNBs, or a list of them, see post_process.
             
         
         Returns:
             None
         """
-        ue_results, score_results = simulate_sbgh_users(nUEs ,simDataframes ,intervals,interval,scenario,alpha, beta, delay = 1, penalty_dict=penalty_dict, penalty_time=penalty_time)
+        ue_results, score_results = simulate_sbgh_users(nUEs ,simDataframes ,intervals,interval,scenario,alpha, beta, delay = 1, penalty_dict=penalty_dict, penalty_time=penalty_time, scoreTensor=scoreTensor)
         results_folder = os.path.join(traces_sim_folder, "results")
         if not os.path.isdir(results_folder):
             os.mkdir(results_folder)
@@ -314,88 +320,11 @@ def simulate_sbgh_handover(nUEs=False,debug=False,traces_sim_folder=str, nGnbs=i
         scores_folder = os.path.join(results_folder, "scores")
         if not os.path.isdir(scores_folder):
             os.mkdir(scores_folder)
-        ue_results_folder = os.path.join(results_folder, "ue-ideal")
-        if not os.path.isdir(ue_results_folder):
-            os.mkdir(ue_results_folder)
-    
-        for user in range(nUEs):
-            print_progress(user+1, nUEs, prefix = 'Ideal UE Simulation Progress:', suffix = 'Complete')
-            results = ue_results[user]
-            results_file = os.path.join(ue_results_folder, f"UE-{user}.csv")
-            results.to_csv(results_file, index=False)
-
-        # calculate the gNB metrics
-        gnbResults_list = []    
-        logging.info("Calculating gNB metrics")
-        for gnb in range(nGnbs):
-            print_progress(gnb+1, nGnbs, prefix = 'GNB Simulation Progress:', suffix = 'Complete')
-            gnbResults_list.append(simulate_gnb(gnb,intervals,nUEs, ue_results, scenario, packetSize))
-        # Save the results to a file
-        for gnb in range(nGnbs):
-            gnbResults_folder = os.path.join(results_folder, "gnb")
-            if not os.path.isdir(gnbResults_folder):
-                os.mkdir(gnbResults_folder)
-            gnbResults_file = os.path.join(gnbResults_folder, f"GNB-{gnb}.csv")
-            gnbResults_list[gnb] = pd.DataFrame(gnbResults_list[gnb])
-            gnbResults_list[gnb].to_csv(gnbResults_file, index=False)
-        
-        logging.info("Calculating the restricted UE throughput")
-        # create a folder to save the results
-        ueResults_folder = os.path.join(results_folder, "ue-restricted")
-        if not os.path.isdir(ueResults_folder):
-            os.mkdir(ueResults_folder)
-        
-        for ue in range(nUEs):
-            print_progress(ue+1, nUEs, prefix = 'Restricted UE Simulation Progress:', suffix = 'Complete')
-            ue_results[ue] = simulate_user_restricted(ue_results, gnbResults_list, ue, intervals, packetSize)
-            # Save the results to a file
-            ueResults_file = os.path.join(ueResults_folder, f"UE-{ue}.csv")
-            ue_results[ue].to_csv(ueResults_file, index=False)
-    
-        logging.info("Calculating the scenario metrics")
-        # convert the list of dataframes to a single dataframe
-        gnbs_metrics = pd.concat(gnbResults_list)
-        # aggregate the fields
-        
-        gnbs_metrics = gnbs_metrics.groupby(['Time']).agg({
-            'Throughput': 'sum',
-            'TxPacketsAcc': 'sum',
-            'TxBytesAcc': 'sum',
-            'TxBytesDiff': 'sum',
-            'TxPacketsDiff': 'sum',
-            'RxPacketsAcc': 'sum',
-            'RxBytesAcc': 'sum',
-            'RxBytesDiff': 'sum',
-            'RxPacketsDiff': 'sum',
-            'Latency': 'mean',
-            'Jitter': 'mean',
-            'LostPackets': 'sum',
-            'ConnectedUEs': 'sum',
-            'Occupation': 'mean',
-            'PLostPackets': 'mean',
-            'Handovers': 'sum',
-        })
-
-        gnbs_metrics['MeanThroughput'] = gnbs_metrics['Throughput'] / nGnbs
-        
-        logging.info("Saving the results")
-        # save the results to a file into the results folder
-        gnbs_metrics_file = os.path.join(results_folder, "scenario.csv")
-        gnbs_metrics.to_csv(gnbs_metrics_file)
-        algorithm = "SBGH"
-        logging.info(f"Finished {algorithm} algorithm simulation")
-        
-    
-        #save the score of the algorithm
-        score = calculate_algorithm_score(gnbs_metrics)
-        logging.info(f"Scenario Score: {score}")
-        # save the score in a file
-        score_file = os.path.join(results_folder, "scenario-score.txt")
-        with open(score_file, "w") as file:
-            file.write(str(int(score)))
+        post_process(results_folder, ue_results, intervals, nGnbs, scenario, packetSize, SCENARIO_SBGH, queueModel)
+        logging.info(f"Finished {ALGORITHM} algorithm simulation")
 
 
-def simulate_ideal_sbgh_handover(nUEs=False,debug=False,traces_sim_folder=str, nGnbs=int, interval=float ,simDataframes=None ,intervals=None ,scenario=None, packetSize=int, alpha=float, beta=float, penalty_dict=None, penalty_time=float):
+def simulate_ideal_sbgh_handover(nUEs=False,debug=False,traces_sim_folder=str, nGnbs=int, interval=float ,simDataframes=None ,intervals=None ,scenario=None, packetSize=int, alpha=float, beta=float, penalty_dict=None, penalty_time=float, scoreTensor=None, queueModel=MD1_QUEUE):
         """Simulate the propossed handover algorithm.
 
         Args:
@@ -407,13 +336,15 @@ def simulate_ideal_sbgh_handover(nUEs=False,debug=False,traces_sim_folder=str, n
             interval (float): The interval of the simulation.
             simDataframes (list): A list of lists of dataframes.
             intervals (list): A list of intervals.
-            scenario (dict): The scenario data.
+            scenario (Scenario): The scenario data.
             packetSize (int): The packet size.
+            scoreTensor (ndarray): The scores of calculate_score_tensor, shared with SBGH, computed if None.
+            queueModel (QueueModel): The queue model of the gNBs, or a list of them, see post_process.
         
         Returns:
             None
         """
-        ue_results,ue_results_score = simulate_sbgh_users(nUEs ,simDataframes ,intervals,interval ,scenario,alpha, beta, delay = 0, penalty_dict=penalty_dict, penalty_time=penalty_time)
+        ue_results,ue_results_score = simulate_sbgh_users(nUEs ,simDataframes ,intervals,interval ,scenario,alpha, beta, delay = 0, penalty_dict=penalty_dict, penalty_time=penalty_time, scoreTensor=scoreTensor)
         results_folder = os.path.join(traces_sim_folder, "results")
         if not os.path.isdir(results_folder):
             os.mkdir(results_folder)
@@ -425,89 +356,9 @@ def simulate_ideal_sbgh_handover(nUEs=False,debug=False,traces_sim_folder=str, n
         scores_folder = os.path.join(results_folder, "scores")
         if not os.path.isdir(scores_folder):
             os.mkdir(scores_folder)
-        ue_results_folder = os.path.join(results_folder, "ue-ideal")
-        if not os.path.isdir(ue_results_folder):
-            os.mkdir(ue_results_folder)
-    
         for user in range(nUEs):
-            print_progress(user+1, nUEs, prefix = 'Ideal UE Simulation Progress:', suffix = 'Complete')
-            results = pd.DataFrame(ue_results[user])
-            results_score = pd.DataFrame(ue_results_score[user])
             # save the scores in a file
             results_score_file = os.path.join(scores_folder, f"UE-{user}.csv")
-            
-            results_score.to_csv(results_score_file, index=False)
-            # save the results in a file
-            results_file = os.path.join(ue_results_folder, f"UE-{user}.csv")
-            results.to_csv(results_file, index=False)
-
-        # calculate the gNB metrics
-        gnbResults_list = []    
-        logging.info("Calculating gNB metrics")
-        for gnb in range(nGnbs):
-            print_progress(gnb+1, nGnbs, prefix = 'GNB Simulation Progress:', suffix = 'Complete')
-            gnbResults_list.append(simulate_gnb(gnb,intervals,nUEs, ue_results, scenario, packetSize))
-        # Save the results to a file
-        for gnb in range(nGnbs):
-            gnbResults_folder = os.path.join(results_folder, "gnb")
-            if not os.path.isdir(gnbResults_folder):
-                os.mkdir(gnbResults_folder)
-            gnbResults_file = os.path.join(gnbResults_folder, f"GNB-{gnb}.csv")
-            gnbResults_list[gnb] = pd.DataFrame(gnbResults_list[gnb])
-            gnbResults_list[gnb].to_csv(gnbResults_file, index=False)
-        
-        logging.info("Calculating the restricted UE throughput")
-        # create a folder to save the results
-        ueResults_folder = os.path.join(results_folder, "ue-restricted")
-        if not os.path.isdir(ueResults_folder):
-            os.mkdir(ueResults_folder)
-        
-        for ue in range(nUEs):
-            print_progress(ue+1, nUEs, prefix = 'Restricted UE Simulation Progress:', suffix = 'Complete')
-            ue_results[ue] = simulate_user_restricted(ue_results, gnbResults_list, ue, intervals, packetSize)
-            # Save the results to a file
-            ueResults_file = os.path.join(ueResults_folder, f"UE-{ue}.csv")
-            ue_results[ue].to_csv(ueResults_file, index=False)
-    
-        logging.info("Calculating the scenario metrics")
-        # convert the list of dataframes to a single dataframe
-        gnbs_metrics = pd.concat(gnbResults_list)
-        # aggregate the fields
-        gnbs_metrics = gnbs_metrics.groupby(['Time']).agg({
-            'Throughput': 'sum',
-            'TxPacketsAcc': 'sum',
-            'TxBytesAcc': 'sum',
-            'TxBytesDiff': 'sum',
-            'TxPacketsDiff': 'sum',
-            'RxPacketsAcc': 'sum',
-            'RxBytesAcc': 'sum',
-            'RxBytesDiff': 'sum',
-            'RxPacketsDiff': 'sum',
-            'Latency': 'mean',
-            'Jitter': 'mean',
-            'LostPackets': 'sum',
-            'ConnectedUEs': 'sum',
-            'Occupation': 'mean',
-            'PLostPackets': 'mean',
-
-        })
-
-        meanThroughput = gnbs_metrics['Throughput'] / nGnbs
-        gnbs_metrics['MeanThroughput'] = gnbs_metrics['Throughput'] / nGnbs
-        
-
-        
-        logging.info("Saving the results")
-        # save the results to a file into the results folder
-        gnbs_metrics_file = os.path.join(results_folder, "scenario.csv")
-        gnbs_metrics.to_csv(gnbs_metrics_file)
-        algorithm = "ideal-SBGH"
-        logging.info(f"Finished {algorithm} algorithm simulation")
-        
-        #save the score of the algorithm
-        score = calculate_algorithm_score(gnbs_metrics)
-        logging.info(f"Scenario Score: {score}")
-        # save the score in a file
-        score_file = os.path.join(results_folder, "scenario-score.txt")
-        with open(score_file, "w") as file:
-            file.write(str(int(score)))
+            pd.DataFrame(ue_results_score[user]).to_csv(results_score_file, index=False)
+        post_process(results_folder, ue_results, intervals, nGnbs, scenario, packetSize, SCENARIO_IDEAL_SBGH, queueModel)
+        logging.info("Finished ideal-SBGH algorithm simulation")
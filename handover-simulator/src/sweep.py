@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+# Parameter sweep of the 3GPP A3 and CHO handovers on the traces of a previous simulation. The trace
+# cube is loaded once and every combination of the parameter grid runs as extra rows of the batched
+# state machines, the scenario score and the handovers of each combination go to one table.
+import os
+import json
+import hashlib
+import argparse
+import itertools
+import logging
+import logging.config
+import yaml
+import numpy as np
+import pandas as pd
+
+from utils import *
+from trace_cube import load_trace_cube
+from trace_store import TraceBatch
+from simulator_common import calculate_scenario_score
+from simulator_3gpp_batched import stack_columns, stack_metrics, gather_results, advance_a3
+from simulator_3gpp_rel16_batched import advance_cho
+
+SWEEP_FILE_NAME = "sweep.csv"
+# Number of rows, combinations times UEs, advanced together, bounds the memory of the state machines
+DEFAULT_SWEEP_ROWS = 16384
+# Parameters of the grid of every algorithm
+ALGORITHM_PARAMETERS = {
+    "a3": ["Hys", "A3Offset", "ttt", "NrMeasureInt", "HOInterval"],
+    "cho": ["Hys", "A3Offset", "ttt", "NrMeasureInt", "HOInterval", "HysFR2", "tttFR2"],
+}
+SWEEP_COLUMNS = ["Algorithm", "Hys", "A3Offset", "ttt", "NrMeasureInt", "HOInterval", "HysFR2", "tttFR2", "Score",
+                 "Handovers", "PingPongs"]
+# A handover back to the previous gNB within this time in seconds is a ping-pong
+DEFAULT_PING_PONG_TIME = 1.0
+
+
+def load_grid(grid_file, defaults):
+    """Read a parameter grid from a YAML file.
+
+    Each key of the file is a parameter of ALGORITHM_PARAMETERS with a value or a list of values,
+    the parameters not in the file take their default value.
+
+    Args:
+        grid_file (str): The YAML file of the grid.
+        defaults (dict): The default value of every parameter.
+
+    Returns:
+        dict: The list of values of every parameter.
+
+    Raises:
+        ValueError: If the grid has an unknown parameter.
+    """
+    with open(grid_file, 'r') as file:
+        grid = yaml.safe_load(file) or {}
+    unknown = set(grid) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown parameters in {grid_file}: {sorted(unknown)}")
+    values = {}
+    for name, default in defaults.items():
+        value = grid.get(name, default)
+        values[name] = list(value) if isinstance(value, list) else [value]
+    return values
+
+
+def grid_combinations(grid, algorithm):
+    """Combinations of the grid an algorithm depends on, as dicts of parameter values.
+
+    A tttFR2 of None takes the ttt of its combination, as the TTT_FR2 default of simulate_3gpp_cho_handover.
+    """
+    names = ALGORITHM_PARAMETERS[algorithm]
+    combinations = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        combination = dict(zip(names, values))
+        if combination.get("tttFR2", 0) is None:
+            combination["tttFR2"] = combination["ttt"]
+        if combination not in combinations:
+            combinations.append(combination)
+    return combinations
+
+
+def count_handovers(connected):
+    """Number of handovers of every row of a selection: changes of the connected gNB once connected."""
+    return np.count_nonzero((connected[:, 1:] != connected[:, :-1]) & (connected[:, :-1] >= 0), axis=1)
+
+
+def count_ping_pongs(connected, intervals, pingPongTime=DEFAULT_PING_PONG_TIME):
+    """Number of ping-pongs of every row of a selection.
+
+    A ping-pong is a handover A -> B followed by the handover B -> A within pingPongTime seconds.
+
+    Args:
+        connected (ndarray): The connected gNB of every row and interval, -1 if none, shape [row, interval].
+        intervals (list): The time of every interval.
+        pingPongTime (float): The longest time between the two handovers of a ping-pong in seconds.
+
+    Returns:
+        ndarray: The number of ping-pongs of every row.
+    """
+    rows, ticks = np.nonzero((connected[:, 1:] != connected[:, :-1]) & (connected[:, :-1] >= 0))
+    source = connected[rows, ticks]
+    target = connected[rows, ticks + 1]
+    times = np.asarray(intervals, dtype=np.float64)[ticks + 1]
+    # The handovers are sorted by row and tick, every handover is compared with the previous one of its row
+    ping_pong = ((rows[1:] == rows[:-1]) & (target[1:] == source[:-1])
+                 & (times[1:] - times[:-1] <= pingPongTime))
+    return np.bincount(rows[1:][ping_pong], minlength=connected.shape[0])
+
+
+def sweep(ueDataframes, intervals, interval, scenario, packetSize, grid, algorithms, maxRows=DEFAULT_SWEEP_ROWS,
+          pingPongTime=DEFAULT_PING_PONG_TIME, penalty_dict=None):
+    """Evaluate every combination of a parameter grid with the batched A3 and CHO engines.
+
+    The combinations of a chunk run as rows of one batch, each UE once per combination. The scenario
+    score only depends on the gNB every UE is connected to and the trace rows its results are taken
+    from, with the penalty share of every row, so it is computed once for every distinct selection.
+
+    Args:
+        ueDataframes (list): The dataframes of every UE, indexed by UE and gNB, or a TraceBatch of all the UEs,
+            which reads the traces from the trace cube without building the DataFrames.
+        intervals (list): A list of intervals.
+        interval (float): The sample time interval in seconds.
+        scenario (Scenario): The scenario information.
+        packetSize (int): The packet size in bytes.
+        grid (dict): The list of values of every parameter, see load_grid.
+        algorithms (list): The algorithms to evaluate, a3 or cho.
+        maxRows (int): The number of rows advanced together.
+        pingPongTime (float): The longest time between the two handovers of a ping-pong in seconds.
+        penalty_dict (dict): The penalty of every trace column during the handover interruption of
+            HOInterval seconds.
+
+    Returns:
+        DataFrame: One row per algorithm and combination with its score and its numbers of handovers and
+            ping-pongs.
+    """
+    nUEs, nGnbs = len(ueDataframes), len(scenario.gnbs)
+    ranked, rsrp = stack_metrics(ueDataframes, DECISION_PARAMETER)
+    columns = stack_columns(ueDataframes)
+    fr2 = scenario.frequency_range == "FR2"
+    if "cho" in algorithms and not any(fr2):
+        logging.warning("The scenario has no FR2 gNBs, HysFR2 and tttFR2 do not change the CHO results")
+    scores = {}
+    results = []
+    chunkSize = max(1, maxRows // nUEs)
+    for algorithm in algorithms:
+        combinations = grid_combinations(grid, algorithm)
+        logging.info(f"Sweeping {len(combinations)} combinations of {algorithm}")
+        for start in range(0, len(combinations), chunkSize):
+            chunk = combinations[start:start + chunkSize]
+            ues = np.tile(np.arange(nUEs), len(chunk))
+            parameters = {name: np.repeat([combination[name] for combination in chunk], nUEs)
+                          for name in ALGORITHM_PARAMETERS[algorithm]}
+            if algorithm == "a3":
+                selection = advance_a3(ranked, rsrp, parameters["Hys"], parameters["A3Offset"],
+                                       parameters["NrMeasureInt"], interval, parameters["ttt"], ues,
+                                       parameters["HOInterval"], penalty_dict)
+            else:
+                selection = advance_cho(ranked, rsrp, fr2, parameters["Hys"], parameters["A3Offset"],
+                                        parameters["NrMeasureInt"], interval, parameters["ttt"],
+                                        parameters["HysFR2"], parameters["tttFR2"], ues,
+                                        parameters["HOInterval"], penalty_dict)
+            connected, rows_gnb, rows_index, handovers, rows_penalty = selection
+            for i, combination in enumerate(chunk):
+                rows = slice(i * nUEs, (i + 1) * nUEs)
+                key = hashlib.blake2b(connected[rows].tobytes() + rows_gnb[rows].tobytes() + rows_index[rows].tobytes()
+                                      + rows_penalty[rows].tobytes(), digest_size=20).hexdigest()
+                if key not in scores:
+                    ueResults = gather_results(columns, intervals, connected[rows], rows_gnb[rows], rows_index[rows],
+                                               handovers[rows], rows_penalty[rows], penalty_dict)
+                    scores[key] = calculate_scenario_score(ueResults, intervals, nUEs, nGnbs, scenario, packetSize)
+                results.append({"Algorithm": algorithm, **combination, "Score": scores[key],
+                                "Handovers": int(count_handovers(connected[rows]).sum()),
+                                "PingPongs": int(count_ping_pongs(connected[rows], intervals, pingPongTime).sum())})
+            logging.info(f"{algorithm}: {min(start + chunkSize, len(combinations))}/{len(combinations)} combinations, "
+                         f"{len(scores)} distinct selections")
+    return pd.DataFrame(results, columns=SWEEP_COLUMNS)
+
+
+if __name__ == "__main__":
+    default_scFile = "../../handover-simulator/scenario/sc.txt"  # Default scenario definition filename
+    default_HysFR2 = 6.0  # Default hysteresis of the CHO A3 event in FR2, as in simulate_3gpp_cho_handover
+    default_HOInterval = 0.1  # Handover interruption time of the traces whose parameters.json predates HOInterval
+    # Penalty of the handover interruption, as in main.py
+    penalty_dict = {"Latency": 0.020}
+
+    parser = argparse.ArgumentParser(description="Parameter sweep of the 3GPP A3 and CHO handovers")
+    logging.config.fileConfig('logging.conf')
+    parser.add_argument('--trace', type=str, required=True, help='Path to the simulation trace to evaluate the grid on')
+    parser.add_argument('--grid', type=str, required=True, help='Path to a YAML file with the values of each parameter: Hys, A3Offset, ttt, NrMeasureInt, HOInterval, HysFR2, tttFR2')
+    parser.add_argument("--sc", type=str, default=default_scFile, help="Scenario definition filename")
+    parser.add_argument("--algorithms", nargs="+", choices=list(ALGORITHM_PARAMETERS), default=list(ALGORITHM_PARAMETERS), help="Algorithms to evaluate")
+    parser.add_argument("--output", type=str, help=f"Output CSV file, results/{SWEEP_FILE_NAME} of the trace by default")
+    parser.add_argument("--maxRows", type=int, default=DEFAULT_SWEEP_ROWS, help="Number of UE and combination pairs advanced together")
+    parser.add_argument("--pingPongTime", type=float, default=DEFAULT_PING_PONG_TIME, help="Longest time in seconds between a handover and the return to the previous gNB counted as a ping-pong")
+    args = parser.parse_args()
+
+    traces_sim_folder = args.trace
+    with open(os.path.join(traces_sim_folder, PARAMETERS_FILE_NAME), 'r') as jsonfile:
+        parameters = json.load(jsonfile)
+    nUEs = parameters["nUEs"]
+    interval = parameters["interval"]
+    packetSize = parameters["packetSize"]
+    scenario = parse_scenario_file(os.path.abspath(args.sc))
+    nGnb = len(scenario.gnbs)
+    # The parameters of the simulation are the defaults of the grid
+    grid = load_grid(args.grid, {
+        "Hys": parameters["Hys"],
+        "A3Offset": parameters["A3Offset"],
+        "ttt": parameters["timeToTrigger"],
+        "NrMeasureInt": parameters["NrMeasureInt"],
+        "HOInterval": parameters.get("HOInterval", default_HOInterval),
+        "HysFR2": default_HysFR2,
+        "tttFR2": None,
+        })
+
+    traceCube = load_trace_cube(traces_sim_folder, nUEs, nGnb, interval)
+    # Every UE runs once per combination, the batch reads their columns straight from the cube
+    ueTraces = TraceBatch(traceCube, range(nUEs))
+    sweepResults = sweep(ueTraces, traceCube.times, interval, scenario, packetSize, grid, args.algorithms, args.maxRows,
+                         args.pingPongTime, penalty_dict)
+
+    output = args.output or os.path.join(traces_sim_folder, "results", SWEEP_FILE_NAME)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    sweepResults.to_csv(output, index=False)
+    print(f"{len(sweepResults)} combinations written to {output}")
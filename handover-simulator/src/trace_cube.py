@@ -0,0 +1,797 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+# Columnar trace cube: all the <ue>/<gnb>/traces.csv (or traces.bin) files of a run packed into a single
+# dense [UE, gNB, interval, metric] array, cached on disk next to parameters.json.
+import os
+import json
+import time
+import hashlib
+import logging
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# pyarrow parses the traces several times faster than the default C engine, it is optional
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = "c"
+
+TRACES_FILE_NAME = "traces.csv"
+BINARY_TRACES_FILE_NAME = "traces.bin"
+CACHE_FOLDER_NAME = "trace-cache"
+CACHE_INDEX_FILE_NAME = "index.json"
+CACHE_DATA_FILE_NAME = "data.npy"
+CACHE_TEXT_FILE_NAME = "text.npy"
+CACHE_TIMES_FILE_NAME = "times.npy"
+CACHE_LENGTHS_FILE_NAME = "lengths.npy"
+CACHE_VALID_FILE_NAME = "valid.npy"
+CACHE_VERSION = 3
+
+# Columns written by network-simulator/sim.cc, in file order
+TRACE_COLUMNS = ["Time", "TxBytes", "TxPackets", "RxBytes", "RxPackets", "LatencySum", "LatencyLast",
+                 "JitterSum", "LostPackets", "Distance", "Rsrp", "UE Position", "System Time"]
+# ns-3 writes the UE position as a Vector ("x:y:z"), it is split into numeric columns at ingest time
+POSITION_COLUMN = "UE Position"
+POSITION_COLUMNS = ["PosX", "PosY", "PosZ"]
+# Non numeric columns, stored aside from the numeric cube
+TEXT_COLUMNS = ["System Time"]
+# Fixed column types of the traces, so the parser never has to infer them
+TRACE_SCHEMA = {
+    "Time": np.float64,
+    "TxBytes": np.int64,
+    "TxPackets": np.int64,
+    "RxBytes": np.int64,
+    "RxPackets": np.int64,
+    "LatencySum": np.float64,
+    "LatencyLast": np.float64,
+    "JitterSum": np.float64,
+    "LostPackets": np.int64,
+    "Distance": np.float64,
+    "Rsrp": np.float64,
+    "UE Position": str,
+    "System Time": str,
+}
+# Cumulative counters, restored as integers when the DataFrames are rebuilt
+COUNTER_COLUMNS = ["TxBytes", "TxPackets", "RxBytes", "RxPackets", "LostPackets"]
+# Per interval increments of the cumulative counters, and the counter each one is derived from
+DIFF_COLUMNS = {
+    "TxPacketsDiff": "TxPackets",
+    "TxBytesDiff": "TxBytes",
+    "RxPacketsDiff": "RxPackets",
+    "RxBytesDiff": "RxBytes",
+    "LostPacketsDiff": "LostPackets",
+}
+# Columns computed from the traces by add_derived_columns
+DERIVED_COLUMNS = list(DIFF_COLUMNS) + ["Throughput"]
+# The rebuilt DataFrames use compact column types: the counters and their increments take the smallest
+# unsigned integer type that holds their range, these metrics are float32 and the rest float64. They
+# are only reported or averaged; Rsrp and Throughput stay float64, Rsrp decides the handovers and the
+# SBGH scores, and Throughput gives the gNB occupation, the lost packets and the scenario score.
+FLOAT32_COLUMNS = ["LatencySum", "LatencyLast", "JitterSum", "Distance"] + POSITION_COLUMNS
+# Maximum relative error accepted when a metric is downcast to float32, it is kept as float64 otherwise
+FLOAT32_RTOL = 1e-6
+
+# Binary trace format written by sim.cc with --traceFormat=bin: a header followed by fixed size
+# records in native byte order, the layout of TraceRecord in network-simulator/sim.h
+BINARY_TRACE_MAGIC = b"NRTRACE"
+BINARY_TRACE_VERSION = 1
+BINARY_TRACE_HEADER = np.dtype([("magic", "S8"), ("version", "=u4"), ("record_size", "=u4")])
+TRACE_RECORD_DTYPE = np.dtype([
+    ("Time", "=f8"),
+    ("TxBytes", "=u8"),
+    ("TxPackets", "=u8"),
+    ("RxBytes", "=u8"),
+    ("RxPackets", "=u8"),
+    ("LatencySum", "=f8"),
+    ("LatencyLast", "=f8"),
+    ("JitterSum", "=f8"),
+    ("LostPackets", "=u8"),
+    ("Distance", "=f8"),
+    ("Rsrp", "=f8"),
+    ("PosX", "=f8"),
+    ("PosY", "=f8"),
+    ("PosZ", "=f8"),
+    ("System Time", "=i8"),
+])
+SYSTEM_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+HASH_CHUNK_SIZE = 1 << 20
+# Sample times are matched to the interval grid with microsecond resolution, the resolution of the ns-3 --int argument
+TIME_DECIMALS = 6
+
+
+class TraceCube:
+    """Dense representation of the traces of a simulation run.
+
+    Attributes:
+        data (ndarray): Numeric metrics, shape [UE, gNB, interval, metric].
+        metrics (list): Names of the numeric metrics, in the order of the last axis of data.
+        metric_index (dict): Maps a metric name to its position in the last axis of data.
+        times (ndarray): Simulation time of each interval (tick) of the common time grid.
+        lengths (ndarray): Number of rows read from each trace, shape [UE, gNB].
+        text (ndarray): Non numeric columns, shape [UE, gNB, interval, text metric].
+        text_metrics (list): Names of the non numeric columns.
+        valid (ndarray): Whether each trace reported each tick, shape [UE, gNB, interval]. Ticks a
+            trace did not report are filled by fill_missing_ticks.
+        handle (TraceCubeHandle): Reference other processes open the cube with, None if the cube is
+            not stored in the trace cache.
+    """
+
+    def __init__(self, data, metrics, times, lengths, text=None, text_metrics=(), valid=None):
+        self.data = data
+        self.metrics = list(metrics)
+        self.metric_index = {name: i for i, name in enumerate(self.metrics)}
+        self.times = times
+        self.lengths = lengths
+        self.text = text
+        self.text_metrics = list(text_metrics)
+        self.text_metric_index = {name: i for i, name in enumerate(self.text_metrics)}
+        if valid is None:
+            valid = np.arange(data.shape[2]) < np.asarray(lengths)[..., None]
+        self.valid = valid
+        self.handle = None
+
+    @property
+    def nUEs(self):
+        return self.data.shape[0]
+
+    @property
+    def nGnb(self):
+        return self.data.shape[1]
+
+    @property
+    def nIntervals(self):
+        return self.data.shape[2]
+
+    def column(self, name):
+        """Get a metric for every UE, gNB and interval.
+
+        Args:
+            name (str): The name of the metric.
+
+        Returns:
+            ndarray: A [UE, gNB, interval] view of the metric.
+        """
+        return self.data[..., self.metric_index[name]]
+
+    def text_column(self, name):
+        """Get a non numeric column for every UE, gNB and interval.
+
+        Args:
+            name (str): The name of the column.
+
+        Returns:
+            ndarray: A [UE, gNB, interval] view of the column.
+        """
+        return self.text[..., self.text_metric_index[name]]
+
+    def alignment_report(self):
+        """Describe the ticks missing from the traces.
+
+        Returns:
+            dict: Maps "<ue>/<gnb>" to the number of "gaps" (missing ticks between the first and last
+            reported tick), the "late" start (missing ticks before the first one) and the "truncated"
+            end (missing ticks after the last one), for the traces that miss any tick.
+        """
+        report = {}
+        ticks = np.arange(self.nIntervals)
+        for ue in range(self.nUEs):
+            for gnb in range(self.nGnb):
+                reported = ticks[np.asarray(self.valid[ue, gnb])]
+                if len(reported) == self.nIntervals:
+                    continue
+                if len(reported) == 0:
+                    report[f"{ue}/{gnb}"] = {"gaps": 0, "late": 0, "truncated": self.nIntervals}
+                    continue
+                first, last = int(reported[0]), int(reported[-1])
+                report[f"{ue}/{gnb}"] = {"gaps": last - first + 1 - len(reported), "late": first,
+                                         "truncated": self.nIntervals - 1 - last}
+        return report
+
+    def to_dataframes(self):
+        """Rebuild the nested list of DataFrames returned by utils.load_dataframes.
+
+        Every DataFrame has one row per tick of the time grid, so row i of every trace is the
+        interval times[i] and the simulators can address the traces by tick.
+
+        Returns:
+            list: A list of lists of dataframes, indexed as [ue][gnb].
+        """
+        return [self.ue_dataframes(ue) for ue in range(self.nUEs)]
+
+    def ue_dataframes(self, ue):
+        """Build the DataFrames of a single UE, only its slice of the cube is read.
+
+        Args:
+            ue (int): The UE.
+
+        Returns:
+            list: A list of dataframes, indexed by gNB.
+        """
+        columns = [c for c in cube_columns(TRACE_COLUMNS) if c in self.metric_index or c in self.text_metric_index]
+        columns += [c for c in self.metrics if c not in columns]
+        node_dataframes = []
+        for gnb in range(self.nGnb):
+            df = {}
+            for name in columns:
+                if name in self.metric_index:
+                    values = compact_column(name, np.asarray(self.data[ue, gnb, :, self.metric_index[name]]))
+                else:
+                    # The text columns repeat the same few values, the rows share their str objects
+                    uniques, inverse = np.unique(np.asarray(self.text[ue, gnb, :, self.text_metric_index[name]]),
+                                                 return_inverse=True)
+                    values = uniques.astype(object)[inverse]
+                df[name] = values
+            node_dataframes.append(pd.DataFrame(df))
+        return node_dataframes
+
+    def ue_columns(self, ues, name):
+        """Get a column of several UEs with the types of their DataFrame columns, see ue_dataframes.
+
+        Only the slices of the cube of the UEs and the column are read, no DataFrame is built.
+
+        Args:
+            ues (list): The UEs.
+            name (str): The name of the column, a metric or a text column.
+
+        Returns:
+            ndarray: A [UE, gNB, interval] array.
+        """
+        ues = list(ues)
+        if name in self.metric_index:
+            values = self.data[:, :, :, self.metric_index[name]][ues]
+            return np.stack([np.stack([compact_column(name, np.asarray(trace)) for trace in ue_values])
+                             for ue_values in values])
+        return np.asarray(self.text[:, :, :, self.text_metric_index[name]][ues]).astype(object)
+
+    def save(self, cache_folder, index):
+        """Store the cube as .npy files that can be memory-mapped back.
+
+        The index file is written last so an interrupted save never looks like a valid cache.
+
+        Args:
+            cache_folder (str): The folder where the cache is stored.
+            index (dict): Cache metadata (source fingerprints), stored with the metric names.
+        """
+        os.makedirs(cache_folder, exist_ok=True)
+        index_file = os.path.join(cache_folder, CACHE_INDEX_FILE_NAME)
+        if os.path.isfile(index_file):
+            os.remove(index_file)
+        save_array(os.path.join(cache_folder, CACHE_DATA_FILE_NAME), self.data)
+        save_array(os.path.join(cache_folder, CACHE_TEXT_FILE_NAME), self.text)
+        save_array(os.path.join(cache_folder, CACHE_TIMES_FILE_NAME), self.times)
+        save_array(os.path.join(cache_folder, CACHE_LENGTHS_FILE_NAME), self.lengths)
+        save_array(os.path.join(cache_folder, CACHE_VALID_FILE_NAME), self.valid)
+        index = dict(index, version=CACHE_VERSION, metrics=self.metrics, text_metrics=self.text_metrics)
+        write_cache_index(cache_folder, index)
+
+    @classmethod
+    def open(cls, cache_folder, index, mmap_mode="r"):
+        """Open a cube stored with TraceCube.save without copying it into memory.
+
+        Args:
+            cache_folder (str): The folder where the cache is stored.
+            index (dict): The cache index, as returned by read_cache_index.
+            mmap_mode (str): numpy memory-map mode, None to load the arrays in memory.
+
+        Returns:
+            TraceCube: The cached cube.
+        """
+        def load(file_name):
+            return np.load(os.path.join(cache_folder, file_name), mmap_mode=mmap_mode)
+
+        cube = cls(load(CACHE_DATA_FILE_NAME), index["metrics"], load(CACHE_TIMES_FILE_NAME),
+                   load(CACHE_LENGTHS_FILE_NAME), load(CACHE_TEXT_FILE_NAME), index["text_metrics"],
+                   load(CACHE_VALID_FILE_NAME))
+        if mmap_mode is not None:
+            cube.handle = TraceCubeHandle(cache_folder, index.get("key"), index.get("interval"))
+        return cube
+
+
+# Cube opened by this process from a TraceCubeHandle
+_opened_cubes = {}
+
+
+class TraceCubeHandle:
+    """Reference to a cube stored in the trace cache, a few bytes to pickle.
+
+    Worker processes get the handle instead of the traces and memory-map the cache themselves, so
+    the pages of the cube are shared with the parent through the page cache.
+
+    Attributes:
+        cache_folder (str): The folder of the trace cache.
+        key (str): The content hash of the traces the cache was built from.
+        interval (float): The sample time interval of the derived columns of the cache.
+    """
+
+    def __init__(self, cache_folder, key, interval):
+        self.cache_folder = cache_folder
+        self.key = key
+        self.interval = interval
+
+    def open(self):
+        """Open the cube, once per process.
+
+        Raises:
+            ValueError: If the cache was rebuilt since the handle was created.
+
+        Returns:
+            TraceCube: The memory-mapped cube.
+        """
+        name = (self.cache_folder, self.key, self.interval)
+        if name not in _opened_cubes:
+            index = read_cache_index(self.cache_folder)
+            if index is None or index.get("key") != self.key or index.get("interval") != self.interval:
+                raise ValueError(f"The trace cache {self.cache_folder} changed since the handle was created")
+            _opened_cubes.clear()
+            _opened_cubes[name] = TraceCube.open(self.cache_folder, index)
+        return _opened_cubes[name]
+
+
+def save_array(file_name, array):
+    """Save an array as .npy through a temporary file.
+
+    The file is replaced atomically, so a cube that is still memory-mapped from the old file stays valid.
+    """
+    tmp_file = file_name + ".tmp"
+    with open(tmp_file, "wb") as file:
+        np.save(file, array)
+    os.replace(tmp_file, file_name)
+
+
+def compact_column(name, values):
+    """Convert a metric of the cube to the compact type of its DataFrame column.
+
+    The counters are stored in the cube as float64, which holds them exactly, and they are restored as
+    uint32 when their range allows it, uint64 otherwise (int64 if they have negative values). The
+    FLOAT32_COLUMNS are downcast only when every value survives the conversion within FLOAT32_RTOL.
+
+    Args:
+        name (str): The name of the metric.
+        values (ndarray): The float64 values of the metric.
+
+    Returns:
+        ndarray: The values with the type of the column.
+    """
+    if name in COUNTER_COLUMNS or name in DIFF_COLUMNS:
+        if not np.isfinite(values).all():
+            return values.astype(np.float64)
+        if len(values) == 0 or values.min() >= 0:
+            dtype = np.uint32 if len(values) == 0 or values.max() <= np.iinfo(np.uint32).max else np.uint64
+        else:
+            dtype = np.int64
+        return values.astype(dtype)
+    if name in FLOAT32_COLUMNS:
+        compact = values.astype(np.float32)
+        if np.allclose(compact, values, rtol=FLOAT32_RTOL, atol=0, equal_nan=True):
+            return compact
+        logging.debug(f"Column {name} does not fit in float32, it is kept as float64")
+    return values.astype(np.float64)
+
+
+def cube_columns(columns):
+    """Map trace file columns to the columns stored in the cube (the position is split in x, y, z)."""
+    result = []
+    for c in columns:
+        result.extend(POSITION_COLUMNS if c == POSITION_COLUMN else [c])
+    return result
+
+
+def parse_positions(positions):
+    """Split ns-3 Vector strings ("x:y:z") into numeric coordinates.
+
+    Args:
+        positions (Series): The "UE Position" column of a trace.
+
+    Returns:
+        ndarray: A [interval, 3] float32 array with the x, y and z coordinates.
+    """
+    return positions.str.split(":", expand=True).to_numpy(dtype=np.float32).reshape(len(positions), len(POSITION_COLUMNS))
+
+
+def get_trace_files(traces_sim_folder, nUEs, nGnb):
+    """List the trace file of every UE/gNB pair, the binary trace is used when both exist.
+
+    Raises:
+        FileNotFoundError: If a trace file is not found.
+
+    Returns:
+        list: A list of lists of file names, indexed as [ue][gnb].
+    """
+    files = []
+    for iUE in range(nUEs):
+        node_files = []
+        for iGnb in range(nGnb):
+            folder = os.path.join(traces_sim_folder, str(iUE), str(iGnb))
+            file_name = os.path.join(folder, BINARY_TRACES_FILE_NAME)
+            if not os.path.isfile(file_name):
+                file_name = os.path.join(folder, TRACES_FILE_NAME)
+            if not os.path.isfile(file_name):
+                raise FileNotFoundError(f"File {file_name} not found.")
+            node_files.append(file_name)
+        files.append(node_files)
+    return files
+
+
+def stat_fingerprint(files):
+    """Cheap fingerprint of the trace files, based on their size and modification time."""
+    return [[[os.stat(f).st_size, os.stat(f).st_mtime_ns] for f in node_files] for node_files in files]
+
+
+def content_hash(files):
+    """Hash of the contents of the trace files, used as the key of the cache."""
+    digest = hashlib.blake2b(digest_size=20)
+    for node_files in files:
+        for file_name in node_files:
+            digest.update(os.path.basename(os.path.dirname(file_name)).encode())
+            with open(file_name, "rb") as file:
+                for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_cache_index(cache_folder):
+    index_file = os.path.join(cache_folder, CACHE_INDEX_FILE_NAME)
+    if not os.path.isfile(index_file):
+        return None
+    try:
+        with open(index_file, "r") as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != CACHE_VERSION:
+        return None
+    return index
+
+
+def write_cache_index(cache_folder, index):
+    index_file = os.path.join(cache_folder, CACHE_INDEX_FILE_NAME)
+    tmp_file = index_file + ".tmp"
+    with open(tmp_file, "w") as file:
+        json.dump(index, file)
+    os.replace(tmp_file, index_file)
+
+
+def format_system_times(seconds):
+    """Format wall clock times (seconds since the epoch) as the "System Time" column of the CSV traces."""
+    unique, inverse = np.unique(seconds, return_inverse=True)
+    formatted = np.array([time.strftime(SYSTEM_TIME_FORMAT, time.localtime(int(t))) for t in unique], dtype=str)
+    return formatted[inverse] if len(unique) else np.empty(0, dtype=str)
+
+
+def read_binary_trace_file(file_name):
+    """Read a binary trace file through a memory map.
+
+    A partially written trailing record, if any, is ignored.
+
+    Args:
+        file_name (str): The trace file.
+
+    Raises:
+        ValueError: If the file is not a binary trace or its version or record layout is not supported.
+
+    Returns:
+        tuple: Same as read_trace_file.
+    """
+    header = np.fromfile(file_name, dtype=BINARY_TRACE_HEADER, count=1)
+    if len(header) == 0 or header["magic"][0] != BINARY_TRACE_MAGIC:
+        raise ValueError(f"{file_name} is not a binary trace file")
+    if header["version"][0] != BINARY_TRACE_VERSION or header["record_size"][0] != TRACE_RECORD_DTYPE.itemsize:
+        raise ValueError(f"Unsupported binary trace {file_name}: version {header['version'][0]}, "
+                         f"record size {header['record_size'][0]}")
+    n_records = (os.path.getsize(file_name) - BINARY_TRACE_HEADER.itemsize) // TRACE_RECORD_DTYPE.itemsize
+    if n_records > 0:
+        records = np.memmap(file_name, dtype=TRACE_RECORD_DTYPE, mode="r", offset=BINARY_TRACE_HEADER.itemsize,
+                            shape=(n_records,))
+    else:
+        records = np.empty(0, dtype=TRACE_RECORD_DTYPE)
+    return parse_trace_records(records)
+
+
+def parse_trace_records(records):
+    """Convert binary trace records (a TRACE_RECORD_DTYPE array) to the read_trace_file output."""
+    n_records = len(records)
+    columns = cube_columns(TRACE_COLUMNS)
+    metrics = [c for c in columns if c not in TEXT_COLUMNS]
+    data = np.empty((n_records, len(metrics)), dtype=np.float64)
+    for i, name in enumerate(metrics):
+        data[:, i] = records[name]
+    text = np.stack([format_system_times(records[name]) for name in TEXT_COLUMNS], axis=1) if n_records else \
+        np.empty((0, len(TEXT_COLUMNS)), dtype=str)
+    return columns, data, text
+
+
+def read_trace_file(file_name):
+    """Parse a single trace file with the fixed trace schema.
+
+    Binary traces (traces.bin) are read with read_binary_trace_file.
+
+    Args:
+        file_name (str): The trace file.
+
+    Returns:
+        tuple: The cube column names, the numeric columns as a [interval, metric] array and the
+        non numeric columns as a [interval, text metric] array.
+    """
+    if file_name.endswith(BINARY_TRACES_FILE_NAME):
+        return read_binary_trace_file(file_name)
+    with open(file_name, "r") as file:
+        header = file.readline().rstrip("\n").split(",")
+    return parse_trace_csv(file_name, header)
+
+
+def parse_trace_csv(source, header):
+    """Parse CSV trace data with the fixed trace schema.
+
+    Args:
+        source (str or file): A trace file name or a buffer holding the CSV lines, header included.
+        header (list): The column names of the header line.
+
+    Returns:
+        tuple: Same as read_trace_file.
+    """
+    dtype = {c: TRACE_SCHEMA[c] for c in header if c in TRACE_SCHEMA}
+    df = pd.read_csv(source, dtype=dtype, engine=CSV_ENGINE)
+    if POSITION_COLUMN in df.columns:
+        position = parse_positions(df[POSITION_COLUMN])
+        location = df.columns.get_loc(POSITION_COLUMN)
+        df = df.drop(columns=[POSITION_COLUMN])
+        for i, name in enumerate(POSITION_COLUMNS):
+            df.insert(location + i, name, position[:, i])
+    metrics = [c for c in df.columns if c not in TEXT_COLUMNS]
+    text_metrics = [c for c in df.columns if c in TEXT_COLUMNS]
+    data = df[metrics].to_numpy(dtype=np.float64)
+    text = df[text_metrics].to_numpy(dtype=str) if text_metrics else np.empty((len(df), 0), dtype=str)
+    return list(df.columns), data, text
+
+
+def read_trace_files(file_names, workers=None):
+    """Parse trace files in parallel on a process pool.
+
+    Args:
+        file_names (list): The trace files.
+        workers (int): The number of worker processes, all the CPU threads by default.
+
+    Returns:
+        list: The result of read_trace_file for every file, in order.
+    """
+    if workers is None:
+        workers = mp.cpu_count()
+    workers = max(1, min(workers, len(file_names)))
+    total_bytes = sum(os.path.getsize(f) for f in file_names)
+    start = time.perf_counter()
+    if workers > 1:
+        chunksize = max(1, len(file_names) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parsed = list(executor.map(read_trace_file, file_names, chunksize=chunksize))
+    else:
+        parsed = [read_trace_file(f) for f in file_names]
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    logging.info(f"Ingested {len(file_names)} trace files ({total_bytes / 1e6:.1f} MB) in {elapsed:.2f}s with {workers} "
+                 f"worker(s) and the {CSV_ENGINE} engine: {len(file_names) / elapsed:.1f} files/s, {total_bytes / 1e6 / elapsed:.1f} MB/s")
+    return parsed
+
+
+def build_trace_cube(files, workers=None):
+    """Parse the trace files and pack them into a TraceCube.
+
+    Args:
+        files (list): A list of lists of trace file names, indexed as [ue][gnb].
+        workers (int): The number of ingest worker processes, all the CPU threads by default.
+
+    Raises:
+        ValueError: If the trace files do not share the same columns.
+
+    Returns:
+        TraceCube: The packed traces.
+    """
+    nUEs, nGnb = len(files), len(files[0]) if files else 0
+    file_names = [file_name for node_files in files for file_name in node_files]
+    return pack_trace_cube(read_trace_files(file_names, workers), nUEs, nGnb, file_names)
+
+
+def pack_trace_cube(parsed, nUEs, nGnb, names=None, times=None):
+    """Pack parsed traces into a TraceCube aligned on a common time grid.
+
+    Every row is placed at the tick of its "Time" value, so a trace that started late, ended early
+    or skipped samples does not shift the rest of its rows. The ticks a trace did not report are
+    filled by fill_missing_ticks and logged as a warning.
+
+    Args:
+        parsed (list): The read_trace_file output of every trace, in [ue][gnb] order.
+        nUEs (int): The number of UEs.
+        nGnb (int): The number of gNBs.
+        names (list): The trace names, used in the error messages.
+        times (ndarray): The time grid, by default the union of the times of all the traces.
+            Rows outside of the given grid are dropped.
+
+    Raises:
+        ValueError: If the traces do not share the same columns.
+
+    Returns:
+        TraceCube: The packed traces.
+    """
+    names = names if names is not None else [f"{ue}/{gnb}" for ue in range(nUEs) for gnb in range(nGnb)]
+    columns = parsed[0][0]
+    for name, (file_columns, _, _) in zip(names, parsed):
+        if file_columns != columns:
+            raise ValueError(f"Trace {name} has columns {file_columns}, expected {columns}")
+    metrics = [c for c in columns if c not in TEXT_COLUMNS]
+    text_metrics = [c for c in columns if c in TEXT_COLUMNS]
+    time_index = metrics.index("Time")
+    lengths = np.array([len(data) for _, data, _ in parsed], dtype=np.int64).reshape(nUEs, nGnb)
+
+    keys = [np.round(data[:, time_index], TIME_DECIMALS) for _, data, _ in parsed]
+    if times is None:
+        grid = np.unique(np.concatenate(keys)) if keys else np.empty(0)
+    else:
+        grid = np.round(np.asarray(times, dtype=np.float64), TIME_DECIMALS)
+    nIntervals = len(grid)
+
+    data = np.full((nUEs, nGnb, nIntervals, len(metrics)), np.nan)
+    text_width = max([1] + [text.dtype.itemsize // np.dtype("<U1").itemsize for _, _, text in parsed])
+    text = np.full((nUEs, nGnb, nIntervals, len(text_metrics)), "", dtype=f"<U{text_width}")
+    valid = np.zeros((nUEs, nGnb, nIntervals), dtype=bool)
+    grid_times = np.full(nIntervals, np.nan) if times is None else np.asarray(times, dtype=np.float64).copy()
+    dropped = 0
+    # Reverse order, so the time of a tick is taken from the first trace that reported it
+    for i in reversed(range(len(parsed))):
+        _, file_data, file_text = parsed[i]
+        ue, gnb = divmod(i, nGnb)
+        ticks = np.searchsorted(grid, keys[i])
+        inside = ticks < nIntervals
+        inside[inside] = grid[ticks[inside]] == keys[i][inside]
+        dropped += int(np.count_nonzero(~inside))
+        ticks = ticks[inside]
+        data[ue, gnb, ticks, :] = file_data[inside]
+        text[ue, gnb, ticks, :] = file_text[inside]
+        valid[ue, gnb, ticks] = True
+        if times is None:
+            grid_times[ticks] = file_data[inside, time_index]
+    if dropped:
+        logging.warning(f"{dropped} trace rows are not on the time grid and were dropped")
+    data[..., time_index] = grid_times
+    cube = TraceCube(data, metrics, grid_times, lengths, text, text_metrics, valid)
+    report = cube.alignment_report()
+    if report:
+        truncated = [name for name, r in report.items() if r["truncated"]]
+        late = [name for name, r in report.items() if r["late"]]
+        gaps = [name for name, r in report.items() if r["gaps"]]
+        logging.warning(f"{len(report)} of {nUEs * nGnb} traces miss ticks of the {nIntervals} interval grid: "
+                        f"{len(truncated)} truncated {truncated[:10]}, {len(late)} started late {late[:10]}, "
+                        f"{len(gaps)} with gaps {gaps[:10]}. Missing ticks repeat the previous sample with RSRP -inf")
+    return fill_missing_ticks(cube)
+
+
+def fill_missing_ticks(cube):
+    """Fill the ticks a trace did not report, in place.
+
+    A missing tick repeats the previous sample of the trace (the cumulative counters did not grow) and
+    its RSRP is -inf so the gNB is never selected. Before the first sample the metrics are 0, except
+    the UE position and the text columns that are taken from the first sample. "Time" is the time
+    of the tick.
+
+    Args:
+        cube (TraceCube): The aligned traces.
+
+    Returns:
+        TraceCube: The same cube.
+    """
+    valid = cube.valid
+    if valid.all():
+        return cube
+    ticks = np.arange(cube.nIntervals)
+    previous = np.maximum.accumulate(np.where(valid, ticks, 0), axis=2)
+    has_previous = np.logical_or.accumulate(valid, axis=2)
+    following = np.flip(np.minimum.accumulate(np.flip(np.where(valid, ticks, cube.nIntervals - 1), axis=2), axis=2), axis=2)
+    source = np.where(has_previous, previous, following)
+    cube.data[:] = np.take_along_axis(cube.data, source[..., None], axis=2)
+    cube.text[:] = np.take_along_axis(cube.text, source[..., None], axis=2)
+    position = [cube.metric_index[c] for c in POSITION_COLUMNS if c in cube.metric_index]
+    other = [i for i in range(len(cube.metrics)) if i not in position]
+    before_first = cube.data[~has_previous]
+    before_first[:, other] = 0
+    cube.data[~has_previous] = before_first
+    missing = ~valid
+    rows = cube.data[missing]
+    rows[np.isnan(rows)] = 0
+    rows[:, cube.metric_index["Rsrp"]] = -np.inf
+    rows[:, cube.metric_index["Time"]] = np.broadcast_to(cube.times, valid.shape)[missing]
+    cube.data[missing] = rows
+    return cube
+
+
+def add_derived_columns(cube, interval):
+    """Compute the per interval increments of the counters and the throughput of every trace.
+
+    The traces extracted from the simulation are aggregated, so the packets and bytes of an interval
+    are the difference between consecutive rows. For the first interval the difference is the
+    value itself. This is done in a single vectorized pass over the whole cube.
+
+    Args:
+        cube (TraceCube): The traces.
+        interval (float): The sample time interval in seconds.
+
+    Returns:
+        TraceCube: A new cube with the DERIVED_COLUMNS metrics (replaced if they were already present).
+    """
+    metrics = [m for m in cube.metrics if m not in DERIVED_COLUMNS]
+    base = np.stack([cube.column(m) for m in metrics], axis=-1)
+    derived = {name: np.diff(cube.column(source), axis=2, prepend=0) for name, source in DIFF_COLUMNS.items()}
+    derived["Throughput"] = (derived["RxBytesDiff"] * 8) / interval
+    data = np.concatenate([base, np.stack([derived[name] for name in DERIVED_COLUMNS], axis=-1)], axis=-1)
+    return TraceCube(data, metrics + DERIVED_COLUMNS, cube.times, cube.lengths, cube.text, cube.text_metrics, cube.valid)
+
+
+def cache_trace_cube(traces_sim_folder, cube, files, interval=None):
+    """Store a cube built from the given trace files as the trace cache of the run.
+
+    Args:
+        traces_sim_folder (str): The folder where the traces are stored.
+        cube (TraceCube): The traces, with the derived columns if interval is set.
+        files (list): The source trace files, indexed as [ue][gnb].
+        interval (float): The sample time interval the derived columns were computed with.
+    """
+    index = {"key": content_hash(files), "fingerprint": stat_fingerprint(files), "interval": interval}
+    cube.save(os.path.join(traces_sim_folder, CACHE_FOLDER_NAME), index)
+
+
+def load_trace_cube(traces_sim_folder, nUEs, nGnb, interval=None, use_cache=True, workers=None):
+    """Load the traces of a simulation run as a TraceCube.
+
+    The cube is cached in <traces_sim_folder>/trace-cache as memory-mapped .npy files, keyed by a
+    content hash of the source trace files. The hash is only recomputed when the size or modification
+    time of a source file changed, so loading an up to date cache never reads the traces.
+    The derived columns (see add_derived_columns) are stored in the cache as well, they are only
+    recomputed when the sample interval changes.
+
+    Args:
+        traces_sim_folder (str): The folder where the traces are stored.
+        nUEs (int): The number of UEs.
+        nGnb (int): The number of gNBs.
+        interval (float): The sample time interval in seconds, if set the derived columns are added.
+        use_cache (bool): If False, the traces are always parsed and the cache is not written.
+        workers (int): The number of ingest worker processes, all the CPU threads by default.
+
+    Raises:
+        FileNotFoundError: If a trace file is not found.
+
+    Returns:
+        TraceCube: The traces of the run.
+    """
+    files = get_trace_files(traces_sim_folder, nUEs, nGnb)
+    if not use_cache:
+        cube = build_trace_cube(files, workers)
+        return add_derived_columns(cube, interval) if interval is not None else cube
+
+    cache_folder = os.path.join(traces_sim_folder, CACHE_FOLDER_NAME)
+    index = read_cache_index(cache_folder)
+    fingerprint = stat_fingerprint(files)
+    cube = None
+    if index is not None and index.get("fingerprint") == fingerprint:
+        logging.info(f"Loading traces from cache {cache_folder}")
+        cube = TraceCube.open(cache_folder, index)
+    else:
+        key = content_hash(files)
+        if index is not None and index.get("key") == key:
+            logging.info(f"Trace files touched but unchanged, loading traces from cache {cache_folder}")
+            index["fingerprint"] = fingerprint
+            write_cache_index(cache_folder, index)
+            cube = TraceCube.open(cache_folder, index)
+        else:
+            logging.info(f"Parsing {nUEs * nGnb} trace files")
+            cube = build_trace_cube(files, workers)
+            index = {"key": key, "fingerprint": fingerprint, "interval": None}
+            if interval is None:
+                cube.save(cache_folder, index)
+                return TraceCube.open(cache_folder, read_cache_index(cache_folder))
+
+    if interval is not None and index.get("interval") != interval:
+        logging.info(f"Computing the derived columns for a {interval}s interval")
+        cube = add_derived_columns(cube, interval)
+        cube.save(cache_folder, dict(index, interval=interval))
+        cube = TraceCube.open(cache_folder, read_cache_index(cache_folder))
+    return cube
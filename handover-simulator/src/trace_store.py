@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+# Lazy, memory-bounded access to the traces of a run: the per UE DataFrames are built on demand
+# from the memory-mapped trace cube and kept in an LRU cache bounded by a memory budget.
+import logging
+from collections import OrderedDict
+
+from trace_cube import TraceCubeHandle
+
+
+class TraceStore:
+    """Drop-in replacement of the simDataframes nested list that pages UEs in on demand.
+
+    store[ue] returns the list of DataFrames of a UE, indexed by gNB, as simDataframes[ue] does.
+    The DataFrames are built from the UE slice of the trace cube, which is memory-mapped from the
+    trace cache, and the least recently used UEs are evicted once their DataFrames exceed the budget.
+    The UE being returned is never evicted, so a single UE larger than the budget still works.
+    A store over the trace cache pickles as the handle of the cache, without its DataFrames, and the
+    process that unpickles it memory-maps the cache itself.
+
+    Attributes:
+        cube (TraceCube): The traces of the run.
+        memory_budget (int): Maximum size in bytes of the cached DataFrames, None for no limit.
+        loads (int): Number of UEs built from the cube, evicted UEs count again when reloaded.
+    """
+
+    def __init__(self, cube, memory_budget=None):
+        self.cube = cube
+        self.memory_budget = memory_budget
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.loads = 0
+
+    def __len__(self):
+        return self.cube.nUEs
+
+    def __getstate__(self):
+        cube = self.cube.handle if self.cube.handle is not None else self.cube
+        return {"cube": cube, "memory_budget": self.memory_budget}
+
+    def __setstate__(self, state):
+        cube = state["cube"]
+        self.__init__(cube.open() if isinstance(cube, TraceCubeHandle) else cube, state["memory_budget"])
+
+    def __getitem__(self, ue):
+        if ue < 0 or ue >= len(self):
+            raise IndexError(f"UE {ue} out of range")
+        if ue in self.cache:
+            self.cache.move_to_end(ue)
+            return self.cache[ue][0]
+        dataframes = self.cube.ue_dataframes(ue)
+        size = sum(int(df.memory_usage(deep=True).sum()) for df in dataframes)
+        self.loads += 1
+        self.cache[ue] = (dataframes, size)
+        self.cache_bytes += size
+        self._evict()
+        return dataframes
+
+    def __iter__(self):
+        for ue in range(len(self)):
+            yield self[ue]
+
+    def _evict(self):
+        if self.memory_budget is None:
+            return
+        while self.cache_bytes > self.memory_budget and len(self.cache) > 1:
+            ue, (_, size) = self.cache.popitem(last=False)
+            self.cache_bytes -= size
+            logging.debug(f"Evicted the traces of UE {ue} ({size / 1e6:.1f} MB)")
+
+    def batch(self, ues):
+        """The traces of several UEs as a TraceBatch, read from the cube without building DataFrames."""
+        return TraceBatch(self.cube, ues)
+
+    def clear(self):
+        """Drop all the cached DataFrames."""
+        self.cache.clear()
+        self.cache_bytes = 0
+
+
+class TraceBatch:
+    """Columns of the traces of several UEs, read straight from the trace cube.
+
+    The batched engines stack every column of a batch of UEs into a [UE, gNB, interval] array; a
+    TraceBatch gives those arrays from the slices of the memory-mapped cube, so the DataFrames of the
+    batch are never built and the LRU cache of the TraceStore is left alone.
+
+    Attributes:
+        cube (TraceCube): The traces of the run.
+        ues (list): The UEs of the batch.
+    """
+
+    def __init__(self, cube, ues):
+        self.cube = cube
+        self.ues = list(ues)
+
+    def __len__(self):
+        return len(self.ues)
+
+    def column(self, name):
+        """A column of every UE of the batch, see TraceCube.ue_columns."""
+        return self.cube.ue_columns(self.ues, name)
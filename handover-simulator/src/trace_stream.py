@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+# Streaming trace ingest: the trace files are tailed while the ns-3 simulations are still writing
+# them, so the handover algorithms can start on the UEs whose simulations already finished.
+import io
+import os
+import logging
+import threading
+import numpy as np
+
+from trace_cube import (TEXT_COLUMNS, TRACES_FILE_NAME, BINARY_TRACES_FILE_NAME, BINARY_TRACE_MAGIC, BINARY_TRACE_VERSION,
+                        BINARY_TRACE_HEADER, TRACE_RECORD_DTYPE, parse_trace_csv, parse_trace_records,
+                        pack_trace_cube, add_derived_columns, get_trace_files, cache_trace_cube)
+
+
+class TraceTail:
+    """Incremental reader of a trace file that is still being written.
+
+    Only complete rows are returned: CSV lines up to the last newline, or whole binary records.
+    The file format is picked from the file found in the folder, traces.bin first.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.file_name = None
+        self.binary = False
+        self.header = None
+        self.columns = None
+        self.offset = 0
+
+    def _find_file(self):
+        for name in (BINARY_TRACES_FILE_NAME, TRACES_FILE_NAME):
+            file_name = os.path.join(self.folder, name)
+            if os.path.isfile(file_name):
+                self.file_name = file_name
+                self.binary = name == BINARY_TRACES_FILE_NAME
+                return True
+        return False
+
+    def read(self):
+        """Read the rows completed since the previous call.
+
+        Raises:
+            ValueError: If a binary trace has an unsupported header.
+
+        Returns:
+            tuple: Same as trace_cube.read_trace_file, or None if there are no new complete rows.
+        """
+        if self.file_name is None and not self._find_file():
+            return None
+        with open(self.file_name, "rb") as file:
+            file.seek(self.offset)
+            chunk = file.read()
+        if self.header is None:
+            header_size = BINARY_TRACE_HEADER.itemsize if self.binary else chunk.find(b"\n") + 1
+            if header_size == 0 or len(chunk) < header_size:
+                return None
+            self.header = chunk[:header_size]
+            self.offset += header_size
+            chunk = chunk[header_size:]
+            if self.binary:
+                header = np.frombuffer(self.header, dtype=BINARY_TRACE_HEADER)[0]
+                if header["magic"] != BINARY_TRACE_MAGIC or header["version"] != BINARY_TRACE_VERSION or \
+                        header["record_size"] != TRACE_RECORD_DTYPE.itemsize:
+                    raise ValueError(f"Unsupported binary trace {self.file_name}")
+            else:
+                self.columns = self.header.decode("utf-8").rstrip("\n").split(",")
+        if self.binary:
+            size = len(chunk) - len(chunk) % TRACE_RECORD_DTYPE.itemsize
+        else:
+            size = chunk.rfind(b"\n") + 1
+        if size == 0:
+            return None
+        self.offset += size
+        if self.binary:
+            return parse_trace_records(np.frombuffer(chunk[:size], dtype=TRACE_RECORD_DTYPE))
+        return parse_trace_csv(io.BytesIO(self.header + chunk[:size]), self.columns)
+
+
+class StreamingTraceCube:
+    """Trace cube that grows while the ns-3 simulations of a run are writing their traces.
+
+    poll() appends the rows written since the previous call and mark_done() records that the ns-3
+    process of a UE/gNB pair exited. A UE is complete once the simulations of all its gNBs are done,
+    the interval-causal algorithms can then evaluate it while the remaining simulations run.
+    All the methods are thread safe.
+
+    Attributes:
+        traces_sim_folder (str): The folder where the traces are stored.
+        nUEs (int): The number of UEs.
+        nGnb (int): The number of gNBs.
+        rows (ndarray): Number of rows read from each trace, shape [UE, gNB].
+        done (ndarray): Whether the simulation of each UE/gNB pair finished, shape [UE, gNB].
+    """
+
+    def __init__(self, traces_sim_folder, nUEs, nGnb):
+        self.traces_sim_folder = traces_sim_folder
+        self.nUEs = nUEs
+        self.nGnb = nGnb
+        self.tails = [[TraceTail(os.path.join(traces_sim_folder, str(ue), str(gnb))) for gnb in range(nGnb)]
+                      for ue in range(nUEs)]
+        self.chunks = [[[] for _ in range(nGnb)] for _ in range(nUEs)]
+        self.columns = None
+        self.rows = np.zeros((nUEs, nGnb), dtype=np.int64)
+        self.done = np.zeros((nUEs, nGnb), dtype=bool)
+        self.condition = threading.Condition()
+        self.times = None
+
+    def _read(self, ue, gnb):
+        parsed = self.tails[ue][gnb].read()
+        if parsed is None:
+            return 0
+        columns, data, text = parsed
+        if self.columns is None:
+            self.columns = columns
+        elif columns != self.columns:
+            raise ValueError(f"Trace {ue}/{gnb} has columns {columns}, expected {self.columns}")
+        self.chunks[ue][gnb].append((data, text))
+        self.rows[ue, gnb] += len(data)
+        return len(data)
+
+    def _parsed(self, ue, gnb):
+        chunks = self.chunks[ue][gnb]
+        if len(chunks) > 1:
+            chunks[:] = [(np.concatenate([data for data, _ in chunks]), np.concatenate([text for _, text in chunks]))]
+        if self.columns is None:
+            raise ValueError(f"No trace rows read in {self.traces_sim_folder}")
+        if not chunks:
+            nText = len([c for c in self.columns if c in TEXT_COLUMNS])
+            return self.columns, np.empty((0, len(self.columns) - nText)), np.empty((0, nText), dtype=str)
+        return (self.columns,) + chunks[0]
+
+    def poll(self):
+        """Read the rows written to the running traces since the previous poll.
+
+        Returns:
+            int: The number of new rows.
+        """
+        with self.condition:
+            new_rows = 0
+            for ue in range(self.nUEs):
+                for gnb in range(self.nGnb):
+                    if not self.done[ue, gnb]:
+                        new_rows += self._read(ue, gnb)
+            if new_rows:
+                self.condition.notify_all()
+        return new_rows
+
+    def mark_done(self, ue, gnb):
+        """Record that the simulation of a UE/gNB pair finished, reading the rest of its trace."""
+        with self.condition:
+            try:
+                self._read(ue, gnb)
+            finally:
+                self.done[ue, gnb] = True
+                self.condition.notify_all()
+        if self.done[ue].all():
+            logging.info(f"Traces of UE {ue} complete ({int(self.rows[ue].min())} intervals)")
+
+    def ue_complete(self, ue):
+        with self.condition:
+            return bool(self.done[ue].all())
+
+    def wait_for_ues(self, ues, timeout=None):
+        """Wait until the simulations of all the gNBs of at least one of several UEs finished.
+
+        Args:
+            ues (list): The UEs.
+            timeout (float): The longest wait in seconds, no limit if None.
+
+        Returns:
+            list: The complete UEs of ues, in their order, empty if the timeout expired.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: any(self.done[ue].all() for ue in ues), timeout)
+            return [ue for ue in ues if self.done[ue].all()]
+
+    def wait_for_ue(self, ue, timeout=None):
+        """Wait until the simulations of all the gNBs of a UE finished.
+
+        Returns:
+            bool: False if the timeout expired.
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.done[ue].all(), timeout)
+
+    def ue_cube(self, ue, interval=None):
+        """Pack the traces read so far for a UE as a single UE TraceCube.
+
+        Once intervals() was called, the UE is aligned on the interval grid of the first UE.
+
+        Args:
+            ue (int): The UE.
+            interval (float): The sample time interval in seconds, if set the derived columns are added.
+
+        Returns:
+            TraceCube: A [1, gNB, interval, metric] cube.
+        """
+        with self.condition:
+            cube = pack_trace_cube([self._parsed(ue, gnb) for gnb in range(self.nGnb)], 1, self.nGnb,
+                                   [f"{ue}/{gnb}" for gnb in range(self.nGnb)], self.times)
+        return add_derived_columns(cube, interval) if interval is not None else cube
+
+    def ue_dataframes(self, ue, interval=None):
+        """Wait until a UE is complete and return its traces as a list of DataFrames, indexed by gNB."""
+        self.wait_for_ue(ue)
+        return self.ue_cube(ue, interval).to_dataframes()[0]
+
+    def intervals(self):
+        """Wait until the first UE is complete and return its interval grid, used for all the UEs.
+
+        The --trace replay aligns the traces on the grid of all the UEs, which only differs from this
+        grid when the traces of the other UEs report other times, see matches_grid.
+        """
+        self.wait_for_ue(0)
+        with self.condition:
+            if self.times is None:
+                self.times = pack_trace_cube([self._parsed(0, gnb) for gnb in range(self.nGnb)], 1, self.nGnb).times
+            return self.times
+
+    def matches_grid(self, times):
+        """Whether the UEs were aligned on a time grid, e.g. the grid of the cube of the complete traces.
+
+        Args:
+            times (ndarray): The time grid.
+
+        Returns:
+            bool: False if the grid is different or no UE was aligned yet.
+        """
+        with self.condition:
+            return self.times is not None and np.array_equal(self.times, times)
+
+    def to_trace_cube(self, interval=None):
+        """Pack the traces read so far for all the UEs as a TraceCube."""
+        with self.condition:
+            parsed = [self._parsed(ue, gnb) for ue in range(self.nUEs) for gnb in range(self.nGnb)]
+            cube = pack_trace_cube(parsed, self.nUEs, self.nGnb)
+        return add_derived_columns(cube, interval) if interval is not None else cube
+
+    def save_cache(self, interval=None):
+        """Store the complete traces as the trace cache of the run, so load_trace_cube does not parse them again.
+
+        Args:
+            interval (float): The sample time interval in seconds, if set the derived columns are added.
+        """
+        files = get_trace_files(self.traces_sim_folder, self.nUEs, self.nGnb)
+        cache_trace_cube(self.traces_sim_folder, self.to_trace_cube(interval), files, interval)
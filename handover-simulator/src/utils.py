@@ -1,10 +1,13 @@
 import os
+import numpy as np
 import pandas as pd
 import logging
 
 DECISION_PARAMETER = "Rsrp"
 PARAMETERS_FILE_NAME ="parameters.json"
 RESULTS_FILE_NAME ="results.csv"
+# Value of the GNodeB column of the results while the UE is not connected to any gNB
+NO_GNB = -1
 
 MAX_DATARATE_PER_BANDWIDTH_REFERENCE = 98e6 #  aprox 77  Mbps
 BANDWIDTH_REFERENCE = 20.0e6 # 20 MHz
@@ -47,7 +50,8 @@ def apply_penalty(connected_gnb, penalty_dict, time, interval):
                     else:
                         penalty_value = penalty_dict[key] * (time / interval)
                         
-                    connected_gnb.loc[:, key] += penalty_value
+                    # A penalized value is a float, also for the integer counters of the traces
+                    connected_gnb[key] = float(connected_gnb[key]) + penalty_value
 
     return connected_gnb
 
@@ -58,15 +62,102 @@ def get_gnb_data(gnb_id,dataframes, index):
     Args:
         gnb_id (int): The ID of the gNB.
         dataframes (list): A list of lists of dataframes containing the simulation data.
-        index (float): index of the interval to be analyzed.
+        index (int): tick of the interval to be analyzed, the traces are aligned on the interval grid.
 
     Returns:
-        DataFrame: The data of the gNB for the given interval.
+        Series: The data of the gNB for the given interval.
     """
     return  dataframes[gnb_id].iloc[index]
 
 
 
+def compact_results(results):
+    """Build the DataFrame of the per interval results of a UE with compact column types.
+
+    The connected gNB is stored as int16, NO_GNB while the UE is not connected, and the integer columns
+    take the smallest integer type that holds their range. The float columns are kept as float64, they
+    are aggregated by the gNB and scenario metrics.
+
+    Args:
+        results (list): The results of every interval, as dicts or Series.
+
+    Returns:
+        DataFrame: The results, one row per interval.
+    """
+    df = pd.DataFrame(results)
+    for name in df.columns:
+        column = df[name]
+        if name == "GNodeB":
+            df[name] = column.fillna(NO_GNB).astype("int16")
+        elif pd.api.types.is_bool_dtype(column):
+            continue
+        elif pd.api.types.is_integer_dtype(column):
+            df[name] = pd.to_numeric(column, downcast="unsigned" if len(column) and column.min() >= 0 else "integer")
+    return df
+
+
+class Scenario:
+    """Scenario of a simulation: its dimensions, bands and gNBs.
+
+    The bands and gNBs are kept as parsed, and the attributes of every gNB are NumPy arrays indexed by
+    gNB id, the position of the gNB in the scenario file, so the per gNB lookups are array indexing
+    instead of searches of the band of the gNB. The scenario is built once and pickles as its arrays.
+
+    Args:
+        scenario_dimensions (dict): min_x, max_x, min_y and max_y of the scenario.
+        bands (list): The bands, dicts with Band_ID, Central_Frequency_Hz, User_Bandwidth_Hz and GNB_Bandwidth_Hz.
+        gnbs (list): The gNBs, dicts with GNB_ID, Position_X, Position_Y, Position_Z, Band_ID,
+            Transmission_Power_dBm and Type.
+
+    Attributes:
+        position (ndarray): The position of every gNB, shape [gNB, 3].
+        band (ndarray): The position in bands of the band of every gNB.
+        tx_power (ndarray): The transmission power of every gNB in dBm.
+        central_frequency (ndarray): The central frequency of every gNB in Hz.
+        gnb_bandwidth (ndarray): The bandwidth of every gNB in Hz.
+        user_bandwidth (ndarray): The bandwidth of a UE connected to every gNB in Hz.
+        gnb_capacity (ndarray): The datarate of every gNB in bps, see get_datarate.
+        user_capacity (ndarray): The datarate of a UE connected to every gNB in bps.
+        max_users (ndarray): The number of UEs every gNB has bandwidth for.
+        frequency_range (ndarray): FR1, FR2 or Unknown for every gNB.
+
+    Raises:
+        ValueError: If a gNB has a band that is not in bands.
+    """
+
+    __slots__ = ("scenario_dimensions", "bands", "gnbs", "position", "band", "tx_power", "central_frequency",
+                 "gnb_bandwidth", "user_bandwidth", "gnb_capacity", "user_capacity", "max_users", "frequency_range")
+
+    def __init__(self, scenario_dimensions, bands, gnbs):
+        self.scenario_dimensions = scenario_dimensions
+        self.bands = bands
+        self.gnbs = gnbs
+        band_index = {}
+        for i, band in enumerate(bands):
+            band_index.setdefault(band['Band_ID'], i)
+        unknown = [gnb['GNB_ID'] for gnb in gnbs if gnb['Band_ID'] not in band_index]
+        if unknown:
+            raise ValueError(f"gNBs {unknown} have a band that is not in the scenario")
+        self.position = np.array([[gnb['Position_X'], gnb['Position_Y'], gnb['Position_Z']] for gnb in gnbs],
+                                 dtype=np.float64).reshape(len(gnbs), 3)
+        self.band = np.array([band_index[gnb['Band_ID']] for gnb in gnbs], dtype=np.int64)
+        self.tx_power = np.array([gnb['Transmission_Power_dBm'] for gnb in gnbs], dtype=np.float64)
+
+        def band_metric(name):
+            return np.array([band[name] for band in bands], dtype=np.float64)[self.band]
+
+        self.central_frequency = band_metric('Central_Frequency_Hz')
+        self.gnb_bandwidth = band_metric('GNB_Bandwidth_Hz')
+        self.user_bandwidth = band_metric('User_Bandwidth_Hz')
+        self.gnb_capacity = get_datarate(self.gnb_bandwidth)
+        self.user_capacity = get_datarate(self.user_bandwidth)
+        self.max_users = np.floor(self.gnb_bandwidth / self.user_bandwidth).astype(np.int64)
+        # FR1: 410 MHz - 7.125 GHz, FR2: 24.25 GHz - 52.6 GHz
+        central_freq_ghz = self.central_frequency / 1e9
+        self.frequency_range = np.where((0.41 <= central_freq_ghz) & (central_freq_ghz <= 7.125), 'FR1',
+                                        np.where((24.25 <= central_freq_ghz) & (central_freq_ghz <= 52.6), 'FR2', 'Unknown'))
+
+
 def parse_scenario_file(filename):
     """Parse the scenario file and return the scenario information.
 
@@ -74,7 +165,7 @@ def parse_scenario_file(filename):
         filename (str): The name of the scenario file.
 
     Returns:
-        dict (scenario_info): A dictionary containing the scenario information.
+        Scenario: The scenario information, built from the scenario_info dictionary.
         
         
         The scenario_info dictionary has the following structure:
@@ -146,15 +237,26 @@ def parse_scenario_file(filename):
                 gnb_id, position_x, position_y, position_z, band_id, transmission_power, gnb_type = gnb_info
                 scenario_info['gnbs'].append({
                     'GNB_ID': int(gnb_id),
-                    'Position_X': position_x,
-                    'Position_Y': position_y,
-                    'Position_Z': position_z,
+                    'Position_X': float(position_x),
+                    'Position_Y': float(position_y),
+                    'Position_Z': float(position_z),
                     'Band_ID': int(band_id),
-                    'Transmission_Power_dBm': transmission_power,
+                    'Transmission_Power_dBm': float(transmission_power),
                     'Type': gnb_type
                 })
 
-    return scenario_info
+    return Scenario(scenario_info['scenario_dimensions'], scenario_info['bands'], scenario_info['gnbs'])
+
+def scenario_bands(scenario):
+    """Classify the band of every gNB of a scenario by its central frequency.
+
+    Args:
+        scenario (Scenario): The scenario information, see parse_scenario_file.
+
+    Returns:
+        list: FR1, FR2 or Unknown for every gNB.
+    """
+    return scenario.frequency_range.tolist()
 
 def format_frequency(frequency):
     """Format a frequency in Hz, kHz, MHz or GHz.
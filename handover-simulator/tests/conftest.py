@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+# Shared fixtures of the handover simulator tests: small synthetic ns-3 trace folders and the scenario
+# of the repository.
+import os
+import sys
+import json
+import numpy as np
+import pytest
+
+SRC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_FOLDER)
+
+from utils import parse_scenario_file  # noqa: E402
+from trace_cube import TRACE_COLUMNS  # noqa: E402
+
+SCENARIO_FILE = os.path.join(SRC_FOLDER, "..", "scenario", "sc.txt")
+INTERVAL = 0.1
+PACKET_SIZE = 1000
+
+
+def write_traces(folder, rsrp, rx_packets=None, rx_bytes=None, interval=INTERVAL):
+    """Write the traces.csv files of a run and its parameters.json.
+
+    Args:
+        folder (str): The trace folder.
+        rsrp (ndarray): The RSRP of every UE, gNB and tick, shape [UE, gNB, tick].
+        rx_packets (ndarray): The packets received in every tick, 1000 by default.
+        rx_bytes (ndarray): The bytes received in every tick, PACKET_SIZE per packet by default.
+        interval (float): The sample time interval in seconds.
+
+    Returns:
+        str: The trace folder.
+    """
+    rsrp = np.asarray(rsrp, dtype=np.float64)
+    nUEs, nGnb, nTicks = rsrp.shape
+    if rx_packets is None:
+        rx_packets = np.full(rsrp.shape, 1000, dtype=np.int64)
+    if rx_bytes is None:
+        rx_bytes = rx_packets * PACKET_SIZE
+    tx_packets = np.maximum(rx_packets, 1200) + 10
+    for ue in range(nUEs):
+        for gnb in range(nGnb):
+            trace_folder = os.path.join(folder, str(ue), str(gnb))
+            os.makedirs(trace_folder, exist_ok=True)
+            lines = [",".join(TRACE_COLUMNS)]
+            acc = np.cumsum([tx_packets[ue, gnb], rx_packets[ue, gnb], rx_bytes[ue, gnb]], axis=1)
+            for tick in range(nTicks):
+                tx, rx, rx_b = acc[:, tick]
+                lost = tx - rx
+                lines.append(",".join([
+                    repr((tick + 1) * interval), str(tx * PACKET_SIZE), str(tx), str(rx_b), str(rx),
+                    "0.0012345", "0.0012345", "3.14159e-05", str(lost), repr(10.0 + 100.0 * gnb + ue),
+                    repr(rsrp[ue, gnb, tick]), f"{1.5 * tick}:{2.5 * ue}:1.5", f"2024-05-01 10:00:{tick % 60:02d}",
+                ]))
+            with open(os.path.join(trace_folder, "traces.csv"), "w") as file:
+                file.write("\n".join(lines) + "\n")
+    parameters = {"nUEs": nUEs, "interval": interval, "Hys": 2.0, "A3Offset": 1.0, "NrMeasureInt": interval,
+                  "timeToTrigger": 2 * interval, "packetSize": PACKET_SIZE}
+    with open(os.path.join(folder, "parameters.json"), "w") as file:
+        json.dump(parameters, file)
+    return folder
+
+
+@pytest.fixture
+def scenario():
+    return parse_scenario_file(SCENARIO_FILE)
+
+
+@pytest.fixture
+def make_traces(tmp_path):
+    """Write a trace folder in the temporary folder of the test, see write_traces."""
+    count = iter(range(1000))
+
+    def make(rsrp, **kwargs):
+        return write_traces(str(tmp_path / f"traces-{next(count)}"), rsrp, **kwargs)
+    return make
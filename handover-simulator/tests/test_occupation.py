@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from occupation import MD1_QUEUE, MM1_QUEUE, MG1Queue, QueueModel, apply_channel_simulation_array, \
+    calculate_system_waiting_time, get_queue_model
+from trace_cube import load_trace_cube
+from postprocessing import SCENARIO_SBGH, post_process
+from simulator_3gpp_batched import simulate_users_batched
+from utils import DECISION_PARAMETER
+
+from conftest import INTERVAL, PACKET_SIZE
+
+
+def test_queue_models():
+    with pytest.raises(TypeError):
+        QueueModel()
+    occupation = np.array([0.0, 0.3, 0.9, 1.5])
+    assert get_queue_model("md1") is MD1_QUEUE and get_queue_model("mm1") is MM1_QUEUE
+    for queue, service_cv in [(MD1_QUEUE, 0.0), (MM1_QUEUE, 1.0)]:
+        model = get_queue_model("mg1", service_cv)
+        assert model.name == f"mg1-cv{service_cv:g}"
+        np.testing.assert_allclose(model.waiting_time(100.0, occupation[:3]), queue.waiting_time(100.0, occupation[:3]))
+    # M/D/1 is the model of the scalar formula
+    expected = [calculate_system_waiting_time(8e5, rho, 1000) for rho in occupation]
+    np.testing.assert_allclose(MD1_QUEUE.waiting_time(100.0, np.minimum(occupation, 1 - 1e-5)), expected)
+    with pytest.raises(ValueError):
+        get_queue_model("mg1")
+    with pytest.raises(ValueError):
+        get_queue_model("gg1")
+
+
+def test_a_list_of_queue_models_stacks_every_output():
+    occupation = np.array([[0.5, 1.5], [0.9, 2.0]])
+    interval_data = {"Throughput": np.full((2, 2), 4e5), "Latency": np.full((2, 2), 0.01),
+                     "RxPacketsDiff": np.full((2, 2), 50), "RxBytesDiff": np.full((2, 2), 50000.0),
+                     "LostPackets": np.ones((2, 2))}
+    models = [MD1_QUEUE, MG1Queue(0.5), MM1_QUEUE]
+    stacked = apply_channel_simulation_array(interval_data, occupation, 8e5, 1000, models)
+    for m, model in enumerate(models):
+        single = apply_channel_simulation_array(interval_data, occupation, 8e5, 1000, model)
+        assert stacked.keys() == single.keys()
+        for name, values in single.items():
+            np.testing.assert_array_equal(stacked[name][m], values, err_msg=name)
+
+
+def test_post_process_writes_the_results_of_every_queue_model(make_traces, scenario, tmp_path):
+    rng = np.random.default_rng(3)
+    nUEs, nGnb = 4, len(scenario.gnbs)
+    cube = load_trace_cube(make_traces(rng.normal(-90, 6, (nUEs, nGnb, 30))), nUEs, nGnb, INTERVAL, use_cache=False)
+    ueResults = simulate_users_batched(nUEs, cube.to_dataframes(), cube.times, 2.0, 1.0, INTERVAL, INTERVAL,
+                                       DECISION_PARAMETER, 2 * INTERVAL)
+    models = [MD1_QUEUE, MG1Queue(2.0)]
+    scores = post_process(str(tmp_path / "all"), ueResults, cube.times, nGnb, scenario, PACKET_SIZE, SCENARIO_SBGH,
+                          models)
+    assert list(scores) == ["md1", "mg1-cv2"]
+    for model in models:
+        folder = str(tmp_path / model.name)
+        assert scores[model.name] == post_process(folder, ueResults, cube.times, nGnb, scenario, PACKET_SIZE,
+                                                  SCENARIO_SBGH, model)
+        for path, _, files in os.walk(folder):
+            for name in files:
+                expected = os.path.join(path, name)
+                relative = os.path.relpath(expected, folder)
+                parts = ["all"] + ([] if relative.startswith("ue-ideal") else [model.name]) + [relative]
+                assert open(os.path.join(tmp_path, *parts)).read() == open(expected).read(), expected
+    # A larger variation of the service time only adds waiting time
+    latency = [pd.read_csv(tmp_path / "all" / model.name / "gnb" / "GNB-0.csv")["SimLatency"] for model in models]
+    assert (latency[1] >= latency[0]).all()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+import os
+import numpy as np
+import pandas as pd
+
+from trace_cube import load_trace_cube
+from trace_store import TraceStore
+from simulator_common import stack_ue_results
+from postprocessing import SCENARIO_SBGH, post_process, serving_results
+
+from conftest import INTERVAL, PACKET_SIZE
+
+
+def serving_matrix(nUEs, nGnb, nIntervals, seed=4):
+    """A serving-gNB matrix that changes gNB every few intervals, with intervals out of coverage."""
+    rng = np.random.default_rng(seed)
+    serving = np.repeat(rng.integers(-1, nGnb, (nUEs, nIntervals // 5 + 1)), 5, axis=1)[:, :nIntervals]
+    serving[:, 0] = -1
+    return serving
+
+
+def test_post_process_takes_a_serving_matrix(make_traces, scenario, tmp_path):
+    rng = np.random.default_rng(4)
+    nUEs, nGnb, nIntervals = 5, len(scenario.gnbs), 40
+    cube = load_trace_cube(make_traces(rng.normal(-90, 6, (nUEs, nGnb, nIntervals))), nUEs, nGnb, INTERVAL,
+                           use_cache=False)
+    serving = serving_matrix(nUEs, nGnb, nIntervals)
+
+    ueResults, ue_columns = serving_results(serving, TraceStore(cube, 1), cube.times)
+    for ue, results in enumerate(ueResults):
+        assert (results["GNodeB"].to_numpy() == serving[ue]).all()
+        connected = serving[ue] >= 0
+        expected = cube.column("Throughput")[ue, np.maximum(serving[ue], 0), np.arange(nIntervals)]
+        assert (results["Throughput"].to_numpy() == np.where(connected, expected, 0)).all()
+    # The UE results of the gNB metrics are the ones stacked from the DataFrames
+    stacked = stack_ue_results(ueResults, nUEs)
+    assert ue_columns.keys() == stacked.keys()
+    for name, values in stacked.items():
+        np.testing.assert_array_equal(ue_columns[name], values, err_msg=name)
+
+    matrix_folder, frames_folder = str(tmp_path / "matrix"), str(tmp_path / "frames")
+    score = post_process(matrix_folder, serving, cube.times, nGnb, scenario, PACKET_SIZE, SCENARIO_SBGH,
+                         traces=cube.to_dataframes())
+    assert score == post_process(frames_folder, ueResults, cube.times, nGnb, scenario, PACKET_SIZE, SCENARIO_SBGH)
+    for path, _, files in os.walk(frames_folder):
+        for name in files:
+            expected = os.path.join(path, name)
+            result = os.path.join(matrix_folder, os.path.relpath(expected, frames_folder))
+            assert open(result).read() == open(expected).read(), expected
+    handovers = pd.read_csv(os.path.join(matrix_folder, "ue-ideal", "UE-0.csv"))["Handovers"]
+    changes = (serving[0, 1:] != serving[0, :-1]) & (serving[0, :-1] >= 0)
+    assert handovers.iloc[-1] == changes.sum()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+import os
+import pytest
+
+import run_cache
+from run_cache import RunCache, file_digest
+
+# An ns-3 command of main.run_simulation
+COMMAND = ["ns3.41-sim-optimized", "--path=/traces/a/3/2/", "--logging=0", "--simTime=10", "--gnb=2",
+           "--sc=/scenario/sc.txt", "--MaxPackets=0", "--packetSize=1000", "--bitRate=380000000.0", "--seed=1237",
+           "--int=100000", "--errorModel=ns3::NrEesmCcT1", "--tolerance=1", "--speed=10.0", "--trayectoryTime=5.0",
+           "--traceFormat=csv", "--wp=/waypoints/wp.txt"]
+
+
+def write_file(folder, name, text):
+    os.makedirs(folder, exist_ok=True)
+    file_name = os.path.join(folder, name)
+    with open(file_name, "w") as file:
+        file.write(text)
+    return file_name
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """The scenario, waypoints and ns-3 executable of a run and their digests."""
+    files = {name: write_file(str(tmp_path / "inputs"), name, f"{name} contents\n") for name in ("sc", "wp", "ns3")}
+    return files, {name: file_digest(file_name) for name, file_name in files.items()}
+
+
+def test_same_arguments_hit_the_cache(tmp_path, inputs):
+    _, digests = inputs
+    cache_folder = str(tmp_path / "run-cache")
+    run_folder = str(tmp_path / "run-1")
+    write_file(run_folder, "traces.csv", "Time,Rsrp\n0.1,-80\n")
+    cache = RunCache(cache_folder, digests)
+    assert not cache.lookup(cache.key(COMMAND), run_folder)
+    cache.store(cache.key(COMMAND), run_folder, COMMAND)
+
+    # Another simulation with the same arguments, in another traces folder and with other log settings
+    command = [argument.replace("/traces/a", "/traces/b").replace("--logging=0", "--logging=1") for argument in COMMAND]
+    other_folder = str(tmp_path / "run-2")
+    os.makedirs(other_folder)
+    cache = RunCache(cache_folder, dict(digests))
+    assert cache.key(command) == cache.key(COMMAND)
+    assert cache.lookup(cache.key(command), other_folder)
+    with open(os.path.join(other_folder, "traces.csv")) as file:
+        assert file.read() == "Time,Rsrp\n0.1,-80\n"
+    # A changed ns-3 argument is another run
+    reseeded = [argument.replace("--seed=1237", "--seed=1238") for argument in COMMAND]
+    assert not cache.lookup(cache.key(reseeded), other_folder)
+
+
+@pytest.mark.parametrize("name", ["sc", "wp", "ns3"])
+def test_changed_input_files_miss_the_cache(tmp_path, inputs, name):
+    files, digests = inputs
+    cache_folder = str(tmp_path / "run-cache")
+    run_folder = str(tmp_path / "run")
+    write_file(run_folder, "traces.csv", "Time,Rsrp\n0.1,-80\n")
+    RunCache(cache_folder, digests).store(RunCache(cache_folder, digests).key(COMMAND), run_folder, COMMAND)
+
+    with open(files[name], "a") as file:
+        file.write("changed\n")
+    changed = dict(digests, **{name: file_digest(files[name])})
+    assert changed[name] != digests[name]
+    cache = RunCache(cache_folder, changed)
+    assert not cache.lookup(cache.key(COMMAND), str(tmp_path / "run"))
+
+
+def test_interrupted_store_is_a_miss(tmp_path, inputs, monkeypatch):
+    _, digests = inputs
+    cache = RunCache(str(tmp_path / "run-cache"), digests)
+    run_folder = str(tmp_path / "run")
+    write_file(run_folder, "traces.csv", "Time,Rsrp\n0.1,-80\n")
+
+    def interrupted(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    # The trace is stored, but the run is interrupted before its run.json is written
+    monkeypatch.setattr(run_cache.json, "dump", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        cache.store(cache.key(COMMAND), run_folder, COMMAND)
+    monkeypatch.undo()
+    entry_folder = os.path.join(cache.cache_folder, cache.key(COMMAND))
+    assert os.path.isfile(os.path.join(entry_folder, "traces.csv"))
+    assert not os.path.isfile(os.path.join(entry_folder, "run.json"))
+    assert not cache.lookup(cache.key(COMMAND), str(tmp_path / "other"))
+    # The next run stores the trace again
+    cache.store(cache.key(COMMAND), run_folder, COMMAND)
+    os.makedirs(str(tmp_path / "other"))
+    assert cache.lookup(cache.key(COMMAND), str(tmp_path / "other"))
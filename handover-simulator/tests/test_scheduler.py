@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+import os
+import pytest
+
+import scheduler
+from scheduler import run_algorithms
+from simulator_common import create_worker_pool
+
+
+def record(folder, name, pool=None):
+    """An algorithm that writes the process it ran in, and the process of a task of its pool."""
+    pids = [os.getpid()] + ([pool.apply(os.getpid)] if pool is not None else [])
+    with open(os.path.join(folder, name), "w") as file:
+        file.write(" ".join(map(str, pids)))
+
+
+def fail(folder, name):
+    raise ValueError(name)
+
+
+@pytest.fixture
+def algorithms(monkeypatch):
+    monkeypatch.setattr(scheduler, "ALGORITHMS", {"per-ue": (__name__, "record"), "whole": (__name__, "record"),
+                                                  "fail": (__name__, "fail")})
+    monkeypatch.setattr(scheduler, "POOL_ALGORITHMS", {"per-ue"})
+
+
+def read_pids(folder, name):
+    return [int(pid) for pid in open(os.path.join(folder, name)).read().split()]
+
+
+def test_algorithms_share_the_worker_pool(tmp_path, algorithms):
+    folder = str(tmp_path)
+    with create_worker_pool(processes=2) as pool:
+        run_algorithms({"per-ue": ((folder, "per-ue"), {}), "whole": ((folder, "whole"), {})}, pool)
+    # The per UE algorithm runs in this process and submits its work to the pool, the other one runs in the pool
+    per_ue, pool_pid = read_pids(folder, "per-ue")
+    assert per_ue == os.getpid() and pool_pid != os.getpid()
+    assert read_pids(folder, "whole")[0] != os.getpid()
+
+
+def test_a_failed_algorithm_lets_the_others_finish(tmp_path, algorithms):
+    folder = str(tmp_path)
+    with pytest.raises(RuntimeError, match="fail"):
+        run_algorithms({"fail": ((folder, "fail"), {}), "per-ue": ((folder, "per-ue"), {}),
+                        "whole": ((folder, "whole"), {})})
+    assert os.path.isfile(os.path.join(folder, "per-ue")) and os.path.isfile(os.path.join(folder, "whole"))
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+import os
+import numpy as np
+
+from scoring import calculate_score, calculate_score_tensor
+from trace_cube import load_trace_cube
+
+from conftest import INTERVAL
+
+
+def test_score_tensor_matches_calculate_score(make_traces, scenario):
+    rng = np.random.default_rng(13)
+    nUEs, nGnb, nTicks = 3, len(scenario.gnbs), 25
+    # RSRPs below, inside and above the range of the power parameter
+    folder = make_traces(rng.uniform(-115, -65, (nUEs, nGnb, nTicks)).round(3))
+    # Traces that miss some ticks, their RSRP is -inf there
+    for ue, gnb, ticks in [(0, 2, [4, 5]), (1, 7, [0]), (2, 0, [12, 24])]:
+        file_name = os.path.join(folder, str(ue), str(gnb), "traces.csv")
+        lines = open(file_name).read().splitlines()
+        with open(file_name, "w") as file:
+            file.write("\n".join(line for i, line in enumerate(lines) if i - 1 not in ticks) + "\n")
+    cube = load_trace_cube(folder, nUEs, nGnb, INTERVAL, use_cache=False)
+    assert np.isneginf(cube.column("Rsrp")).sum() == 5
+    simDataframes = cube.to_dataframes()
+    alpha, beta = 0.7, 0.3
+    scores = calculate_score_tensor(cube.column("Rsrp"), scenario, alpha, beta)
+    assert scores.shape == (nUEs, nGnb, cube.nIntervals)
+    for ue in range(nUEs):
+        for gnb in range(nGnb):
+            df = simDataframes[ue][gnb]
+            for tick in range(cube.nIntervals):
+                assert scores[ue, gnb, tick] == calculate_score(df.iloc[tick], scenario, gnb, alpha, beta)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+import numpy as np
+import pandas as pd
+
+from utils import DECISION_PARAMETER, compact_results
+from trace_cube import load_trace_cube
+from simulator_3gpp import simulate_user
+from simulator_3gpp_batched import simulate_users_batched
+import simulator_3gpp_rel16
+import simulator_3gpp_rel16_batched
+
+from conftest import INTERVAL, PACKET_SIZE
+
+A3_PARAMETERS = (2.0, 1.0, INTERVAL, INTERVAL, DECISION_PARAMETER, 2 * INTERVAL)
+# The FR2 hysteresis and time to trigger of CHO
+CHO_FR2_PARAMETERS = (4.0, 3 * INTERVAL)
+
+
+def alternating_traces(make_traces, nUEs=3, nGnb=4, nTicks=80, period=20):
+    """Traces where the best gNB alternates between gNB 0 and gNB 1 every period ticks."""
+    rng = np.random.default_rng(7)
+    rsrp = rng.normal(-100, 1, (nUEs, nGnb, nTicks))
+    best = (np.arange(nTicks) // period) % 2
+    for ue in range(nUEs):
+        rsrp[ue, best, np.arange(nTicks)] = -60.0 - ue
+        rsrp[ue, 1 - best, np.arange(nTicks)] = -75.0
+    cube = load_trace_cube(make_traces(rsrp.round(3)), nUEs, nGnb, INTERVAL, use_cache=False)
+    return cube.to_dataframes(), cube.times
+
+
+def run_engines(simDataframes, intervals, penalty_time, penalty_dict):
+    scalar = [compact_results(simulate_user(ue, simDataframes, intervals, *A3_PARAMETERS, penalty_time, None,
+                                            PACKET_SIZE, penalty_dict)) for ue in range(len(simDataframes))]
+    batched = [compact_results(results) for results in
+               simulate_users_batched(len(simDataframes), simDataframes, intervals, *A3_PARAMETERS, penalty_time,
+                                      penalty_dict)]
+    return scalar, batched
+
+
+def test_a_ue_hands_over_more_than_once(make_traces):
+    simDataframes, intervals = alternating_traces(make_traces)
+    for ueResults in run_engines(simDataframes, intervals, INTERVAL, {"Latency": 0.02}):
+        for results in ueResults:
+            # Attached to gNB 0, then every change of the best gNB is a handover
+            assert results["Handovers"].iloc[-1] == 3
+            assert results["GNodeB"].diff().fillna(0).ne(0).sum() == 4
+
+
+def test_batched_engine_models_the_handover_penalty(make_traces):
+    simDataframes, intervals = alternating_traces(make_traces)
+    penalty_dict = {"LatencySum": 0.02, "Rsrp": -3.0, "TxPacketsDiff": 5, "PosX": 0.5, "Latency": 0.02}
+    scalar, batched = run_engines(simDataframes, intervals, 2.5 * INTERVAL, penalty_dict)
+    for result, expected in zip(batched, scalar):
+        pd.testing.assert_frame_equal(result, expected, check_exact=True)
+    unpenalized, _ = run_engines(simDataframes, intervals, 2.5 * INTERVAL, None)
+    # The interruption degrades three rows of every handover, the last one by half of the penalty
+    latency = scalar[0]["Latency"] - unpenalized[0]["Latency"]
+    assert np.count_nonzero(latency.round(9)) == 3 * 3
+    assert sorted(set(latency.round(9))) == [0.0, 0.01, 0.02]
+
+
+def test_batched_cho_engine_matches_the_scalar_engine(make_traces):
+    simDataframes, intervals = alternating_traces(make_traces, nUEs=4, nGnb=5, nTicks=120, period=15)
+    # gNB 0 and gNB 1, between which the UEs alternate, are in different frequency ranges
+    bands = ["FR2", "FR1", "FR2", "FR1", "FR2"]
+    penalty_dict = {"LatencySum": 0.02, "Rsrp": -3.0, "TxPacketsDiff": 5, "Latency": 0.02}
+    penalty_time = 2.5 * INTERVAL
+    scalar = [compact_results(simulator_3gpp_rel16.simulate_user(ue, simDataframes, intervals, *A3_PARAMETERS,
+                                                                 penalty_time, bands, PACKET_SIZE, penalty_dict,
+                                                                 *CHO_FR2_PARAMETERS))
+              for ue in range(len(simDataframes))]
+    batched = [compact_results(results) for results in
+               simulator_3gpp_rel16_batched.simulate_users_batched(len(simDataframes), simDataframes, intervals,
+                                                                   *A3_PARAMETERS, bands, *CHO_FR2_PARAMETERS,
+                                                                   penalty_time, penalty_dict)]
+    for result, expected in zip(batched, scalar):
+        pd.testing.assert_frame_equal(result, expected, check_exact=True)
+        assert result["Handovers"].iloc[-1] > 1
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+import numpy as np
+
+from utils import DECISION_PARAMETER
+from trace_cube import load_trace_cube
+from simulator_common import GNB_COLUMNS, GNB_INTEGER_COLUMNS, RESTRICTED_COLUMNS, simulate_gnbs, \
+    simulate_users_restricted
+from simulator_3gpp_batched import simulate_users_batched
+
+from conftest import INTERVAL, PACKET_SIZE
+
+
+def test_gnb_and_restricted_results_have_fixed_columns_and_types(make_traces, scenario):
+    rng = np.random.default_rng(2)
+    nUEs, nGnb = 4, len(scenario.gnbs)
+    cube = load_trace_cube(make_traces(rng.normal(-90, 6, (nUEs, nGnb, 30))), nUEs, nGnb, INTERVAL, use_cache=False)
+    ueResults = simulate_users_batched(nUEs, cube.to_dataframes(), cube.times, 2.0, 1.0, INTERVAL, INTERVAL,
+                                       DECISION_PARAMETER, 2 * INTERVAL)
+    gnbResults = simulate_gnbs(nGnb, cube.times, nUEs, ueResults, scenario, PACKET_SIZE)
+
+    connected = np.stack([results["ConnectedUEs"].to_numpy() for results in gnbResults])
+    # Idle gNBs, gNBs with idle intervals and busy gNBs have the same layout
+    assert (connected == 0).all(axis=1).any() and (connected > 0).any()
+    for results in gnbResults:
+        assert list(results.columns) == GNB_COLUMNS
+        for name in GNB_COLUMNS:
+            assert results[name].dtype == (np.int64 if name in GNB_INTEGER_COLUMNS else np.float64), name
+        # Only the latency weighted by the throughput has no value, while the connected UEs receive nothing
+        assert not results.drop(columns=["Latency", "ChannelDelay"]).isna().any().any()
+        assert (results["Throughput"][results["Latency"].isna()] == 0).all()
+        idle = results["ConnectedUEs"] == 0
+        assert (results.loc[idle, ["Throughput", "Latency", "MeanThroughput", "ChannelDelay"]] == 0).all().all()
+
+    restricted = simulate_users_restricted(ueResults, gnbResults, nUEs, cube.times, PACKET_SIZE)
+    for results, ideal in zip(restricted, ueResults):
+        assert list(results.columns) == list(ideal.columns) + ["SimLatency", "PLostPackets"]
+        for name in results.columns:
+            expected = np.float64 if name in RESTRICTED_COLUMNS else ideal[name].dtype
+            assert results[name].dtype == expected, name
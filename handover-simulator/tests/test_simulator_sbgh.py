@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+import numpy as np
+
+from simulator_sbgh import GnbLoad
+
+
+def test_gnb_load_follows_the_connected_ues(scenario):
+    rng = np.random.default_rng(11)
+    nUEs, nGnb = 60, len(scenario.gnbs)
+    load = GnbLoad(scenario)
+    connected = [-1] * nUEs
+    for _ in range(500):
+        ue = rng.integers(nUEs)
+        gnb_id = int(rng.integers(-1, nGnb))
+        load.move(connected[ue], gnb_id)
+        connected[ue] = gnb_id
+        counts = np.bincount([c for c in connected if c >= 0], minlength=nGnb)
+        np.testing.assert_array_equal(load.connected_ues, counts)
+        np.testing.assert_array_equal(load.remaining_throughput,
+                                      scenario.gnb_capacity - counts * scenario.user_capacity)
+        for gnb in range(nGnb):
+            # The admission rule of the UE count: the UEs already connected leave room for one more
+            assert load.admits(gnb) == (counts[gnb] * scenario.user_capacity[gnb] < scenario.gnb_capacity[gnb])
+    # Detaching every UE frees the whole capacity of the gNBs
+    for ue in range(nUEs):
+        load.move(connected[ue], None)
+    np.testing.assert_array_equal(load.connected_ues, np.zeros(nGnb))
+    np.testing.assert_array_equal(load.remaining_throughput, scenario.gnb_capacity)
+
+
+def test_gnb_load_admits_up_to_the_capacity_of_the_gnb(scenario):
+    load = GnbLoad(scenario)
+    for gnb in range(len(scenario.gnbs)):
+        while load.admits(gnb):
+            load.update(gnb, 1)
+        assert load.connected_ues[gnb] == np.ceil(scenario.gnb_capacity[gnb] / scenario.user_capacity[gnb])
+        load.update(gnb, -1)
+        assert load.admits(gnb)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+import numpy as np
+import pandas as pd
+
+from trace_cube import load_trace_cube
+from trace_store import TraceBatch
+from sweep import ALGORITHM_PARAMETERS, count_ping_pongs, grid_combinations, sweep
+
+from conftest import INTERVAL, PACKET_SIZE
+
+
+def ping_pong_traces(make_traces, nUEs=2, nGnb=8, nTicks=60, period=4):
+    """Traces where the best gNB alternates between gNB 6 and gNB 7 every period ticks."""
+    rng = np.random.default_rng(11)
+    rsrp = rng.normal(-110, 1, (nUEs, nGnb, nTicks))
+    best = 6 + (np.arange(nTicks) // period) % 2
+    rsrp[:, best, np.arange(nTicks)] = -60.0
+    rsrp[:, 13 - best, np.arange(nTicks)] = -70.0
+    return load_trace_cube(make_traces(rsrp.round(3)), nUEs, nGnb, INTERVAL, use_cache=False)
+
+
+def test_count_ping_pongs():
+    intervals = np.arange(1, 9) * 0.5
+    connected = np.array([[-1, 0, 1, 0, 0, 0, 1, 1],
+                          [-1, 0, 1, 1, 1, 1, 0, 0]])
+    # 0 -> 1 -> 0 within 0.5 s, then 0 -> 1 1.5 s later is not a return to the previous gNB
+    assert count_ping_pongs(connected, intervals).tolist() == [1, 0]
+    assert count_ping_pongs(connected, intervals, pingPongTime=2.0).tolist() == [2, 1]
+
+
+def test_sweep_counts_the_ping_pongs_of_every_handover(make_traces, scenario):
+    cube = ping_pong_traces(make_traces)
+    ueDataframes, intervals = [cube.ue_dataframes(ue) for ue in range(cube.nUEs)], cube.times
+    grid = {"Hys": [1.0], "A3Offset": [1.0], "ttt": [0.0, 0.1], "NrMeasureInt": [INTERVAL], "HOInterval": [0.1, 0.3],
+            "HysFR2": [1.0], "tttFR2": [None]}
+    results = sweep(ueDataframes, intervals, INTERVAL, scenario, PACKET_SIZE, grid, list(ALGORITHM_PARAMETERS),
+                    pingPongTime=1.0)
+    assert len(results) == len(grid_combinations(grid, "a3")) + len(grid_combinations(grid, "cho"))
+    assert (results["PingPongs"] > 0).all()
+    # With a short interruption the UEs follow every change of the best gNB, each handover after the
+    # first one of a UE is a return to its previous gNB
+    short = results[results["HOInterval"] == 0.1]
+    assert (short["PingPongs"] == short["Handovers"] - len(ueDataframes)).all()
+    # A longer interruption delays the next A3 evaluation and skips some of the changes
+    fast = results[results["HOInterval"] == 0.1].set_index(["Algorithm", "ttt"])["Handovers"]
+    slow = results[results["HOInterval"] == 0.3].set_index(["Algorithm", "ttt"])["Handovers"]
+    assert (slow <= fast).all() and (slow < fast).any()
+    # The traces read from the cube give the results of the DataFrames
+    pd.testing.assert_frame_equal(sweep(TraceBatch(cube, range(cube.nUEs)), intervals, INTERVAL, scenario, PACKET_SIZE,
+                                        grid, list(ALGORITHM_PARAMETERS), pingPongTime=1.0), results)
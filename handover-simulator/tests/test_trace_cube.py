@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from utils import DECISION_PARAMETER
+from trace_cube import BINARY_TRACE_HEADER, BINARY_TRACE_MAGIC, BINARY_TRACE_VERSION, BINARY_TRACES_FILE_NAME, \
+    FLOAT32_COLUMNS, POSITION_COLUMNS, SYSTEM_TIME_FORMAT, TRACE_COLUMNS, TRACE_RECORD_DTYPE, TRACES_FILE_NAME, \
+    compact_column, load_trace_cube, read_trace_file
+from simulator_3gpp import simulate_3gpp_handover
+from simulator_sbgh import simulate_sbgh_handover
+
+from conftest import INTERVAL, PACKET_SIZE
+
+
+def saturated_traces(make_traces, nUEs=6, nGnb=8, nTicks=30, seed=3):
+    """Traces of UEs well above the capacity of their gNBs, with throughputs float32 cannot hold."""
+    rng = np.random.default_rng(seed)
+    rsrp = rng.normal(-90, 6, (nUEs, nGnb, nTicks)).round(4)
+    rx_packets = rng.integers(40000, 47000, (nUEs, nGnb, nTicks))
+    rx_bytes = rx_packets * PACKET_SIZE + rng.integers(1, 999, (nUEs, nGnb, nTicks))
+    return make_traces(rsrp, rx_packets=rx_packets, rx_bytes=rx_bytes)
+
+
+def float64_dataframes(cube):
+    """The DataFrames of the cube with every metric as float64, as the traces are parsed."""
+    simDataframes = cube.to_dataframes()
+    for ue, dataframes in enumerate(simDataframes):
+        for gnb, df in enumerate(dataframes):
+            for name in FLOAT32_COLUMNS:
+                df[name] = np.asarray(cube.column(name)[ue, gnb], dtype=np.float64)
+    return simDataframes
+
+
+def read_results(folder):
+    results = {}
+    for path, _, files in os.walk(folder):
+        for name in files:
+            file_name = os.path.join(path, name)
+            key = os.path.relpath(file_name, folder)
+            results[key] = open(file_name).read() if name.endswith(".txt") else pd.read_csv(file_name)
+    return results
+
+
+def run_algorithms(folder, simDataframes, cube, scenario):
+    os.makedirs(folder)
+    nUEs, nGnb = cube.nUEs, cube.nGnb
+    intervals = cube.times
+    simulate_3gpp_handover(nUEs, 0, folder, nGnb, 2.0, 1.0, INTERVAL, INTERVAL, DECISION_PARAMETER, 2 * INTERVAL,
+                           INTERVAL, intervals, simDataframes, scenario, PACKET_SIZE, {"Latency": 0.02},
+                           engine="batched")
+    simulate_sbgh_handover(nUEs, 0, folder, nGnb, INTERVAL, simDataframes, intervals, scenario, PACKET_SIZE,
+                           5000.0, 1000.0, {"Latency": 0.02}, INTERVAL)
+    return read_results(os.path.join(folder, "results"))
+
+
+def test_decision_and_capacity_metrics_stay_float64():
+    values = np.array([1128932480.0 + 8, -66.90561234, 3482299200.0 + 40])
+    for name in ["Rsrp", "Throughput"]:
+        assert compact_column(name, values).dtype == np.float64
+    assert compact_column("Distance", np.array([88.5702, 92.2567])).dtype == np.float32
+
+
+def test_compact_types_do_not_change_the_results(make_traces, scenario, tmp_path):
+    folder = saturated_traces(make_traces)
+    cube = load_trace_cube(folder, 6, 8, INTERVAL, use_cache=False)
+    compact = run_algorithms(str(tmp_path / "compact"), cube.to_dataframes(), cube, scenario)
+    reference = run_algorithms(str(tmp_path / "float64"), float64_dataframes(cube), cube, scenario)
+
+    assert compact.keys() == reference.keys()
+    for key, expected in reference.items():
+        result = compact[key]
+        if isinstance(expected, str):
+            # The scores are the same, not only close
+            assert result == expected, key
+            continue
+        assert list(result.columns) == list(expected.columns), key
+        for name in expected.columns:
+            if pd.api.types.is_float_dtype(expected[name]) and name not in ["Throughput", "Rsrp"]:
+                # Only the float32 metrics and the values averaged from them may differ, by their rounding
+                np.testing.assert_allclose(result[name], expected[name], rtol=1e-6, err_msg=f"{key} {name}")
+            else:
+                pd.testing.assert_series_equal(result[name], expected[name], check_exact=True, obj=f"{key} {name}")
+
+
+def test_binary_traces_parse_as_the_csv_traces(tmp_path):
+    rng = np.random.default_rng(5)
+    nTicks = 12
+    records = np.zeros(nTicks, dtype=TRACE_RECORD_DTYPE)
+    records["Time"] = (np.arange(nTicks) + 1) * INTERVAL
+    for name in ["TxBytes", "TxPackets", "RxBytes", "RxPackets", "LostPackets"]:
+        records[name] = np.cumsum(rng.integers(0, 50000, nTicks))
+    for name in ["LatencySum", "LatencyLast", "JitterSum", "Distance", "Rsrp"]:
+        records[name] = rng.normal(-50, 30, nTicks)
+    # The CSV positions are parsed as float32
+    for name in POSITION_COLUMNS:
+        records[name] = rng.normal(0, 300, nTicks).astype(np.float32)
+    records["System Time"] = 1714557600 + np.arange(nTicks) // 3
+    header = np.array([(BINARY_TRACE_MAGIC, BINARY_TRACE_VERSION, TRACE_RECORD_DTYPE.itemsize)],
+                      dtype=BINARY_TRACE_HEADER)
+    bin_file = str(tmp_path / BINARY_TRACES_FILE_NAME)
+    with open(bin_file, "wb") as file:
+        file.write(header.tobytes() + records.tobytes())
+    # The same samples as sim.cc writes them in CSV
+    lines = [",".join(TRACE_COLUMNS)]
+    for record in records:
+        values = [repr(record[name].item()) for name in TRACE_COLUMNS[:-2]]
+        position = ":".join(repr(record[name].item()) for name in POSITION_COLUMNS)
+        system_time = time.strftime(SYSTEM_TIME_FORMAT, time.localtime(int(record["System Time"])))
+        lines.append(",".join(values + [position, system_time]))
+    csv_file = str(tmp_path / TRACES_FILE_NAME)
+    with open(csv_file, "w") as file:
+        file.write("\n".join(lines) + "\n")
+
+    csv_columns, csv_data, csv_text = read_trace_file(csv_file)
+    columns, data, text = read_trace_file(bin_file)
+    assert columns == csv_columns
+    np.testing.assert_array_equal(data, csv_data)
+    np.testing.assert_array_equal(text, csv_text)
+    # A partially written trailing record is ignored
+    with open(bin_file, "ab") as file:
+        file.write(records[:1].tobytes()[:TRACE_RECORD_DTYPE.itemsize // 2])
+    _, data, text = read_trace_file(bin_file)
+    np.testing.assert_array_equal(data, csv_data)
+    np.testing.assert_array_equal(text, csv_text)
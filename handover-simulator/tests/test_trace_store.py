@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+import pickle
+import numpy as np
+import pandas as pd
+
+from utils import DECISION_PARAMETER
+from trace_cube import load_trace_cube
+from trace_store import TraceStore
+from simulator_3gpp_batched import STACKED_COLUMNS, batch_size, simulate_users_batched
+
+from conftest import INTERVAL
+
+
+def test_batch_size_follows_the_memory_budget(make_traces):
+    cube = load_trace_cube(make_traces(np.full((3, 2, 10), -80.0)), 3, 2, INTERVAL, use_cache=False)
+    ue_bytes = STACKED_COLUMNS * 2 * 10 * 8
+    assert batch_size(TraceStore(cube)) == 1024
+    assert batch_size(TraceStore(cube, 2 * ue_bytes)) == 2
+    assert batch_size(TraceStore(cube, 1)) == 1
+    assert batch_size(cube.to_dataframes()) == 1024
+
+
+def test_batches_are_read_from_the_cube(make_traces):
+    rng = np.random.default_rng(5)
+    cube = load_trace_cube(make_traces(rng.normal(-85, 5, (5, 3, 20))), 5, 3, INTERVAL, use_cache=False)
+    store = TraceStore(cube, 1)
+    results = simulate_users_batched(5, store, cube.times, 2.0, 1.0, INTERVAL, INTERVAL, DECISION_PARAMETER, 2 * INTERVAL)
+    expected = simulate_users_batched(5, cube.to_dataframes(), cube.times, 2.0, 1.0, INTERVAL, INTERVAL,
+                                      DECISION_PARAMETER, 2 * INTERVAL)
+    # The batches of one UE are read from the cube, not paged in as DataFrames
+    assert store.loads == 0
+    for result, reference in zip(results, expected):
+        pd.testing.assert_frame_equal(result, reference, check_exact=True)
+
+
+def test_a_store_pickles_as_the_handle_of_the_trace_cache(make_traces):
+    rng = np.random.default_rng(9)
+    folder = make_traces(rng.normal(-85, 5, (4, 3, 20)))
+    cached = load_trace_cube(folder, 4, 3, INTERVAL)
+    assert cached.handle is not None
+    for cube in [cached, load_trace_cube(folder, 4, 3, INTERVAL, use_cache=False)]:
+        store = TraceStore(cube, 1 << 20)
+        store[2]
+        data = pickle.dumps(store)
+        # Only the handle is sent for a cached cube, its traces otherwise
+        assert (len(data) < 1024) == (cube.handle is not None)
+        copy = pickle.loads(data)
+        assert copy.memory_budget == store.memory_budget and not copy.cache
+        for ue in range(len(store)):
+            for result, expected in zip(copy[ue], store[ue]):
+                pd.testing.assert_frame_equal(result, expected, check_exact=True)
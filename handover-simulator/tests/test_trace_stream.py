@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from utils import DECISION_PARAMETER, compact_results
+from trace_cube import BINARY_TRACE_HEADER, BINARY_TRACE_MAGIC, BINARY_TRACE_VERSION, BINARY_TRACES_FILE_NAME, \
+    SYSTEM_TIME_FORMAT, TRACE_RECORD_DTYPE, TRACES_FILE_NAME, load_trace_cube, read_trace_file
+from trace_stream import StreamingTraceCube, TraceTail
+from simulator_common import create_worker_pool, simulate_stream_batches, simulate_users
+from simulator_3gpp import simulate_user
+from simulator_3gpp_batched import simulate_users_batched
+
+from conftest import INTERVAL, PACKET_SIZE
+
+A3_ARGS = (2.0, 1.0, INTERVAL, INTERVAL, DECISION_PARAMETER, 2 * INTERVAL, INTERVAL, None, PACKET_SIZE, None)
+
+
+def binary_trace(csv_file):
+    """The contents of the traces.bin of a CSV trace, the header and one record per row."""
+    columns, data, text = read_trace_file(csv_file)
+    metrics = [c for c in columns if c in TRACE_RECORD_DTYPE.names and c != "System Time"]
+    records = np.zeros(len(data), dtype=TRACE_RECORD_DTYPE)
+    for i, name in enumerate(metrics):
+        records[name] = data[:, i]
+    records["System Time"] = [time.mktime(time.strptime(t, SYSTEM_TIME_FORMAT)) for t in text[:, 0]]
+    header = np.array([(BINARY_TRACE_MAGIC, BINARY_TRACE_VERSION, TRACE_RECORD_DTYPE.itemsize)],
+                      dtype=BINARY_TRACE_HEADER)
+    return header.tobytes() + records.tobytes()
+
+
+def append(file_name, contents):
+    with open(file_name, "ab") as file:
+        file.write(contents)
+
+
+def tail_in_pieces(tail, file_name, contents, sizes):
+    """Append the contents to a trace in pieces of the given sizes and read the tail after every piece."""
+    parsed = []
+    start = 0
+    for size in sizes + [len(contents)]:
+        append(file_name, contents[start:start + size])
+        start += size
+        parsed.append(tail.read())
+    return parsed
+
+
+def concatenate(parsed):
+    parsed = [p for p in parsed if p is not None]
+    return parsed[0][0], np.concatenate([p[1] for p in parsed]), np.concatenate([p[2] for p in parsed])
+
+
+def test_tail_reads_the_complete_rows_of_a_csv_trace(make_traces, tmp_path):
+    source = os.path.join(make_traces(np.full((1, 1, 12), -80.0)), "0", "0", TRACES_FILE_NAME)
+    contents = open(source, "rb").read()
+    folder = str(tmp_path / "tail")
+    os.makedirs(folder)
+    tail = TraceTail(folder)
+    assert tail.read() is None
+    line = contents.index(b"\n") + 1
+    # Half of the header, the header and half of a row, then pieces that end inside the rows
+    parsed = tail_in_pieces(tail, os.path.join(folder, TRACES_FILE_NAME), contents, [line // 2, line, 150, 1, 400])
+    assert parsed[0] is None and parsed[1] is None and parsed[3] is None
+    columns, data, text = read_trace_file(source)
+    tailed = concatenate(parsed)
+    assert tailed[0] == columns
+    np.testing.assert_array_equal(tailed[1], data)
+    np.testing.assert_array_equal(tailed[2], text)
+
+
+def test_tail_reads_the_complete_records_of_a_binary_trace(make_traces, tmp_path):
+    source = os.path.join(make_traces(np.full((1, 1, 12), -80.0)), "0", "0", TRACES_FILE_NAME)
+    contents = binary_trace(source)
+    folder = str(tmp_path / "tail")
+    os.makedirs(folder)
+    tail = TraceTail(folder)
+    record = TRACE_RECORD_DTYPE.itemsize
+    header = BINARY_TRACE_HEADER.itemsize
+    parsed = tail_in_pieces(tail, os.path.join(folder, BINARY_TRACES_FILE_NAME), contents,
+                            [header - 3, 3 + record // 2, record, 1, 3 * record])
+    assert parsed[0] is None and parsed[1] is None and parsed[3] is None
+    assert len(parsed[2][1]) == 1
+    columns, data, text = read_trace_file(source)
+    tailed = concatenate(parsed)
+    assert tailed[0] == columns
+    np.testing.assert_array_equal(tailed[1], data)
+    np.testing.assert_array_equal(tailed[2], text)
+    # The file a trace is read from is the binary one, as in get_trace_files
+    assert tail.binary
+
+
+def stream_traces(folder, stream_folder, nUEs, nGnb, binary_ues=()):
+    """Copy the first half of every trace of a run to a streamed run, the traces of binary_ues as traces.bin.
+
+    Returns:
+        dict: The rest of every trace, by (UE, gNB).
+    """
+    rest = {}
+    for ue in range(nUEs):
+        for gnb in range(nGnb):
+            source = os.path.join(folder, str(ue), str(gnb), TRACES_FILE_NAME)
+            name = BINARY_TRACES_FILE_NAME if ue in binary_ues else TRACES_FILE_NAME
+            contents = binary_trace(source) if ue in binary_ues else open(source, "rb").read()
+            os.makedirs(os.path.join(stream_folder, str(ue), str(gnb)))
+            append(os.path.join(stream_folder, str(ue), str(gnb), name), contents[:len(contents) // 2])
+            rest[ue, gnb] = (os.path.join(stream_folder, str(ue), str(gnb), name), contents[len(contents) // 2:])
+    return rest
+
+
+def finish_ue(stream, rest, ue, nGnb):
+    for gnb in range(nGnb):
+        append(*rest[ue, gnb])
+        stream.mark_done(ue, gnb)
+
+
+def test_streamed_ues_match_the_replay(make_traces, tmp_path):
+    rng = np.random.default_rng(17)
+    nUEs, nGnb = 4, 3
+    folder = make_traces(rng.normal(-85, 6, (nUEs, nGnb, 40)).round(3))
+    cube = load_trace_cube(folder, nUEs, nGnb, INTERVAL, use_cache=False)
+    stream_folder = str(tmp_path / "stream")
+    rest = stream_traces(folder, stream_folder, nUEs, nGnb, binary_ues=(1, 2))
+    stream = StreamingTraceCube(stream_folder, nUEs, nGnb)
+    assert stream.poll() > 0
+    assert stream.wait_for_ues(range(nUEs), timeout=0.01) == []
+    # The UEs complete out of order
+    finish_ue(stream, rest, 2, nGnb)
+    finish_ue(stream, rest, 0, nGnb)
+    assert stream.wait_for_ues([1, 2, 3, 0]) == [2, 0]
+    assert not stream.ue_complete(1) and stream.ue_complete(2)
+    intervals = stream.intervals()
+    for ue in [3, 1]:
+        finish_ue(stream, rest, ue, nGnb)
+    assert stream.matches_grid(cube.times)
+    for ue in range(nUEs):
+        for result, expected in zip(stream.ue_dataframes(ue, INTERVAL), cube.ue_dataframes(ue)):
+            pd.testing.assert_frame_equal(result, expected, check_exact=True)
+    expected = [compact_results(simulate_user(ue, cube.to_dataframes(), cube.times, *A3_ARGS)) for ue in range(nUEs)]
+    with create_worker_pool(processes=2) as pool:
+        streamed = simulate_users(simulate_user, nUEs, None, intervals, A3_ARGS, stream, INTERVAL, pool)
+    for result, frame in zip(streamed, expected):
+        pd.testing.assert_frame_equal(compact_results(result), frame, check_exact=True)
+
+    def simulate_batch(ueDataframes):
+        return simulate_users_batched(len(ueDataframes), ueDataframes, intervals, *A3_ARGS[:6], INTERVAL)
+
+    batched = simulate_stream_batches(simulate_batch, nUEs, stream, INTERVAL)
+    for result, frame in zip(batched, simulate_batch(cube.to_dataframes())):
+        pd.testing.assert_frame_equal(compact_results(result), compact_results(frame), check_exact=True)
+
+
+def test_other_time_grids_do_not_match_the_replay(make_traces, tmp_path):
+    nUEs, nGnb = 2, 2
+    folder = make_traces(np.full((nUEs, nGnb, 10), -80.0))
+    # UE 1 reports one more tick than UE 0
+    file_name = os.path.join(folder, "1", "0", TRACES_FILE_NAME)
+    lines = open(file_name).read().splitlines()
+    append(file_name, (lines[-1].replace(repr(10 * INTERVAL), repr(11 * INTERVAL), 1) + "\n").encode())
+    cube = load_trace_cube(folder, nUEs, nGnb, INTERVAL, use_cache=False)
+    stream = StreamingTraceCube(str(tmp_path / "stream"), nUEs, nGnb)
+    rest = stream_traces(folder, stream.traces_sim_folder, nUEs, nGnb)
+    for ue in range(nUEs):
+        finish_ue(stream, rest, ue, nGnb)
+    assert not stream.matches_grid(cube.times)
+    assert len(stream.intervals()) == len(cube.times) - 1
+    assert not stream.matches_grid(cube.times)
+    np.testing.assert_array_equal(stream.to_trace_cube(INTERVAL).times, cube.times)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# encoding: UTF-8
+import pickle
+import numpy as np
+import pytest
+
+from utils import Scenario, get_datarate, scenario_bands
+
+DIMENSIONS = {"min_x": -100.0, "max_x": 100.0, "min_y": -50.0, "max_y": 50.0}
+# Band ids out of order, and a band that is neither FR1 nor FR2
+BANDS = [
+    {"Band_ID": 7, "Central_Frequency_Hz": 28e9, "User_Bandwidth_Hz": 100e6, "GNB_Bandwidth_Hz": 400e6},
+    {"Band_ID": 2, "Central_Frequency_Hz": 3.5e9, "User_Bandwidth_Hz": 20e6, "GNB_Bandwidth_Hz": 100e6},
+    {"Band_ID": 4, "Central_Frequency_Hz": 15e9, "User_Bandwidth_Hz": 30e6, "GNB_Bandwidth_Hz": 90e6},
+]
+
+
+def make_gnb(gnb_id, band_id):
+    return {"GNB_ID": gnb_id, "Position_X": 10.0 * gnb_id, "Position_Y": -5.0 * gnb_id, "Position_Z": 3.0 + gnb_id,
+            "Band_ID": band_id, "Transmission_Power_dBm": 20.0 + gnb_id, "Type": "I"}
+
+
+def test_scenario_arrays_match_the_parsed_gnbs(scenario):
+    gnbs = [make_gnb(gnb_id, band_id) for gnb_id, band_id in enumerate([2, 7, 4, 7, 2])]
+    for sc in [Scenario(DIMENSIONS, BANDS, gnbs), scenario]:
+        bands = {band["Band_ID"]: band for band in sc.bands}
+        for i, gnb in enumerate(sc.gnbs):
+            band = bands[gnb["Band_ID"]]
+            assert sc.bands[sc.band[i]] is band
+            np.testing.assert_array_equal(sc.position[i], [gnb["Position_X"], gnb["Position_Y"], gnb["Position_Z"]])
+            assert sc.tx_power[i] == gnb["Transmission_Power_dBm"]
+            assert sc.central_frequency[i] == band["Central_Frequency_Hz"]
+            assert sc.gnb_bandwidth[i] == band["GNB_Bandwidth_Hz"]
+            assert sc.user_bandwidth[i] == band["User_Bandwidth_Hz"]
+            assert sc.gnb_capacity[i] == get_datarate(band["GNB_Bandwidth_Hz"])
+            assert sc.user_capacity[i] == get_datarate(band["User_Bandwidth_Hz"])
+            assert sc.max_users[i] == int(band["GNB_Bandwidth_Hz"] // band["User_Bandwidth_Hz"])
+    assert scenario_bands(Scenario(DIMENSIONS, BANDS, gnbs)) == ["FR1", "FR2", "Unknown", "FR2", "FR1"]
+    assert scenario_bands(scenario) == ["FR2"] * 6 + ["FR1"] * 2
+
+
+def test_scenario_rejects_unknown_bands():
+    with pytest.raises(ValueError, match=r"\[1, 3\]"):
+        Scenario(DIMENSIONS, BANDS, [make_gnb(0, 2), make_gnb(1, 5), make_gnb(2, 7), make_gnb(3, 0)])
+
+
+def test_scenario_pickles(scenario):
+    copy = pickle.loads(pickle.dumps(scenario))
+    assert copy.scenario_dimensions == scenario.scenario_dimensions
+    assert copy.bands == scenario.bands and copy.gnbs == scenario.gnbs
+    for name in Scenario.__slots__[3:]:
+        np.testing.assert_array_equal(getattr(copy, name), getattr(scenario, name), err_msg=name)
@@ -31,6 +31,7 @@
 #include <ns3/vector.h>
 #include <ns3/waypoint.h>
 
+#include <algorithm>
 #include <cmath>
 #include <cstddef>
 #include <cstdint>
@@ -50,6 +51,9 @@
 using namespace ns3;
 
 #define FILE_NAME "traces.csv"
+#define BINARY_FILE_NAME "traces.bin"
+#define BINARY_TRACE_MAGIC "NRTRACE"
+#define BINARY_TRACE_VERSION 1
 
 std::vector<SimulationOutput> output;
 
@@ -70,6 +74,43 @@ create_file(std::ofstream* file, std::string file_name)
     }
 }
 
+void
+create_binary_file(std::ofstream* file, std::string file_name)
+{
+    file->open(file_name.c_str(), std::ios::out | std::ios::binary);
+    if (file->is_open())
+    {
+        char magic[8] = BINARY_TRACE_MAGIC;
+        uint32_t version = BINARY_TRACE_VERSION;
+        uint32_t recordSize = sizeof(TraceRecord);
+        file->write(magic, sizeof(magic));
+        file->write(reinterpret_cast<const char*>(&version), sizeof(version));
+        file->write(reinterpret_cast<const char*>(&recordSize), sizeof(recordSize));
+    }
+}
+
+void
+flush_trace_writer(BinaryTraceWriter* writer)
+{
+    if (!writer->buffer.empty())
+    {
+        writer->file->write(reinterpret_cast<const char*>(writer->buffer.data()),
+                            writer->buffer.size() * sizeof(TraceRecord));
+        writer->file->flush();
+        writer->buffer.clear();
+    }
+}
+
+void
+write_trace_record(BinaryTraceWriter* writer, const TraceRecord& record)
+{
+    writer->buffer.push_back(record);
+    if (writer->buffer.size() >= writer->flushThreshold)
+    {
+        flush_trace_writer(writer);
+    }
+}
+
 /**
  * @brief Closes an open ofstream object.
  *
@@ -444,6 +485,15 @@ MeasureFlowStats(Ptr<ns3::FlowMonitor> monitor, FlowStatsParams params)
         txPackets = i->second.txPackets;
 
         now = std::time(nullptr);
+        if (params.binaryWriter != nullptr)
+        {
+            TraceRecord record = {currentTime, txBytes, txPackets, rxBytes, rxPackets,
+                                  latencySum, latencyLast, jitterSum, lostPackets, distance,
+                                  rsrp, uePos.x, uePos.y, uePos.z, int64_t(now)};
+            write_trace_record(params.binaryWriter, record);
+            continue;
+        }
+
         localTime = std::localtime(&now);
         std::strftime(timeBuffer, sizeof(timeBuffer), "%Y-%m-%d %H:%M:%S", localTime);
 
@@ -545,7 +595,7 @@ BandwidthPartInfo::Scenario getScenario(const std::string& scenarioModel) {
 }
 
 int
-simulate_process(SimulationParameters params, std::ofstream* file)
+simulate_process(SimulationParameters params, std::ofstream* file, BinaryTraceWriter* binaryWriter)
 {
     enum BandwidthPartInfo::Scenario scenarioEnum;
     scenarioEnum = getScenario(params.scenario);
@@ -940,6 +990,7 @@ simulate_process(SimulationParameters params, std::ofstream* file)
     flowStats.gnbNetDev = enbNetDevPerBand[bandid];
     flowStats.movement = params.movement;
     flowStats.file = file;
+    flowStats.binaryWriter = binaryWriter;
     flowStats.isWaypointBasedMobility = params.isWaypointBasedMobility;
     flowStats.tolerance = params.tolerance;
     flowStats.lastWaypointIndex = params.lastWaypointIndex;
@@ -1000,6 +1051,8 @@ main(int argc, char* argv[])
     std::string path = ".";
     std::string scFile = "../handover-simulator/scenario/sc.txt";
     std::string wpFile = "";
+    std::string traceFormat = "csv";
+    uint32_t traceBuffer = 4096;
 
     CommandLine cmd(__FILE__);
     cmd.AddValue("path", "traces directory", path);
@@ -1031,6 +1084,10 @@ main(int argc, char* argv[])
     cmd.AddValue("sc", "Scenario definition file path", scFile);
     cmd.AddValue("wp", "Waypoints definition file path", wpFile);
     cmd.AddValue("tolerance", "The tolerance for the mobility simulation.", params.tolerance);
+    cmd.AddValue("traceFormat", "Trace output format: csv or bin", traceFormat);
+    cmd.AddValue("traceBuffer",
+                 "Number of records buffered before writing a binary trace.",
+                 traceBuffer);
 
     cmd.Parse(argc, argv);
     // Scenario file read----------
@@ -1048,7 +1105,24 @@ main(int argc, char* argv[])
         return -1;
     }
 
-    create_file(&traceFile, path + FILE_NAME);
+    BinaryTraceWriter binaryWriter;
+    binaryWriter.file = &traceFile;
+    binaryWriter.flushThreshold = std::max<uint32_t>(traceBuffer, 1);
+    binaryWriter.buffer.reserve(binaryWriter.flushThreshold);
+    bool binaryTrace = traceFormat == "bin";
+    if (binaryTrace)
+    {
+        create_binary_file(&traceFile, path + BINARY_FILE_NAME);
+    }
+    else if (traceFormat == "csv")
+    {
+        create_file(&traceFile, path + FILE_NAME);
+    }
+    else
+    {
+        std::cout << "invalid trace format " << traceFormat << std::endl;
+        return -1;
+    }
     if (wpFile != "")
     {
 
@@ -1070,7 +1144,11 @@ main(int argc, char* argv[])
     {
         params.isWaypointBasedMobility = false;
     }
-    simulate_process(params, &traceFile);
+    simulate_process(params, &traceFile, binaryTrace ? &binaryWriter : nullptr);
+    if (binaryTrace)
+    {
+        flush_trace_writer(&binaryWriter);
+    }
     close_file(&traceFile);
 
     return 0;
@@ -70,6 +70,34 @@ struct Movement {
 };
 
 
+// Fixed size record of the binary trace format, one per measurement. Every field is 8 bytes wide so
+// the struct has no padding and can be read back as a numpy structured array (see trace_cube.py)
+struct TraceRecord {
+    double time; // simulation time in seconds
+    uint64_t txBytes; // transmitted bytes
+    uint64_t txPackets; // transmitted packets
+    uint64_t rxBytes; // received bytes
+    uint64_t rxPackets; // received packets
+    double latencySum; // mean latency
+    double latencyLast; // last latency
+    double jitterSum; // mean jitter
+    uint64_t lostPackets; // lost packets
+    double distance; // UE to gNB distance
+    double rsrp; // Reference Signal Received Power
+    double posX; // UE position
+    double posY;
+    double posZ;
+    int64_t systemTime; // wall clock time, seconds since the epoch
+};
+static_assert(sizeof(TraceRecord) == 15 * 8, "TraceRecord must not be padded");
+
+// Buffered writer of binary trace records, the records are written in blocks of flushThreshold
+struct BinaryTraceWriter {
+    std::ofstream *file; // file
+    std::vector<TraceRecord> buffer; // records not written yet
+    size_t flushThreshold; // number of buffered records that triggers a write
+};
+
 // Flow statistics parameters
 struct FlowStatsParams {
     ns3::Ptr<ns3::Ipv4FlowClassifier> classifier; // flow classifier
@@ -82,7 +110,8 @@ struct FlowStatsParams {
     ns3::NetDeviceContainer ueNetDev; // UE network devices
     ns3::NetDeviceContainer gnbNetDev; // gNB network devices
     double tolerance; // tolerance
-    std::ofstream *file; // file
+    std::ofstream *file; // CSV trace file
+    BinaryTraceWriter *binaryWriter; // binary trace writer, used instead of file when set
     std::vector<WaypointStruct> wp; // Waypoints for the UE
     Movement movement;
     bool isWaypointBasedMobility;
@@ -213,7 +242,33 @@ void readScenario(std::string filename, std::vector<gnbStruct> *gnbs,
  * @param params The simulation parameters.
  * @return Returns an integer indicating the simulation status.
  */
-int simulate_process(SimulationParameters params);
+int simulate_process(SimulationParameters params, std::ofstream* file, BinaryTraceWriter* binaryWriter);
+
+/**
+ * @brief Creates a binary trace file and writes its header.
+ *
+ * The header is the magic string "NRTRACE" (8 bytes, NUL terminated), the format version and the
+ * record size, both as uint32. It is followed by TraceRecord structs in native byte order.
+ *
+ * @param file A pointer to the ofstream object to open.
+ * @param file_name The name of the file.
+ */
+void create_binary_file(std::ofstream* file, std::string file_name);
+
+/**
+ * @brief Appends a record to a binary trace writer, writing the buffer when it is full.
+ *
+ * @param writer A pointer to the binary trace writer.
+ * @param record The record to append.
+ */
+void write_trace_record(BinaryTraceWriter* writer, const TraceRecord& record);
+
+/**
+ * @brief Writes the buffered records of a binary trace writer to its file.
+ *
+ * @param writer A pointer to the binary trace writer.
+ */
+void flush_trace_writer(BinaryTraceWriter* writer);
 
 
 